@@ -0,0 +1,130 @@
+# USAGE:
+# python -m benchmarks.broadcast [--users N] [--groups N] [--chunk-sizes 30,60] [--timeouts 0.05,1.0]
+# For example, to compare two chunk sizes on 20k synthetic users:
+# python -m benchmarks.broadcast --users 20000 --chunk-sizes 20,30,60
+#
+# Runs BroadcastManager.broadcast and broadcast_to_groups against
+# FakeTelegramSession and reports achieved msg/s, loss and request latency tails.
+
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import time
+from typing import Dict, List
+
+# methods.admin creates a Bot at import time, which needs a well-formed token
+os.environ.setdefault("BOT_TOKEN", "42:BENCHMARK")
+
+from aiogram import Bot
+
+from benchmarks.fake_session import FakeTelegramSession
+from methods.admin import BroadcastManager, MessageContent, broadcast_to_groups
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def make_session(args) -> FakeTelegramSession:
+    return FakeTelegramSession(
+        latency_median=args.latency,
+        latency_sigma=args.sigma,
+        rate_limit=args.rate_limit,
+        retry_after=args.retry_after,
+        flood_probability=args.flood_probability,
+        forbidden_ratio=args.forbidden,
+        seed=args.seed,
+    )
+
+
+def report(name: str, session: FakeTelegramSession, status, recipients: List[int], elapsed: float) -> Dict:
+    expected_loss = sum(1 for chat_id in recipients if session.is_forbidden(chat_id))
+    row = {
+        "name": name,
+        "total": status.total,
+        "sent": status.sent,
+        "failed": status.failed,
+        "loss": status.failed / status.total if status.total else 0.0,
+        "unexpected_loss": max(0, status.failed - expected_loss),
+        "msg_s": status.sent / elapsed if elapsed else 0.0,
+        "elapsed": elapsed,
+        "p50": percentile(session.latencies, 50),
+        "p95": percentile(session.latencies, 95),
+        "p99": percentile(session.latencies, 99),
+        "flood": session.responses[429],
+    }
+    print(
+        f"{row['name']:<34} sent {row['sent']:>6}/{row['total']:<6} "
+        f"loss {row['loss']:6.2%} (unexpected {row['unexpected_loss']:>4}) "
+        f"{row['msg_s']:7.1f} msg/s  {row['elapsed']:7.1f} s  "
+        f"latency p50/p95/p99 {row['p50'] * 1000:.0f}/{row['p95'] * 1000:.0f}/{row['p99'] * 1000:.0f} ms  "
+        f"429s {row['flood']}"
+    )
+    return row
+
+
+async def bench_users(args, chunk_size: int, timeout: float) -> Dict:
+    session = make_session(args)
+    bot = Bot(token="42:BENCHMARK", session=session)
+    recipients = list(range(1_000_000, 1_000_000 + args.users))
+    manager = BroadcastManager(bot, chunk_size=chunk_size, timeout=timeout)
+
+    started = time.perf_counter()
+    status = await manager.broadcast(MessageContent("benchmark"), recipients)
+    elapsed = time.perf_counter() - started
+    return report(f"broadcast chunk={chunk_size} timeout={timeout}", session, status, recipients, elapsed)
+
+
+async def bench_groups(args) -> Dict:
+    session = make_session(args)
+    bot = Bot(token="42:BENCHMARK", session=session)
+    recipients = list(range(-1_001_000_000_000, -1_001_000_000_000 + args.groups))
+
+    started = time.perf_counter()
+    status = await broadcast_to_groups(
+        MessageContent("benchmark"),
+        recipients,
+        "pin_with_notification",
+        sender=bot,
+    )
+    elapsed = time.perf_counter() - started
+    return report("broadcast_to_groups", session, status, recipients, elapsed)
+
+
+async def main(args):
+    chunk_sizes = [int(value) for value in args.chunk_sizes.split(",")]
+    timeouts = [float(value) for value in args.timeouts.split(",")]
+
+    print(
+        f"{args.users} users, {args.groups} groups, server limit {args.rate_limit} req/s, "
+        f"latency median {args.latency * 1000:.0f} ms, forbidden {args.forbidden:.1%}"
+    )
+    for chunk_size, timeout in itertools.product(chunk_sizes, timeouts):
+        await bench_users(args, chunk_size, timeout)
+    if args.groups:
+        await bench_groups(args)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=10_000, help="Synthetic private chats")
+    ap.add_argument("--groups", type=int, default=200, help="Synthetic group chats (0 to skip)")
+    ap.add_argument("--chunk-sizes", default="30", help="Comma separated BroadcastManager chunk sizes")
+    ap.add_argument("--timeouts", default="0.05,1.0", help="Comma separated pauses between chunks, seconds")
+    ap.add_argument("--latency", type=float, default=0.08, help="Median request latency, seconds")
+    ap.add_argument("--sigma", type=float, default=0.5, help="Log-normal latency sigma")
+    ap.add_argument("--rate-limit", type=float, default=30.0, help="Simulated server limit, requests/s")
+    ap.add_argument("--retry-after", type=int, default=1, help="retry_after sent with 429 responses")
+    ap.add_argument("--flood-probability", type=float, default=0.0, help="Random 429 probability")
+    ap.add_argument("--forbidden", type=float, default=0.02, help="Share of chats that blocked the bot")
+    ap.add_argument("--seed", type=int, default=None)
+
+    # per-recipient send errors are expected here and would drown the report
+    logging.basicConfig(level=logging.CRITICAL)
+    asyncio.run(main(ap.parse_args()))
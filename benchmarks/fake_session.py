@@ -0,0 +1,138 @@
+"""
+Local stand-in for the Telegram Bot API.
+
+FakeTelegramSession plugs into aiogram's Bot(session=...) and answers every
+request locally with simulated latency, flood control (429 retry_after) and
+Forbidden errors, so broadcast code can be exercised without real users.
+"""
+
+import asyncio
+import json
+import math
+import random
+import time
+import zlib
+from collections import Counter
+from typing import Any, AsyncGenerator, Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+
+
+class FakeTelegramSession(BaseSession):
+    """
+    Simulated Bot API session.
+
+    Args:
+        latency_median (float): Median request latency in seconds.
+        latency_sigma (float): Sigma of the log-normal latency distribution.
+        rate_limit (float): Requests per second accepted before answering 429.
+        retry_after (int): retry_after value returned with 429 responses.
+        flood_probability (float): Probability of a random 429 below the rate limit.
+        forbidden_ratio (float): Share of chats that have blocked the bot.
+            The choice is deterministic per chat id, so retries stay consistent.
+        seed (int): Seed for the random generator.
+    """
+
+    def __init__(
+        self,
+        latency_median: float = 0.08,
+        latency_sigma: float = 0.5,
+        rate_limit: float = 30.0,
+        retry_after: int = 1,
+        flood_probability: float = 0.0,
+        forbidden_ratio: float = 0.02,
+        seed: Optional[int] = None,
+    ):
+        super().__init__()
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.flood_probability = flood_probability
+        self.forbidden_ratio = forbidden_ratio
+        self.random = random.Random(seed)
+
+        self.latencies: List[float] = []
+        self.responses: Counter = Counter()
+        self._message_id = 0
+        self._window_start = 0.0
+        self._window_count = 0
+
+    def is_forbidden(self, chat_id: int) -> bool:
+        bucket = zlib.crc32(str(chat_id).encode()) % 10_000
+        return bucket < self.forbidden_ratio * 10_000
+
+    def _rate_limited(self) -> bool:
+        now = time.monotonic()
+        if now - self._window_start >= 1.0:
+            self._window_start = now
+            self._window_count = 0
+        self._window_count += 1
+        if self._window_count > self.rate_limit:
+            return True
+        return self.random.random() < self.flood_probability
+
+    def _result(self, method: TelegramMethod[TelegramType]) -> Any:
+        if method.__returning__ is bool:
+            return True
+        chat_id = getattr(method, "chat_id", None) or 0
+        self._message_id += 1
+        return {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+        }
+
+    def _respond(self, method: TelegramMethod[TelegramType]) -> Tuple[int, Dict[str, Any]]:
+        chat_id = getattr(method, "chat_id", None)
+        if self._rate_limited():
+            return 429, {
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }
+        if chat_id is not None and self.is_forbidden(chat_id):
+            return 403, {
+                "ok": False,
+                "error_code": 403,
+                "description": "Forbidden: bot was blocked by the user",
+            }
+        return 200, {"ok": True, "result": self._result(method)}
+
+    async def make_request(
+        self,
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+        timeout: Optional[int] = None,
+    ) -> TelegramType:
+        started = time.perf_counter()
+        status_code, payload = self._respond(method)
+        delay = self.random.lognormvariate(math.log(self.latency_median), self.latency_sigma)
+        await asyncio.sleep(delay)
+        self.latencies.append(time.perf_counter() - started)
+        self.responses[status_code] += 1
+
+        response = self.check_response(
+            bot=bot,
+            method=method,
+            status_code=status_code,
+            content=json.dumps(payload),
+        )
+        return response.result
+
+    async def stream_content(
+        self,
+        url: str,
+        headers: Optional[Dict[str, Any]] = None,
+        timeout: int = 30,
+        chunk_size: int = 65536,
+        raise_for_status: bool = True,
+    ) -> AsyncGenerator[bytes, None]:
+        yield b""
+
+    async def close(self) -> None:
+        pass
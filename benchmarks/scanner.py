@@ -0,0 +1,244 @@
+# USAGE:
+# python -m benchmarks.scanner [-n N] [--input DIR] [--json OUT] [--baseline PREVIOUS.json]
+#                              [--line-detector NAME | --compare-line-detectors]
+# For example, to measure 30 generated 12 MP photos and compare with an earlier run:
+# python -m benchmarks.scanner -n 30 --json scan_bench.json --baseline scan_bench_main.json
+# To pick SCAN_LINE_DETECTOR, run every line detector available here on the same photos:
+# python -m benchmarks.scanner -n 30 --compare-line-detectors
+#
+# Times every DocScanner stage on synthetic photos (see benchmarks.synthetic_docs)
+# and measures how far the detected corners are from the true ones and how
+# well the answer marks are read. With --baseline the run fails if detection
+# got worse than in the earlier run.
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter, defaultdict
+from typing import Dict, Iterator, List, Tuple
+
+import cv2
+import numpy as np
+
+from benchmarks.synthetic_docs import generate, parse_size
+from config import OMR_AUTO_APPROVE_CONFIDENCE, SCAN_LINE_DETECTOR
+from methods import line_detectors, omr
+from methods.scan import DocScanner
+from pyimagesearch import imutils, transform
+
+STAGES = ["decode", "resize", "edges", "get_corners", "get_contour", "warp", "omr", "threshold", "encode", "scan_bytes"]
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    return float(np.percentile(values, q))
+
+
+def load_photos(args) -> Iterator[Tuple[str, bytes, np.ndarray, List]]:
+    """Yields (name, JPEG bytes, true corners, true answers) from --input or freshly generated photos."""
+    if args.input:
+        with open(os.path.join(args.input, "ground_truth.json"), encoding="utf-8") as f:
+            truth = json.load(f)
+        for name in sorted(truth)[:args.count]:
+            with open(os.path.join(args.input, name), "rb") as f:
+                yield name, f.read(), np.array(truth[name]["corners"], np.float32), truth[name]["answers"]
+    else:
+        for i, photo in enumerate(generate(args.count, args.seed, *args.size)):
+            yield f"synthetic_{i:04d}", photo.encode(), photo.corners, photo.answers
+
+
+def timed(timings: Dict[str, List[float]], stage: str, func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    timings[stage].append(time.perf_counter() - started)
+    return result
+
+
+def corner_error(detected: np.ndarray, truth: np.ndarray) -> float:
+    """Largest distance in pixels between matching corners of two quadrilaterals."""
+    detected = transform.order_points(np.asarray(detected, np.float32))
+    truth = transform.order_points(np.asarray(truth, np.float32))
+    return float(np.linalg.norm(detected - truth, axis=1).max())
+
+
+def bench_photo(scanner: DocScanner, data: bytes, truth: np.ndarray, answers: List,
+                timings: Dict[str, List[float]]) -> Dict:
+    image = timed(timings, "decode", cv2.imdecode, np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    rescaled = timed(timings, "resize", imutils.resize, image, None, int(scanner.rescaled_height))
+    edged = timed(timings, "edges", scanner.edge_map, rescaled)
+    corners = timed(timings, "get_corners", scanner.get_corners, edged)
+    contour = timed(timings, "get_contour", scanner.get_contour, rescaled)
+    stage = scanner.last_stage
+
+    ratio = image.shape[0] / scanner.rescaled_height
+    diagonal = float(np.hypot(*image.shape[:2]))
+    # accuracy of the line detector on its own, whichever stage won above
+    lines_error = 1.0
+    if len(corners) >= 4:
+        lines_error = corner_error(scanner.best_quad(corners).reshape(4, 2) * ratio, truth) / diagonal
+    warped = timed(timings, "warp", transform.four_point_transform, image, contour * ratio)
+    reading = timed(timings, "omr", omr.read_sheet, warped)
+    gray = cv2.cvtColor(warped, cv2.COLOR_BGR2GRAY)
+    thresh = timed(timings, "threshold", scanner.threshold, gray)
+    timed(timings, "encode", cv2.imencode, ".png", thresh)
+    timed(timings, "scan_bytes", scanner.scan_bytes, data)
+
+    error = corner_error(contour * ratio, truth)
+    # marks read wrong (blank or ambiguous questions only cost a review, not a wrong score)
+    wrong = sum(1 for given, expected in zip(reading.answers, answers) if given is not None and given != expected)
+    return {
+        "stage": stage, "error_px": error, "error_rel": error / diagonal, "lines_error_rel": lines_error,
+        "omr_confidence": reading.confidence, "omr_wrong": wrong,
+        "omr_unread": sum(1 for given in reading.answers if given is None) - answers.count(None),
+    }
+
+
+def summarize(records: List[Dict], timings: Dict[str, List[float]], tolerance: float, min_confidence: float) -> Dict:
+    errors = [record["error_px"] for record in records]
+    detected = [record for record in records if record["error_rel"] <= tolerance]
+    confident = [record for record in records if record["omr_confidence"] >= min_confidence]
+    return {
+        "photos": len(records),
+        "detection_rate": len(detected) / len(records) if records else 0.0,
+        # share of photos whose corners the line detector alone finds within tolerance
+        "lines_detection_rate": (
+            sum(1 for record in records if record["lines_error_rel"] <= tolerance) / len(records) if records else 0.0
+        ),
+        "corner_error_px": {
+            "mean": float(np.mean(errors)) if errors else 0.0,
+            "p50": percentile(errors, 50),
+            "p95": percentile(errors, 95),
+        },
+        "stages_won": dict(Counter(record["stage"] for record in records)),
+        "omr": {
+            "confident_rate": len(confident) / len(records) if records else 0.0,
+            # wrong marks on sheets that would skip the review: these must stay at zero
+            "confident_wrong": sum(record["omr_wrong"] for record in confident),
+            "confident_unread": sum(max(0, record["omr_unread"]) for record in confident),
+        },
+        "timings_ms": {
+            stage: {
+                "mean": float(np.mean(values)) * 1000,
+                "p50": percentile(values, 50) * 1000,
+                "p95": percentile(values, 95) * 1000,
+            }
+            for stage, values in timings.items()
+        },
+    }
+
+
+def print_summary(summary: Dict) -> None:
+    print(f"{'stage':<12} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9}")
+    for stage in STAGES:
+        row = summary["timings_ms"].get(stage)
+        if row:
+            print(f"{stage:<12} {row['mean']:9.1f} {row['p50']:9.1f} {row['p95']:9.1f}")
+    errors = summary["corner_error_px"]
+    print(
+        f"\ndetected {summary['detection_rate']:.1%} of {summary['photos']} photos, "
+        f"corner error mean/p50/p95 {errors['mean']:.1f}/{errors['p50']:.1f}/{errors['p95']:.1f} px"
+    )
+    print(f"line detector alone: {summary['lines_detection_rate']:.1%} detected")
+    print("winning stage: " + ", ".join(f"{stage} {count}" for stage, count in summary["stages_won"].items()))
+    reading = summary["omr"]
+    print(
+        f"omr: {reading['confident_rate']:.1%} of sheets confident, with {reading['confident_wrong']} wrong "
+        f"and {reading['confident_unread']} unread marks"
+    )
+
+
+def compare(summary: Dict, baseline: Dict, max_rate_drop: float, max_error_growth: float) -> List[str]:
+    """Returns the detection quality regressions of this run against the baseline run."""
+    problems = []
+    rate_drop = baseline["detection_rate"] - summary["detection_rate"]
+    if rate_drop > max_rate_drop:
+        problems.append(
+            f"detection rate fell from {baseline['detection_rate']:.1%} to {summary['detection_rate']:.1%}"
+        )
+    old_error = baseline["corner_error_px"]["p50"]
+    new_error = summary["corner_error_px"]["p50"]
+    if old_error and new_error > old_error * (1 + max_error_growth):
+        problems.append(f"median corner error grew from {old_error:.1f} to {new_error:.1f} px")
+    reading = summary.get("omr", {})
+    if reading.get("confident_wrong", 0) > baseline.get("omr", {}).get("confident_wrong", 0):
+        problems.append(f"{reading['confident_wrong']} marks read wrong on confident sheets")
+    return problems
+
+
+def print_comparison(summaries: Dict[str, Dict]) -> None:
+    print(f"{'detector':<12} {'corners ms':>10} {'lines only':>10} {'detected':>9} {'error p50':>10} {'scan p50 ms':>12}")
+    for name, summary in summaries.items():
+        timings = summary["timings_ms"]
+        print(
+            f"{name:<12} {timings['get_corners']['mean']:10.1f} {summary['lines_detection_rate']:10.1%} "
+            f"{summary['detection_rate']:9.1%} {summary['corner_error_px']['p50']:8.1f}px "
+            f"{timings['scan_bytes']['p50']:12.1f}"
+        )
+
+
+def run(photos, line_detector: str, args) -> Tuple[Dict, List[Dict]]:
+    scanner = DocScanner(preserve_quality=True, apply_filters=True, line_detector=line_detector)
+    timings: Dict[str, List[float]] = defaultdict(list)
+    records = []
+    for name, data, truth, answers in photos:
+        record = bench_photo(scanner, data, truth, answers, timings)
+        record["name"] = name
+        records.append(record)
+        if args.verbose:
+            print(
+                f"{name}: {record['stage']:<9} corner error {record['error_px']:.1f} px, "
+                f"omr confidence {record['omr_confidence']:.2f}, {record['omr_wrong']} wrong"
+            )
+    return summarize(records, timings, args.tolerance, args.omr_confidence), records
+
+
+def main(args) -> int:
+    if args.compare_line_detectors:
+        photos = list(load_photos(args))
+        summaries = {}
+        for name in line_detectors.available():
+            summaries[name], _ = run(photos, name, args)
+        print_comparison(summaries)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump({"line_detectors": summaries}, f, indent=2)
+        return 0
+
+    summary, records = run(load_photos(args), args.line_detector, args)
+    print_summary(summary)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(dict(summary, photos_detail=records), f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            problems = compare(summary, json.load(f), args.max_rate_drop, args.max_error_growth)
+        for problem in problems:
+            print(f"REGRESSION: {problem}", file=sys.stderr)
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-n", "--count", type=int, default=20, help="Number of photos")
+    ap.add_argument("--input", help="Directory written by benchmarks.synthetic_docs (default: generate in memory)")
+    ap.add_argument("--size", type=parse_size, default=(3000, 4000), help="Generated photo size, WIDTHxHEIGHT")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--tolerance", type=float, default=0.02,
+                    help="Largest corner error, as a share of the photo diagonal, still counted as detected")
+    ap.add_argument("--omr-confidence", type=float, default=OMR_AUTO_APPROVE_CONFIDENCE,
+                    help="OMR confidence from which a sheet counts as read without review")
+    ap.add_argument("--line-detector", choices=sorted(line_detectors.DETECTORS), default=SCAN_LINE_DETECTOR,
+                    help="Line segment detector used to find the page corners")
+    ap.add_argument("--compare-line-detectors", action="store_true",
+                    help="Run every line detector available here on the same photos and compare them")
+    ap.add_argument("--json", help="Write the summary and per-photo results to this file")
+    ap.add_argument("--baseline", help="Summary JSON of an earlier run to check for regressions")
+    ap.add_argument("--max-rate-drop", type=float, default=0.02, help="Allowed detection rate drop vs baseline")
+    ap.add_argument("--max-error-growth", type=float, default=0.25, help="Allowed median corner error growth vs baseline")
+    ap.add_argument("-v", "--verbose", action="store_true", help="Print every photo")
+    sys.exit(main(ap.parse_args()))
@@ -0,0 +1,180 @@
+# USAGE:
+# python -m benchmarks.synthetic_docs [-n N] [-o DIR] [--seed S] [--size 3000x4000]
+# For example, to write 50 photos and their ground truth to synthetic/:
+# python -m benchmarks.synthetic_docs -n 50 -o synthetic
+#
+# Renders answer sheets and "photographs" them: each sheet is warped onto a
+# cluttered background with a random homography, then lit unevenly, blurred,
+# noised and JPEG-compressed. The true corners of every sheet are known, so
+# scanner detection quality can be measured.
+
+import argparse
+import json
+import os
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# Answer sheet layout in sheet pixels (A4 at ~100 dpi)
+SHEET_SIZE = (827, 1169)
+OPTIONS = 5
+QUESTIONS_PER_COLUMN = 30
+
+
+@dataclass
+class SyntheticPhoto:
+    """A synthetic photo of an answer sheet with its ground truth."""
+    image: np.ndarray
+    corners: np.ndarray  # (4, 2) float32, top-left, top-right, bottom-right, bottom-left
+    answers: List[Optional[int]]  # marked option per question, None if left blank
+    jpeg_quality: int
+
+    def encode(self) -> bytes:
+        return cv2.imencode(".jpg", self.image, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])[1].tobytes()
+
+
+def render_sheet(rng: np.random.Generator, columns: int = 3) -> Tuple[np.ndarray, List[Optional[int]]]:
+    """Draws a white answer sheet with a header and a grid of bubbles, some of them filled."""
+    width, height = SHEET_SIZE
+    sheet = np.full((height, width, 3), 255, np.uint8)
+    cv2.rectangle(sheet, (30, 30), (width - 30, height - 30), (40, 40, 40), 2)
+    cv2.putText(sheet, "ORT ANSWER SHEET", (60, 90), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (20, 20, 20), 3)
+    for row in range(3):
+        y = 130 + row * 35
+        cv2.line(sheet, (60, y), (width - 60, y), (120, 120, 120), 1)
+
+    answers = []
+    column_width = (width - 120) // columns
+    for column in range(columns):
+        for question in range(QUESTIONS_PER_COLUMN):
+            x0 = 60 + column * column_width
+            y = 260 + question * 29
+            cv2.putText(sheet, str(column * QUESTIONS_PER_COLUMN + question + 1), (x0, y + 5),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.4, (60, 60, 60), 1)
+            marked = int(rng.integers(OPTIONS)) if rng.random() > 0.1 else None
+            answers.append(marked)
+            for option in range(OPTIONS):
+                center = (x0 + 40 + option * 33, y)
+                cv2.circle(sheet, center, 10, (70, 70, 70), 1, cv2.LINE_AA)
+                if option == marked:
+                    cv2.circle(sheet, center, 8, (30, 30, 30), -1, cv2.LINE_AA)
+    return sheet, answers
+
+
+def render_background(rng: np.random.Generator, width: int, height: int) -> np.ndarray:
+    """A desk-like background: a base color with texture and random clutter."""
+    base = rng.integers(40, 170, 3)
+    background = np.empty((height, width, 3), np.uint8)
+    background[:] = base
+    texture = rng.normal(0, 12, (height // 8 + 1, width // 8 + 1, 1)).astype(np.float32)
+    texture = cv2.resize(texture, (width, height), interpolation=cv2.INTER_CUBIC)[..., np.newaxis]
+    background = np.clip(background + texture, 0, 255).astype(np.uint8)
+
+    for _ in range(int(rng.integers(5, 20))):
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        kind = rng.integers(3)
+        p1 = (int(rng.integers(width)), int(rng.integers(height)))
+        p2 = (int(rng.integers(width)), int(rng.integers(height)))
+        if kind == 0:
+            cv2.rectangle(background, p1, p2, color, -1)
+        elif kind == 1:
+            cv2.line(background, p1, p2, color, int(rng.integers(2, 15)))
+        else:
+            cv2.circle(background, p1, int(rng.integers(20, min(width, height) // 6)), color, -1)
+    return background
+
+
+def random_quad(rng: np.random.Generator, width: int, height: int) -> np.ndarray:
+    """Corners of the sheet in the photo: a perspective-distorted page filling 35-80% of it."""
+    scale = rng.uniform(0.6, 0.9)
+    sheet_w, sheet_h = SHEET_SIZE
+    quad_h = height * scale
+    quad_w = quad_h * sheet_w / sheet_h
+    if quad_w > width * 0.9:
+        quad_w = width * 0.9
+        quad_h = quad_w * sheet_h / sheet_w
+    cx = width / 2 + rng.uniform(-0.5, 0.5) * (width - quad_w) * 0.8
+    cy = height / 2 + rng.uniform(-0.5, 0.5) * (height - quad_h) * 0.8
+    quad = np.array([
+        [cx - quad_w / 2, cy - quad_h / 2],
+        [cx + quad_w / 2, cy - quad_h / 2],
+        [cx + quad_w / 2, cy + quad_h / 2],
+        [cx - quad_w / 2, cy + quad_h / 2],
+    ], np.float32)
+
+    # rotate a little and move every corner independently for the perspective
+    angle = np.radians(rng.uniform(-12, 12))
+    rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]], np.float32)
+    quad = (quad - [cx, cy]) @ rotation.T + [cx, cy]
+    quad += rng.uniform(-0.06, 0.06, (4, 2)).astype(np.float32) * [quad_w, quad_h]
+    quad[:, 0] = np.clip(quad[:, 0], 2, width - 3)
+    quad[:, 1] = np.clip(quad[:, 1], 2, height - 3)
+    return quad.astype(np.float32)
+
+
+def apply_lighting(image: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """Uneven lighting: a linear gradient and a soft shadow or highlight."""
+    height, width = image.shape[:2]
+    ys, xs = np.mgrid[0:height, 0:width].astype(np.float32)
+    direction = rng.uniform(-1, 1, 2)
+    gradient = 1 + 0.25 * (direction[0] * (xs / width - 0.5) + direction[1] * (ys / height - 0.5))
+    spot = np.exp(-(((xs - rng.uniform(0, width)) ** 2 + (ys - rng.uniform(0, height)) ** 2)
+                    / (2 * (min(width, height) * 0.3) ** 2)))
+    light = gradient * (rng.uniform(0.7, 1.0) + rng.uniform(-0.25, 0.25) * spot)
+    return np.clip(image * light[..., np.newaxis], 0, 255).astype(np.uint8)
+
+
+def make_photo(rng: np.random.Generator, width: int = 3000, height: int = 4000) -> SyntheticPhoto:
+    sheet, answers = render_sheet(rng)
+    sheet_h, sheet_w = sheet.shape[:2]
+    corners = random_quad(rng, width, height)
+
+    source = np.array([[0, 0], [sheet_w - 1, 0], [sheet_w - 1, sheet_h - 1], [0, sheet_h - 1]], np.float32)
+    matrix = cv2.getPerspectiveTransform(source, corners)
+    image = render_background(rng, width, height)
+    warped = cv2.warpPerspective(sheet, matrix, (width, height), flags=cv2.INTER_LINEAR)
+    mask = cv2.warpPerspective(np.full((sheet_h, sheet_w), 255, np.uint8), matrix, (width, height))
+    image[mask > 127] = warped[mask > 127]
+    del warped, mask
+
+    image = apply_lighting(image, rng)
+    sigma = rng.uniform(0, 2.5)
+    if sigma > 0.3:
+        image = cv2.GaussianBlur(image, (0, 0), sigma)
+    noise = rng.normal(0, rng.uniform(0, 8), image.shape).astype(np.float32)
+    image = np.clip(image + noise, 0, 255).astype(np.uint8)
+    return SyntheticPhoto(image, corners, answers, int(rng.integers(70, 96)))
+
+
+def generate(count: int, seed: int = 0, width: int = 3000, height: int = 4000):
+    """Yields `count` reproducible synthetic photos."""
+    rng = np.random.default_rng(seed)
+    for _ in range(count):
+        yield make_photo(rng, width, height)
+
+
+def parse_size(value: str) -> Tuple[int, int]:
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-n", "--count", type=int, default=20, help="Number of photos")
+    ap.add_argument("-o", "--output", default="synthetic", help="Output directory")
+    ap.add_argument("--size", type=parse_size, default=(3000, 4000), help="Photo size, WIDTHxHEIGHT")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    truth = {}
+    for i, photo in enumerate(generate(args.count, args.seed, *args.size)):
+        name = f"sheet_{i:04d}.jpg"
+        with open(os.path.join(args.output, name), "wb") as f:
+            f.write(photo.encode())
+        truth[name] = {"corners": photo.corners.round(2).tolist(), "answers": photo.answers}
+    with open(os.path.join(args.output, "ground_truth.json"), "w", encoding="utf-8") as f:
+        json.dump(truth, f, indent=2)
+    print(f"Wrote {args.count} photos and ground_truth.json to {args.output}")
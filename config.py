@@ -51,6 +51,51 @@ DATA_FILE = 'schedule.json'
 SCANNER_WEBAPP_URL = "https://example.com/scanner"
 QUIZ_WEBAPP_BASE_URL = "https://hanbiike.github.io/ort-bot/"
 
+# Paced broadcast settings
+BROADCAST_JOBS_FILE = 'broadcast_jobs.json'
+BROADCAST_RECIPIENTS_DIR = 'broadcast_recipients'  # recipient list of each job, written once when it is created
+PACED_BROADCAST_MAX_RATE = 10  # messages per second when catching up
+PACED_BROADCAST_BUSY_RATE = 5  # incoming updates per second that count as busy
+PACED_BROADCAST_MAX_SLOWDOWN = 10  # max pacing slowdown factor under load
+
+# Activity tracking settings
+ACTIVITY_FLUSH_INTERVAL = 300  # seconds between last_seen writes to DATA_FILE
+
+# Usage metrics settings
+METRICS_HISTORY_FILE = 'metrics/usage_history.jsonl'  # one rolled-up record per day
+METRICS_TODAY_FILE = 'metrics/usage_today.json'  # snapshot of the current day
+METRICS_SNAPSHOT_INTERVAL = 60  # seconds
+
+# Background job scheduler settings
+SCHEDULER_STATE_FILE = 'scheduler_state.json'  # next-run times and job statistics
+SCHEDULER_MAX_RUNNING = 4  # jobs allowed to run at the same time
+
+# Daily backup export settings
+EXPORT_DIR = 'exports'  # baseline of the last delivered backup
+EXPORT_FULL_EVERY_DAYS = 7  # send a full snapshot instead of a delta this often
+
+# Document scanner worker pool settings
+SCAN_WORKERS = 0  # worker processes, 0 means one per CPU core
+SCAN_QUEUE_SIZE = 50  # scans allowed to wait for a free worker
+SCAN_PER_USER_LIMIT = 2  # scans one user may have queued or running
+SCAN_OUTPUT_FORMAT = 'png1'  # png, png1 (1-bit PNG), g4 (CCITT G4 TIFF), webp (lossless) or jpeg
+SCAN_JPEG_TARGET_BYTES = 300_000  # size budget of colour scans, sent as grayscale JPEG
+SCAN_QUALITY_GATE = True  # reject blurry, dark or too distant photos before scanning them
+SCAN_GLARE_GATE = False  # also reject glared photos; off, glare is only measured and counted (/scan_pool) until calibrated on real photos
+SCAN_LINE_DETECTOR = 'opencv_lsd'  # pylsd, opencv_lsd, fld (opencv-contrib) or hough; compare with benchmarks.scanner
+SCAN_CACHE_DIR = 'scan_cache'  # finished scans, so a photo sent again is not scanned again
+SCAN_CACHE_MAX_BYTES = 200 * 1024 * 1024  # least recently used scans are removed beyond this
+SCAN_CACHE_MEMORY_BYTES = 32 * 1024 * 1024  # most recently used scans also kept in memory
+
+# Answer sheet recognition (OMR) settings
+OMR_ANSWER_KEY_FILE = 'omr_answer_key.json'  # correct answers used to compute the score
+OMR_MIN_CONFIDENCE = 0.8  # below this the recognized score is not offered to the user
+OMR_LAYOUT_FILE = 'omr_layout.json'  # bubble grid measured on the real answer sheet, see methods.omr.load_layout
+# Approve profiles whose typed score matches the reading without the owner's
+# review; enable only with a calibrated OMR_LAYOUT_FILE and the ORT scale in the answer key
+OMR_AUTO_APPROVE = False
+OMR_AUTO_APPROVE_CONFIDENCE = 0.95  # matching scores above this skip the owner's review
+
 """
 Configuration settings for the ORT broadcaster system.
 """
@@ -58,6 +103,9 @@ Configuration settings for the ORT broadcaster system.
 # File paths and directories
 GRADES_FILE = "biology.json"
 TEMP_LATEX_DIR = Path("temp_latex")
+LATEX_CLASS_FILE = TEMP_LATEX_DIR / "stand.cls"  # linked into every render workspace
+LATEX_WORKSPACE_MAX_AGE = 24 * 3600  # render workspaces left by a crashed process are removed after this
+LATEX_FORMAT_DIR = TEMP_LATEX_DIR / "formats"  # precompiled stand.cls preamble, one .fmt per class version
 OUTPUT_DIR = Path("output")
 
 TASK_CREATION_INTERVAL = 300
@@ -73,6 +121,20 @@ LATEX_OPTIONS = [
 # Multiple compilation passes for better PDF generation
 LATEX_COMPILE_PASSES = 2
 
+# Compile with a format file holding the preamble of stand.cls (built with
+# mylatexformat on first use and whenever stand.cls changes) instead of
+# loading the class and its packages on every run
+LATEX_PRECOMPILED_FORMAT = True
+LATEX_FORMAT_BUILD_TIMEOUT = 180
+
+# pdflatex processes (methods.latex_pool)
+LATEX_WORKERS = 0  # compiles at once, 0 means one per CPU core
+LATEX_QUEUE_SIZE = 20  # compiles allowed to wait for a free slot
+LATEX_TIMEOUT = 60  # seconds; pdflatex is killed with everything it started after this
+LATEX_CACHE_DIR = 'render_cache'  # rendered tasks by document hash, so the same document is not compiled again
+LATEX_CACHE_MAX_BYTES = 100 * 1024 * 1024  # least recently used renders are removed beyond this
+LATEX_CACHE_MEMORY_BYTES = 0  # renders are copied into the job workspace from disk, no need to keep them in memory
+
 # PDF to PNG conversion settings
 DEFAULT_DPI = 300
 PNG_QUALITY = 95
@@ -5,6 +5,7 @@ This module handles the generation of mathematical tasks using OpenAI's API
 and converts them to both PDF and PNG formats for the ORT broadcaster system.
 """
 
+from pathlib import Path
 from typing import Optional, Dict, Any, List, Literal
 from openai import AsyncOpenAI
 from pydantic import BaseModel
@@ -12,6 +13,7 @@ import config
 from exercises.random_task_generator import TaskGenerator, TaskGeneratorError
 from exercises.latex import compile_latex, compile_latex_to_png, create_full_latex_document, LaTeXCompilationError
 from exercises.pdf_converter import convert_pdf_single_image, PDFConversionError
+from methods.render_cache import render_keys, restore_render, store_render
 
 
 class TaskGenerationError(Exception):
@@ -110,7 +112,8 @@ async def generate_task_images(
     subject: str,
     api_key: str,
     output_formats: List[str] = None,
-    dpi: int = None
+    dpi: int = None,
+    workspace: Optional[Path] = None
 ) -> Dict[str, Any]:
     """
     Generate mathematical tasks and export in specified formats.
@@ -119,9 +122,13 @@ async def generate_task_images(
         api_key (str): OpenAI API key
         output_formats (List[str]): List of formats to generate ('pdf', 'png')
         dpi (int): Resolution for PNG output
+        workspace (Optional[Path]): Directory of this render job (see exercises.latex.latex_workspace);
+            the returned file paths point into it
         
     Returns:
-        Dict[str, Any]: Results including file paths and task data
+        Dict[str, Any]: Results including file paths, their render cache
+            keys by format ("render_keys"), task data and the LaTeX document
+            ("full_document") once it was generated
         
     Raises:
         TaskGenerationError: If task generation fails
@@ -155,11 +162,15 @@ async def generate_task_images(
         result["task_topic"] = task["topic"]
 
         if task["type"] == "COMPARISON":
-            result.update(await _generate_comparison_task(subject=subject, api_client=api_client, task=task, output_formats=output_formats, dpi=dpi))
+            result.update(await _generate_comparison_task(subject=subject, api_client=api_client, task=task))
         elif task["type"] == "ABCDE":
-            result.update(await _generate_abcde_task(subject=subject, api_client=api_client, task=task, output_formats=output_formats, dpi=dpi))
+            result.update(await _generate_abcde_task(subject=subject, api_client=api_client, task=task))
         else:
             raise TaskGenerationError(f"Неподдерживаемый тип задачи: {task['type']}")
+
+        # the document is in result before it is compiled, so a failed render
+        # can be retried with render_task_images instead of a new task
+        result.update(await _render_task(result["full_document"], result["output_name"], output_formats, dpi, workspace))
             
     except (TaskGeneratorError, TaskGenerationError, LaTeXCompilationError) as e:
         result["error"] = str(e)
@@ -172,24 +183,59 @@ async def generate_task_images(
     return result
 
 
+async def render_task_images(
+    result: Dict[str, Any],
+    output_formats: List[str] = None,
+    dpi: int = None,
+    workspace: Optional[Path] = None
+) -> Dict[str, Any]:
+    """
+    Render a task generated before by generate_task_images again, e.g. when
+    sending it failed. The task and its document (and so the task number
+    in it) stay the same, so the files usually come from the render cache.
+    
+    Args:
+        result (Dict[str, Any]): Result of generate_task_images with a "full_document"
+        output_formats (List[str]): List of formats to generate ('pdf', 'png')
+        dpi (int): Resolution for PNG output
+        workspace (Optional[Path]): Directory of this render job; the returned file paths point into it
+        
+    Returns:
+        Dict[str, Any]: A copy of result with the new files
+    """
+    if output_formats is None:
+        output_formats = config.SUPPORTED_OUTPUT_FORMATS.copy()
+    if dpi is None:
+        dpi = config.DEFAULT_DPI
+
+    result = {**result, "files": {}, "success": False}
+    result.pop("error", None)
+    try:
+        result.update(await _render_task(result["full_document"], result["output_name"], output_formats, dpi, workspace))
+    except LaTeXCompilationError as e:
+        result["error"] = str(e)
+        print(f"❌ {e}")
+    except Exception as e:
+        error_msg = f"Неожиданная ошибка рендеринга задачи: {e}"
+        result["error"] = error_msg
+        print(f"❌ {error_msg}")
+    return result
+
+
 async def _generate_comparison_task(
     subject: str,
     api_client: TaskAPIClient,
-    task: Dict[str, Any],
-    output_formats: List[str],
-    dpi: int
+    task: Dict[str, Any]
 ) -> Dict[str, Any]:
     """
-    Generate a comparison task with specified output formats.
+    Generate a comparison task and its LaTeX document.
     
     Args:
         api_client (TaskAPIClient): API client instance
         task (Dict[str, Any]): Task configuration
-        output_formats (List[str]): Desired output formats
-        dpi (int): PNG resolution
         
     Returns:
-        Dict[str, Any]: Generation results
+        Dict[str, Any]: Task data and the document to render
     """
     # Generate task content
     parsed_data = await api_client.generate_comparison_task(task)
@@ -198,13 +244,10 @@ async def _generate_comparison_task(
     # Create full document
     full_document = create_full_latex_document(subject=subject, content=latex_content, task_type="COMPARISON")
 
-    # Generate outputs
-    files = await _generate_output_files(full_document, "comparison_task", output_formats, dpi)
-    
     return {
         "task_data": parsed_data.model_dump(),
-        "files": files,
-        "success": bool(files),
+        "full_document": full_document,
+        "output_name": "comparison_task",
         "latex_content": latex_content,
         "right_answer": parsed_data.correct_answer
     }
@@ -213,21 +256,17 @@ async def _generate_comparison_task(
 async def _generate_abcde_task(
     subject: str,
     api_client: TaskAPIClient,
-    task: Dict[str, Any],
-    output_formats: List[str],
-    dpi: int
+    task: Dict[str, Any]
 ) -> Dict[str, Any]:
     """
-    Generate an ABCDE multiple choice task with specified output formats.
+    Generate an ABCDE multiple choice task and its LaTeX document.
     
     Args:
         api_client (TaskAPIClient): API client instance
         task (Dict[str, Any]): Task configuration
-        output_formats (List[str]): Desired output formats
-        dpi (int): PNG resolution
         
     Returns:
-        Dict[str, Any]: Generation results
+        Dict[str, Any]: Task data and the document to render
     """
     # Generate task content
     parsed_data = await api_client.generate_abcde_task(task)
@@ -239,32 +278,48 @@ async def _generate_abcde_task(
     # Create full document
     full_document = create_full_latex_document(subject=subject, content=latex_content, task_type="ABCDE")
 
-    # Generate outputs
-    files = await _generate_output_files(full_document, "abcde_task", output_formats, dpi)
-    
     return {
         "task_data": parsed_data.model_dump(),
-        "files": files,
-        "success": bool(files),
+        "full_document": full_document,
+        "output_name": "abcde_task",
         "latex_content": latex_content,
         "right_answer": parsed_data.correct_answer
     }
 
 
+async def _render_task(
+    full_document: str,
+    output_name: str,
+    output_formats: List[str],
+    dpi: int,
+    workspace: Optional[Path] = None
+) -> Dict[str, Any]:
+    """Render a task document: its files, their render cache keys and whether any was made."""
+    files = await _generate_output_files(full_document, output_name, output_formats, dpi, workspace)
+    return {
+        "files": files,
+        "render_keys": render_keys(full_document, files, dpi),
+        "success": bool(files),
+    }
+
+
 async def _generate_output_files(
     full_document: str,
     output_name: str,
     output_formats: List[str],
-    dpi: int
+    dpi: int,
+    workspace: Optional[Path] = None
 ) -> Dict[str, str]:
     """
-    Generate output files in specified formats.
+    Generate output files in specified formats, or restore them from the
+    render cache when the same document was rendered before.
     
     Args:
         full_document (str): Complete LaTeX document
         output_name (str): Base name for output files
         output_formats (List[str]): Desired output formats
         dpi (int): PNG resolution
+        workspace (Optional[Path]): Directory to compile in; the shared temp directory if None
         
     Returns:
         Dict[str, str]: Mapping of format to file path
@@ -272,12 +327,18 @@ async def _generate_output_files(
     Raises:
         LaTeXCompilationError: If file generation fails
     """
+    temp_dir = workspace or config.get_temp_dir()
+
+    cached = restore_render(full_document, output_formats, dpi, temp_dir, output_name)
+    if cached is not None:
+        print(f"♻️ Взято из кэша рендеринга: {', '.join(cached)}")
+        return cached
+
     files = {}
-    temp_dir = config.get_temp_dir()
     
     # First, always compile to PDF
     try:
-        if await compile_latex(full_document, output_name):
+        if await compile_latex(full_document, output_name, workspace):
             pdf_path = str(temp_dir / f"{output_name}.pdf")
             
             if "pdf" in output_formats:
@@ -302,6 +363,7 @@ async def _generate_output_files(
         # Re-raise compilation errors
         raise
     
+    store_render(full_document, files, dpi)
     return files
 
 
@@ -2,17 +2,26 @@
 LaTeX compilation utilities for mathematical task generation.
 
 This module handles LaTeX document creation and compilation to PDF format,
-with optional PNG conversion through the pdf_converter module.
+with optional PNG conversion through the pdf_converter module. Every render
+job compiles in its own workspace (see latex_workspace), so jobs can run
+concurrently without overwriting each other's files. The preamble of
+stand.cls is precompiled into a format file (see get_latex_format), so a
+run only has to typeset the task itself.
 """
 
-import subprocess
+import hashlib
+import os
+import shutil
+import tempfile
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, AsyncIterator
 import asyncio
 import aiofiles
 import config
 import time
 import json
+from methods.latex_pool import latex_pool, LatexQueueFull
 
 # Import PDF conversion functionality
 try:
@@ -41,7 +50,188 @@ class LaTeXCompilationError(Exception):
     pass
 
 
-async def compile_latex(latex_content: str, output_name: str = "output") -> bool:
+# Один формат собирается за раз; версии класса, формат которых собрать не удалось
+_format_lock = asyncio.Lock()
+_failed_formats = set()
+
+
+def _link_class_file(workspace: Path) -> None:
+    """Делает stand.cls доступным в рабочей директории: ссылкой, а где ссылки недоступны - копией."""
+    target = workspace / config.LATEX_CLASS_FILE.name
+    try:
+        target.symlink_to(config.LATEX_CLASS_FILE.resolve())
+    except OSError:
+        # например, Windows без прав на создание символьных ссылок
+        shutil.copyfile(config.LATEX_CLASS_FILE, target)
+
+
+def _remove_stale_workspaces(root: Path) -> None:
+    """Удаляет рабочие директории, оставшиеся после аварийно завершенного процесса."""
+    cutoff = time.time() - config.LATEX_WORKSPACE_MAX_AGE
+    for path in root.iterdir():
+        try:
+            if path.is_dir() and path.stat().st_mtime < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass
+
+
+def create_workspace(prefix: str = "job") -> Path:
+    """
+    Создает уникальную рабочую директорию для одной задачи рендеринга.
+
+    Директория создается в temp_latex/jobs, класс stand.cls связывается
+    в нее ссылкой. Удалять директорию должен вызывающий код
+    (remove_workspace), проще всего - через latex_workspace.
+
+    Args:
+        prefix (str): Префикс имени директории (по умолчанию "job")
+
+    Returns:
+        Path: Путь к новой рабочей директории
+    """
+    root = config.get_temp_dir() / "jobs"
+    root.mkdir(parents=True, exist_ok=True)
+    _remove_stale_workspaces(root)
+    workspace = Path(tempfile.mkdtemp(prefix=f"{prefix}_", dir=root))
+    _link_class_file(workspace)
+    return workspace
+
+
+def remove_workspace(workspace: Path) -> None:
+    """Удаляет рабочую директорию вместе со всеми файлами компиляции."""
+    shutil.rmtree(workspace, ignore_errors=True)
+
+
+@asynccontextmanager
+async def latex_workspace(prefix: str = "job") -> AsyncIterator[Path]:
+    """
+    Асинхронный контекстный менеджер рабочей директории задачи рендеринга.
+
+    Директория гарантированно удаляется при выходе из блока, в том числе
+    при ошибке или отмене задачи, поэтому результаты (.pdf, .png) нужно
+    использовать внутри блока.
+
+    Args:
+        prefix (str): Префикс имени директории (по умолчанию "job")
+
+    Example:
+        >>> async with latex_workspace("abcde_task") as workspace:
+        ...     await compile_latex(document, "abcde_task", workspace=workspace)
+        ...     await bot.send_document(chat_id, FSInputFile(workspace / "abcde_task.pdf"))
+    """
+    workspace = create_workspace(prefix)
+    try:
+        yield workspace
+    finally:
+        remove_workspace(workspace)
+
+
+def _format_preamble() -> str:
+    """Преамбула, которую mylatexformat сохраняет в формат: все до \\endofdump."""
+    return (
+        f"\\documentclass{{{config.LATEX_DOCUMENT_CLASS}}}\n"
+        "\\csname endofdump\\endcsname\n"
+        "\\begin{document}\n\\end{document}\n"
+    )
+
+
+def _format_name() -> str:
+    """Имя формата текущей версии stand.cls, например stand-3f2a9c0d41be."""
+    digest = hashlib.sha256(config.LATEX_CLASS_FILE.read_bytes())
+    digest.update(_format_preamble().encode("utf-8"))
+    return f"{config.LATEX_DOCUMENT_CLASS}-{digest.hexdigest()[:12]}"
+
+
+async def build_latex_format() -> Optional[Path]:
+    """
+    Асинхронно собирает формат с преамбулой stand.cls (pdflatex -ini с mylatexformat).
+
+    Формат называется по хешу stand.cls, поэтому после изменения класса
+    собирается новый, а форматы прежних версий удаляются. Сборка идет во
+    временной директории, готовый .fmt переносится в LATEX_FORMAT_DIR
+    одной операцией.
+
+    Returns:
+        Optional[Path]: Путь к .fmt файлу, или None если собрать не удалось
+    """
+    name = _format_name()
+    format_dir = config.LATEX_FORMAT_DIR
+    format_dir.mkdir(parents=True, exist_ok=True)
+    format_file = format_dir / f"{name}.fmt"
+    if format_file.exists():
+        return format_file
+
+    build_dir = Path(tempfile.mkdtemp(prefix="build_", dir=format_dir))
+    try:
+        _link_class_file(build_dir)
+        (build_dir / "preamble.tex").write_text(_format_preamble(), encoding="utf-8")
+        cmd = [
+            config.LATEX_COMPILER, "-ini",
+            *config.LATEX_OPTIONS,
+            f"-jobname={name}",
+            f"&{config.LATEX_COMPILER}",
+            "mylatexformat.ltx",
+            "preamble.tex"
+        ]
+        print(f"🔄 Собираю формат LaTeX: {' '.join(cmd)}")
+        try:
+            result = await latex_pool.run(
+                cmd, cwd=build_dir.resolve(), timeout=config.LATEX_FORMAT_BUILD_TIMEOUT
+            )
+        except (FileNotFoundError, asyncio.TimeoutError, LatexQueueFull) as e:
+            print(f"⚠️ Не удалось собрать формат LaTeX: {e!r}")
+            return None
+
+        built = build_dir / f"{name}.fmt"
+        if result.returncode != 0 or not built.exists():
+            print(f"⚠️ Не удалось собрать формат LaTeX (код {result.returncode}):\n{result.stdout[-1000:]}")
+            return None
+        os.replace(built, format_file)
+        print(f"✅ Формат LaTeX собран: {format_file}")
+
+        # Форматы прежних версий класса больше не нужны
+        for old_file in format_dir.glob(f"{config.LATEX_DOCUMENT_CLASS}-*.fmt"):
+            if old_file != format_file:
+                try:
+                    old_file.unlink()
+                except OSError:
+                    pass
+        return format_file
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
+
+
+async def get_latex_format() -> Optional[str]:
+    """
+    Асинхронно возвращает имя формата с преамбулой stand.cls, собирая его при необходимости.
+
+    Returns:
+        Optional[str]: Имя формата для pdflatex "&имя", или None если
+            формат отключен (LATEX_PRECOMPILED_FORMAT) или не собирается -
+            тогда документ компилируется как обычно
+    """
+    if not config.LATEX_PRECOMPILED_FORMAT:
+        return None
+    try:
+        name = _format_name()
+    except OSError as e:
+        print(f"⚠️ Не удалось прочитать {config.LATEX_CLASS_FILE}: {e}")
+        return None
+    if name in _failed_formats:
+        return None
+    if (config.LATEX_FORMAT_DIR / f"{name}.fmt").exists():
+        return name
+
+    async with _format_lock:
+        format_file = await build_latex_format()
+    if format_file is None:
+        _failed_formats.add(name)
+        return None
+    return name
+
+
+async def compile_latex(latex_content: str, output_name: str = "output", workspace: Optional[Path] = None) -> bool:
     """
     Асинхронно компилирует LaTeX документ в PDF.
     
@@ -52,6 +242,8 @@ async def compile_latex(latex_content: str, output_name: str = "output") -> bool
     Args:
         latex_content (str): Содержимое LaTeX документа для компиляции
         output_name (str): Имя выходного файла без расширения (по умолчанию "output")
+        workspace (Optional[Path]): Рабочая директория задачи (см. latex_workspace);
+            без нее используется общая temp_latex, где параллельные задачи мешают друг другу
     
     Returns:
         bool: True если компиляция успешна, False иначе
@@ -64,8 +256,8 @@ async def compile_latex(latex_content: str, output_name: str = "output") -> bool
         >>> success = await compile_latex(content, "test_document")
         >>> print(success)  # True if compilation successful
     """
-    # Создаем временную директорию для компиляции
-    temp_dir = config.get_temp_dir()
+    # Компилируем в рабочей директории задачи, либо в общей временной директории
+    temp_dir = workspace or config.get_temp_dir()
     
     # Определяем пути к файлам (используем абсолютные пути для надежности)
     tex_file = temp_dir / f"{output_name}.tex"
@@ -91,9 +283,10 @@ async def compile_latex(latex_content: str, output_name: str = "output") -> bool
         
         print(f"📝 LaTeX файл создан: {tex_file} ({tex_file.stat().st_size} байт)")
         
-        # Получаем текущий event loop для выполнения subprocess в executor
-        loop = asyncio.get_event_loop()
-        
+        # Формат с уже загруженным stand.cls; pdflatex ищет его по TEXFORMATS
+        latex_format = await get_latex_format()
+        env = {**os.environ, "TEXFORMATS": f"{config.LATEX_FORMAT_DIR.resolve()}{os.pathsep}"}
+
         # Компилируем PDF несколько раз для корректного создания ссылок и референсов
         success = False
         for attempt in range(config.LATEX_COMPILE_PASSES):
@@ -104,36 +297,37 @@ async def compile_latex(latex_content: str, output_name: str = "output") -> bool
                 config.LATEX_COMPILER,
                 *config.LATEX_OPTIONS,
                 "-output-directory", str(temp_dir.resolve()),
+                *([f"&{latex_format}"] if latex_format else []),
                 str(tex_file.resolve())  # Абсолютный путь к .tex файлу
             ]
             
             print(f"   Команда: {' '.join(cmd)}")
             
-            # Запускаем компиляцию асинхронно в executor для избежания блокировки
-            result = await loop.run_in_executor(
-                None,
-                lambda: subprocess.run(
-                    cmd, 
-                    capture_output=True, 
-                    text=True,
-                    encoding='utf-8',
-                    errors='replace',
-                    timeout=60,  # 60 second timeout для предотвращения зависания
-                    cwd=str(temp_dir.resolve())  # Рабочая директория - temp_latex
-                )
+            # Компилируем в пуле процессов; по тайм-ауту (LATEX_TIMEOUT) pdflatex
+            # убивается вместе с дочерними процессами
+            result = await latex_pool.run(
+                cmd,
+                cwd=temp_dir.resolve(),  # Рабочая директория задачи, там же stand.cls
+                env=env
             )
             
             if result.returncode == 0:
+                # pdflatex завершился, значит PDF уже полностью записан
                 success = True
                 print(f"   ✅ Компиляция успешна на попытке {attempt + 1}")
-                # Даем время системе завершить запись файла
-                await asyncio.sleep(0.5)
                 break
             else:
                 print(f"   ⚠️ Ошибка на попытке {attempt + 1}")
                 print(f"   Return code: {result.returncode}")
                 print(f"   STDOUT: {result.stdout[:500]}...")  # First 500 chars
                 print(f"   STDERR: {result.stderr[:500]}...")  # First 500 chars
+
+                if latex_format:
+                    # Следующие попытки - без формата; формат, который не
+                    # подходит установленному pdflatex, удаляем, он пересоберется
+                    if "format file" in result.stdout:
+                        (config.LATEX_FORMAT_DIR / f"{latex_format}.fmt").unlink(missing_ok=True)
+                    latex_format = None
                 
                 if attempt == config.LATEX_COMPILE_PASSES - 1:  # Last attempt
                     error_msg = f"❌ {config.ERROR_MESSAGES['compilation_failed']}:\n"
@@ -170,6 +364,10 @@ async def compile_latex(latex_content: str, output_name: str = "output") -> bool
         error_msg = "Тайм-аут компиляции LaTeX"
         print(f"❌ {error_msg}")
         raise LaTeXCompilationError(error_msg)
+    except LatexQueueFull:
+        error_msg = "Очередь компиляции LaTeX переполнена"
+        print(f"❌ {error_msg}")
+        raise LaTeXCompilationError(error_msg)
     except FileNotFoundError as e:
         error_msg = f"{config.ERROR_MESSAGES['latex_missing']} - {e}"
         print(f"❌ {error_msg}")
@@ -183,7 +381,8 @@ async def compile_latex(latex_content: str, output_name: str = "output") -> bool
 async def compile_latex_to_png(
     latex_content: str, 
     output_name: str = "output",
-    dpi: int = None
+    dpi: int = None,
+    workspace: Optional[Path] = None
 ) -> Optional[str]:
     """
     Асинхронно компилирует LaTeX документ напрямую в PNG.
@@ -196,6 +395,7 @@ async def compile_latex_to_png(
         latex_content (str): Содержимое LaTeX документа
         output_name (str): Имя выходного файла без расширения
         dpi (int): Разрешение для PNG изображения (по умолчанию из config.DEFAULT_DPI)
+        workspace (Optional[Path]): Рабочая директория задачи (см. compile_latex)
     
     Returns:
         Optional[str]: Путь к PNG файлу если успешно, None иначе
@@ -218,13 +418,10 @@ async def compile_latex_to_png(
     
     # Сначала компилируем в PDF
     try:
-        if await compile_latex(latex_content, output_name):
-            temp_dir = config.get_temp_dir()
+        if await compile_latex(latex_content, output_name, workspace):
+            temp_dir = workspace or config.get_temp_dir()
             pdf_file = temp_dir / f"{output_name}.pdf"
             
-            # Ждем немного чтобы файл был полностью записан на диск
-            await asyncio.sleep(1)
-            
             # Проверяем что PDF файл существует и доступен
             if not pdf_file.exists():
                 raise LaTeXCompilationError("PDF файл не найден после компиляции")
@@ -271,7 +468,10 @@ def create_full_latex_document(subject: str, content: str, task_type: str) -> st
     document_options = config.LATEX_OPTIONS_MAP.get(task_type, "")
     counter = _load_counter()
 
+    # Все до \endofdump уже есть в формате (см. get_latex_format);
+    # без формата \csname делает из метки \relax
     document = f"""\\documentclass{{{config.LATEX_DOCUMENT_CLASS}}}
+\\csname endofdump\\endcsname
 {document_options}
 
 \\begin{{document}}
@@ -302,24 +502,16 @@ async def validate_latex_installation() -> bool:
         ...     print("LaTeX not found")
     """
     try:
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(
-            None,
-            lambda: subprocess.run(
-                [config.LATEX_COMPILER, "--version"], 
-                capture_output=True, 
-                text=True,
-                encoding='utf-8',
-                errors='replace',
-                timeout=10  # Quick timeout for version check
-            )
+        result = await latex_pool.run(
+            [config.LATEX_COMPILER, "--version"],
+            timeout=10  # Quick timeout for version check
         )
         return result.returncode == 0
-    except (FileNotFoundError, subprocess.TimeoutExpired):
+    except (FileNotFoundError, asyncio.TimeoutError, LatexQueueFull):
         return False
 
 
-async def get_compilation_log(output_name: str) -> Optional[str]:
+async def get_compilation_log(output_name: str, workspace: Optional[Path] = None) -> Optional[str]:
     """
     Асинхронно получает лог компиляции LaTeX для отладки.
     
@@ -328,6 +520,7 @@ async def get_compilation_log(output_name: str) -> Optional[str]:
     
     Args:
         output_name (str): Имя выходного файла (без расширения)
+        workspace (Optional[Path]): Рабочая директория задачи (см. compile_latex)
         
     Returns:
         Optional[str]: Содержимое лог файла если доступно, None иначе
@@ -337,7 +530,7 @@ async def get_compilation_log(output_name: str) -> Optional[str]:
         >>> if log_content:
         ...     print("Compilation errors found in log")
     """
-    temp_dir = config.get_temp_dir()
+    temp_dir = workspace or config.get_temp_dir()
     log_file = temp_dir / f"{output_name}.log"
     
     try:
@@ -347,7 +540,7 @@ async def get_compilation_log(output_name: str) -> Optional[str]:
         return None
 
 
-async def cleanup_temp_files(output_name: str, keep_pdf: bool = True) -> None:
+async def cleanup_temp_files(output_name: str, keep_pdf: bool = True, workspace: Optional[Path] = None) -> None:
     """
     Асинхронно очищает временные файлы после компиляции.
     
@@ -357,12 +550,13 @@ async def cleanup_temp_files(output_name: str, keep_pdf: bool = True) -> None:
     Args:
         output_name (str): Имя выходного файла (без расширения)
         keep_pdf (bool): Сохранить ли PDF файл (по умолчанию True)
+        workspace (Optional[Path]): Рабочая директория задачи (см. compile_latex)
         
     Example:
         >>> await cleanup_temp_files("my_document", keep_pdf=False)
         >>> # Removes all temporary files including PDF
     """
-    temp_dir = config.get_temp_dir()
+    temp_dir = workspace or config.get_temp_dir()
     
     # Список расширений временных файлов LaTeX
     temp_extensions = ['.aux', '.log', '.toc', '.out', '.fls', '.fdb_latexmk', '.synctex.gz']
@@ -378,4 +572,10 @@ async def cleanup_temp_files(output_name: str, keep_pdf: bool = True) -> None:
                 temp_file.unlink()
                 print(f"🗑️ Удален временный файл: {temp_file}")
             except OSError as e:
-                print(f"⚠️ Не удалось удалить {temp_file}: {e}")
\ No newline at end of file
+                print(f"⚠️ Не удалось удалить {temp_file}: {e}")
+
+
+if __name__ == "__main__":
+    # Сборка формата заранее, например при развертывании: python -m exercises.latex
+    format_file = asyncio.run(build_latex_format())
+    print(format_file or "❌ Формат не собран, документы будут компилироваться без него")
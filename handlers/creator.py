@@ -6,11 +6,17 @@ from typing import Dict
 from aiogram import Bot, Router
 from aiogram.types import FSInputFile
 
-from exercises.azure_api import generate_task_images
+from exercises.azure_api import generate_task_images, render_task_images
+from exercises.latex import latex_workspace
+from methods.render_cache import render_cache
+from methods.scheduler import scheduler, IntervalTrigger
 import config
 
 router = Router()
 
+# threads/logs.json is shared by all subjects, which are now rendered concurrently
+_log_threads_lock = asyncio.Lock()
+
 
 def _load_threads(subject: str) -> dict:
     """Загрузить JSON с thread_id для предмета."""
@@ -64,107 +70,127 @@ async def _get_or_create_thread(bot: Bot, subject: str, topic_name: str) -> int:
 
 async def _get_or_create_log_thread(bot: Bot, subject: str) -> int:
     """Получить или создать thread_id темы в LOGGING_GROUP для предмета."""
-    threads = _load_log_threads()
-    if subject in threads:
-        return threads[subject]
-
-    # Создаём тему с именем предмета в группе логов
-    topic = await bot.create_forum_topic(
-        chat_id=config.LOGGING_GROUP["chat_id"],
-        name=subject
+    async with _log_threads_lock:
+        threads = _load_log_threads()
+        if subject in threads:
+            return threads[subject]
+
+        # Создаём тему с именем предмета в группе логов
+        topic = await bot.create_forum_topic(
+            chat_id=config.LOGGING_GROUP["chat_id"],
+            name=subject
+        )
+        thread_id = topic.message_thread_id
+        threads[subject] = thread_id
+        _save_log_threads(threads)
+        return thread_id
+
+async def _send_generated_task(bot: Bot, subject: str, result: dict) -> None:
+    """Send a rendered task image (a generate_task_images result) followed by a poll to the right group/thread."""
+    # 📌 достаём данные задачи
+    meta = result.get("task_meta", {})
+    caption = meta if subject != "Аналогии" else ""
+    task_type = result.get("task_type")
+    task_data = result.get("task_data", {})
+    topic_name = result.get("task_topic")  # имя темы из result
+    latex_content = result.get("latex_content", "")  # LaTeX контент задачи
+    right_answer = task_data.get("correct_answer", "")
+
+    # 📌 получаем thread_id
+    thread_id = await _get_or_create_thread(bot, subject, topic_name) if subject != "Аналогии" else None
+
+    # 📌 отправляем картинку: уже загруженную в Telegram - по file_id, иначе файлом
+    png_key = result.get("render_keys", {}).get("png")
+    cached = render_cache.peek(png_key) if png_key else None
+    photo = cached.get("file_id") if cached else None
+    sent = await bot.send_photo(
+        chat_id=config.SUBJECT_GROUPS[subject],
+        message_thread_id=thread_id,
+        photo=photo or FSInputFile(result["files"]["png"]),
+        caption=caption if len(caption) <= 1024 else caption[:1000] + "...",
     )
-    thread_id = topic.message_thread_id
-    threads[subject] = thread_id
-    _save_log_threads(threads)
-    return thread_id
+    # дальше (и при повторной отправке того же рендера) картинка уходит по file_id
+    photo = sent.photo[-1].file_id
+    if png_key:
+        render_cache.set_file_id(png_key, photo)
+
+    # 📌 отправляем тот же файл в LOGGING_GROUP в теме, соответствующей предмету
+    log_thread_id = await _get_or_create_log_thread(bot, subject)
+    # Собираем caption для логов: latex_content + основной caption (если есть)
+
+    log_caption = (
+        f"<pre>{latex_content}</pre>\n{caption}\nПравильный ответ: {right_answer}"
+    ) if (latex_content or caption) else ""
+    if len(log_caption) > 1000:
+        await bot.send_photo(
+            chat_id=config.LOGGING_GROUP["chat_id"],
+            message_thread_id=log_thread_id,
+            photo=photo
+        )
+
+        await bot.send_message(
+            chat_id=config.LOGGING_GROUP["chat_id"],
+            message_thread_id=log_thread_id,
+            text=log_caption,
+            parse_mode="HTML"
+        )
+    else:
+        await bot.send_photo(
+            chat_id=config.LOGGING_GROUP["chat_id"],
+            message_thread_id=log_thread_id,
+            photo=photo,
+            caption=log_caption,
+            parse_mode="HTML"
+        )
+
+    # 📌 формируем poll
+    if task_type == "ABCDE":
+        options = ["А", "Б", "В", "Г", "Д"]
+        letter_map = {"А": 0, "Б": 1, "В": 2, "Г": 3, "Д": 4}
+    else:  # COMPARISON и другие
+        options = ["А", "Б", "В", "Г"]
+        letter_map = {"А": 0, "Б": 1, "В": 2, "Г": 3}
+
+    answer = task_data.get("correct_answer", "").upper()
+    if answer not in letter_map:
+        raise ValueError(f"Некорректный правильный ответ: {answer}")
+
+    correct = letter_map[answer]
+
+    await bot.send_poll(
+        chat_id=config.SUBJECT_GROUPS[subject],
+        message_thread_id=thread_id,
+        question="Выберите правильный ответ",
+        options=options,
+        type="quiz",
+        correct_option_id=correct,
+        is_anonymous=True,
+    )
+
 
 async def _send_task(bot: Bot, subject: str) -> None:
     """Generate a task image and send it followed by a poll to the right group/thread.
     Retries up to 3 times on exceptions.
     """
     max_attempts = 3
+    # the task is generated once: retries render (or take from the render
+    # cache) and send the same document, not a new task with the next number
+    result = None
     for attempt in range(1, max_attempts + 1):
         try:
-            result = await generate_task_images(
-                subject=subject, api_key=config.AZURE_OPENAI_API_KEY, output_formats=["png"]
-            )
-            if not result.get("success"):
-                logging.error("generate_task_images returned success=False for subject %s (attempt %d)", subject, attempt)
-                raise RuntimeError("Task generation failed")
-
-            # 📌 достаём данные задачи
-            meta = result.get("task_meta", {})
-            caption = meta if subject != "Аналогии" else ""
-            task_type = result.get("task_type")
-            task_data = result.get("task_data", {})
-            topic_name = result.get("task_topic")  # имя темы из result
-            latex_content = result.get("latex_content", "")  # LaTeX контент задачи
-            right_answer = task_data.get("correct_answer", "")
-
-            # 📌 получаем thread_id
-            thread_id = await _get_or_create_thread(bot, subject, topic_name) if subject != "Аналогии" else None
-
-            # 📌 отправляем картинку (создаём FSInputFile заново на каждой итерации)
-            photo = FSInputFile(result["files"]["png"])
-            await bot.send_photo(
-                chat_id=config.SUBJECT_GROUPS[subject],
-                message_thread_id=thread_id,
-                photo=photo,
-                caption=caption if len(caption) <= 1024 else caption[:1000] + "...",
-            )
-
-            # 📌 отправляем тот же файл в LOGGING_GROUP в теме, соответствующей предмету
-            log_thread_id = await _get_or_create_log_thread(bot, subject)
-            # Собираем caption для логов: latex_content + основной caption (если есть)
-
-            log_caption = (
-                f"<pre>{latex_content}</pre>\n{caption}\nПравильный ответ: {right_answer}"
-            ) if (latex_content or caption) else ""
-            if len(log_caption) > 1000:
-                await bot.send_photo(
-                    chat_id=config.LOGGING_GROUP["chat_id"],
-                    message_thread_id=log_thread_id,
-                    photo=photo
-                )
-
-                await bot.send_message(
-                    chat_id=config.LOGGING_GROUP["chat_id"],
-                    message_thread_id=log_thread_id,
-                    text=log_caption,
-                    parse_mode="HTML"
-                )
-            else:
-                await bot.send_photo(
-                    chat_id=config.LOGGING_GROUP["chat_id"],
-                    message_thread_id=log_thread_id,
-                    photo=photo,
-                    caption=log_caption,
-                    parse_mode="HTML"
-                )
-
-            # 📌 формируем poll
-            if task_type == "ABCDE":
-                options = ["А", "Б", "В", "Г", "Д"]
-                letter_map = {"А": 0, "Б": 1, "В": 2, "Г": 3, "Д": 4}
-            else:  # COMPARISON и другие
-                options = ["А", "Б", "В", "Г"]
-                letter_map = {"А": 0, "Б": 1, "В": 2, "Г": 3}
-
-            answer = task_data.get("correct_answer", "").upper()
-            if answer not in letter_map:
-                raise ValueError(f"Некорректный правильный ответ: {answer}")
-
-            correct = letter_map[answer]
-
-            await bot.send_poll(
-                chat_id=config.SUBJECT_GROUPS[subject],
-                message_thread_id=thread_id,
-                question="Выберите правильный ответ",
-                options=options,
-                type="quiz",
-                correct_option_id=correct,
-                is_anonymous=True,
-            )
+            # every attempt renders in a directory of its own, removed once the task is sent
+            async with latex_workspace("task") as workspace:
+                if result is None or "full_document" not in result:
+                    result = await generate_task_images(
+                        subject=subject, api_key=config.AZURE_OPENAI_API_KEY, output_formats=["png"],
+                        workspace=workspace
+                    )
+                else:
+                    result = await render_task_images(result, output_formats=["png"], workspace=workspace)
+                if not result.get("success"):
+                    logging.error("generate_task_images returned success=False for subject %s", subject)
+                    raise RuntimeError("Task generation failed")
+                await _send_generated_task(bot, subject, result)
 
             # Успех — выходим из функции
             return
@@ -179,17 +205,17 @@ async def _send_task(bot: Bot, subject: str) -> None:
                 return
 
 
-async def _periodic_sender(bot: Bot, interval: int) -> None:
-    """Send tasks for all subjects every interval seconds."""
-    subjects = config.SUBJECT_GROUPS.keys()
-    while True:
-        for subject in subjects:
-            await _send_task(bot, subject)
-        await asyncio.sleep(interval)
+async def _send_all_tasks(bot: Bot) -> None:
+    """Send one task for every subject, rendering the subjects concurrently."""
+    await asyncio.gather(*(_send_task(bot, subject) for subject in config.SUBJECT_GROUPS.keys()))
 
 
 @router.startup()
 async def _on_start(bot: Bot) -> None:
-    """Start the background task on bot startup."""
-    interval = config.TASK_CREATION_INTERVAL
-    asyncio.create_task(_periodic_sender(bot, interval))
+    """Register periodic task creation with the scheduler."""
+    scheduler.add_job(
+        "creator_tasks",
+        lambda: _send_all_tasks(bot),
+        IntervalTrigger(config.TASK_CREATION_INTERVAL),
+        jitter=30,
+    )
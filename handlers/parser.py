@@ -5,6 +5,7 @@ from bs4 import BeautifulSoup
 from aiogram import types, Router
 from aiogram.filters import Command
 from config import CHANNEL_ID
+from methods.scheduler import scheduler, IntervalTrigger
 
 BASE_URL = "https://edu.gov.kg/posts/"
 CHAT_ID = CHANNEL_ID
@@ -153,16 +154,19 @@ def save_state(state):
         json.dump(state, f)
 
 async def poll_news():
-    while True:
-        state = load_state()
-        last_id = state["last_id"]
-        news = await check_for_new_news(last_id)
-        for item in news:
-            msg = format_news_message(item)
-            await bot.send_message(CHAT_ID, msg, parse_mode="HTML", disable_web_page_preview=False)
-            state["last_id"] = item["id"]
-        save_state(state)
-        await asyncio.sleep(1800)  # Change: now polls every 30 minutes
+    state = load_state()
+    last_id = state["last_id"]
+    news = await check_for_new_news(last_id)
+    for item in news:
+        msg = format_news_message(item)
+        await bot.send_message(CHAT_ID, msg, parse_mode="HTML", disable_web_page_preview=False)
+        state["last_id"] = item["id"]
+    save_state(state)
+
+@router.startup()
+async def schedule_news(bot):
+    set_bot(bot)
+    scheduler.add_job("poll_news", poll_news, IntervalTrigger(1800), jitter=60)  # polls every 30 minutes
 
 @router.message(Command("start"))
 async def start_cmd(message: types.Message):
@@ -2,15 +2,24 @@ from aiogram import Router, F, types
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery, WebAppInfo, BufferedInputFile
 from methods.profiles import ProfileManager
-from methods.scan import DocScanner
+from methods.scan_pool import scan_bytes_async, scan_sheet_async, bundle_pdf_async, scan_filename, ScanQueueFull, \
+    ScanUserLimit
+from methods import scan_encoders
+from methods.scan_quality import PhotoQualityError
+from methods.shared_buffers import SharedBuffer, download
+from methods.omr import OmrResult, load_answer_key, summarize
+from methods.scan_cache import scan_cache, photo_key, content_key
 from methods.users import user_lang
+from methods.metrics import usage_metrics
 from methods.validators import validate_score
 from keyboards import menu
-from config import OWNER_ID, MAX_SCORE, SCANNER_WEBAPP_URL
+from typing import List, Optional
+from config import OWNER_ID, MAX_SCORE, SCANNER_WEBAPP_URL, OMR_MIN_CONFIDENCE, OMR_AUTO_APPROVE, \
+    OMR_AUTO_APPROVE_CONFIDENCE
 import json
-import base64
 from io import BytesIO
 
 router = Router()
@@ -58,6 +67,10 @@ MESSAGES = {
         "ru": "Введите ваш балл ОРТ (от 0 до 245):",
         "kg": "ЖРТ баллыңызды жазыңыз (0дон 245ге чейин):"
     },
+    "enter_score_prefilled": {
+        "ru": "🔎 По листу ответов ваш балл: {score}. Нажмите на него, чтобы подтвердить, или введите другой балл (от 0 до 245):",
+        "kg": "🔎 Жооп барагы боюнча баллыңыз: {score}. Ырастоо үчүн аны басыңыз же башка баллды жазыңыз (0дон 245ге чейин):"
+    },
     "invalid_score": {
         "ru": "❌ Неверный формат балла. Введите число от 0 до 245.",
         "kg": "❌ Туура эмес балл. 0дон 245ге чейинки санды жазыңыз."
@@ -78,6 +91,10 @@ MESSAGES = {
         "ru": "✅ Фото получено. Отправьте следующее или напишите 'Готово'.",
         "kg": "✅ Сүрөт алынды. Кийинкисин жөнөтүңүз же 'Бүттү' деп жазыңыз."
     },
+    "profile_auto_approved": {
+        "ru": "✅ Балл совпал с листом ответов, профиль подтвержден.",
+        "kg": "✅ Балл жооп барагына дал келди, профиль тастыкталды."
+    },
     "photo_received": {
         "ru": "✅ Фото отправлено на проверку.",
         "kg": "✅ Сүрөт текшерүүгө жөнөтүлдү."
@@ -90,6 +107,30 @@ MESSAGES = {
         "ru": "❌ Произошла ошибка. Попробуйте позже.",
         "kg": "❌ Ката кетти. Кийинчерээк кайталаңыз."
     },
+    "scan_busy": {
+        "ru": "⏳ Сейчас обрабатывается много фото. Отправьте это фото ещё раз через минуту.",
+        "kg": "⏳ Азыр көп сүрөт иштетилүүдө. Бул сүрөттү бир мүнөттөн кийин кайра жөнөтүңүз."
+    },
+    "photo_rejected": {
+        "ru": "📷 Это фото не получится проверить:\n{problems}\n\nПереснимите лист и отправьте фото ещё раз.",
+        "kg": "📷 Бул сүрөттү текшерүүгө болбойт:\n{problems}\n\nБаракты кайра тартып, сүрөттү дагы бир жолу жөнөтүңүз."
+    },
+    "photo_blurry": {
+        "ru": "• фото размыто — держите телефон неподвижно и дождитесь фокуса",
+        "kg": "• сүрөт бүдөмүк — телефонду кыймылдатпай, фокусту күтүңүз"
+    },
+    "photo_glare": {
+        "ru": "• на листе блики — уберите вспышку или прямой свет",
+        "kg": "• баракта жарык чагылышы бар — жарк этмени же түз жарыкты алып салыңыз"
+    },
+    "photo_dark": {
+        "ru": "• слишком темно — снимайте при хорошем освещении",
+        "kg": "• өтө караңгы — жакшы жарыкта тартыңыз"
+    },
+    "photo_small_page": {
+        "ru": "• лист слишком далеко — он должен занимать большую часть кадра",
+        "kg": "• барак өтө алыс — ал кадрдын көпчүлүк бөлүгүн ээлеши керек"
+    },
     "approve": {
         "ru": "✅ Подтвердить",
         "kg": "✅ Тастыктоо"
@@ -123,6 +164,97 @@ MESSAGES = {
 def get_message(key: str, lang: str) -> str:
     return MESSAGES.get(key, {}).get(lang, "Message not found")
 
+def format_omr(omr: dict) -> str:
+    """One line about an answer sheet reading for the owner."""
+    if omr.get("score") is None:
+        result = "ключ ответов не задан"
+    else:
+        result = f"верных {omr['correct']}, балл {omr['score']}"
+    text = f"🔎 OMR: {result}, уверенность {omr['confidence']:.0%}"
+    if omr["ambiguous"]:
+        text += f", неясные вопросы: {', '.join(map(str, omr['ambiguous'][:10]))}"
+    return text
+
+def photo_rejected_text(error: PhotoQualityError, lang: str) -> str:
+    problems = "\n".join(get_message(f"photo_{problem}", lang) for problem in error.quality.problems)
+    return get_message("photo_rejected", lang).format(problems=problems)
+
+def scan_caption(user: types.User) -> str:
+    return f"📄 Скан от <a href='tg://user?id={user.id}'>{user.full_name}</a>"
+
+async def send_scan(bot, key: str, caption: str, data: Optional[bytes] = None) -> None:
+    """
+    Sends a scan to the owner. A scan that was uploaded before is sent by its
+    file_id; otherwise data (or the cached output) is uploaded and the new
+    file_id is remembered in the scan cache. Raises LookupError when the
+    scan is neither given nor cached any more.
+    """
+    entry = scan_cache.peek(key) or {}
+    if entry.get("file_id"):
+        try:
+            await bot.send_document(OWNER_ID, entry["file_id"], caption=caption, parse_mode="HTML")
+            return
+        except TelegramBadRequest:
+            # e.g. the file is no longer available to the bot; upload it again
+            pass
+    if data is None:
+        data = scan_cache.read(key)
+        if data is None:
+            raise LookupError(f"Scan {key} is no longer in the cache")
+    sent = await bot.send_document(
+        OWNER_ID,
+        BufferedInputFile(data, filename=entry.get("filename", scan_filename())),
+        caption=caption,
+        parse_mode="HTML"
+    )
+    scan_cache.set_file_id(key, sent.document.file_id)
+
+async def send_sheets(message: types.Message, keys: List[str], omr: Optional[dict]) -> None:
+    """
+    Sends the scans of one submission to the owner: several pages as a single
+    PDF assembled in the scan pool, a single page as its scan document. When
+    the pool is busy, bundling fails or Pillow is missing, every page is sent
+    on its own.
+    """
+    caption = scan_caption(message.from_user)
+    if omr:
+        caption += "\n" + format_omr(omr)
+    requested = len(keys)
+    pages = [page for page in map(scan_cache.read, keys) if page is not None]
+    # entries whose output is gone were dropped from the cache by read()
+    keys = [key for key in keys if scan_cache.peek(key) is not None]
+    if len(keys) < requested:
+        print(f"Scans of user {message.from_user.id} are no longer in the cache: "
+              f"{requested - len(keys)} of {requested} pages not sent")
+    if not pages:
+        return
+    pdf = None
+    if len(pages) > 1 and scan_encoders.PIL_AVAILABLE:
+        try:
+            pdf = await bundle_pdf_async(pages, user_id=message.from_user.id)
+        except (ScanQueueFull, ScanUserLimit):
+            pass
+        except Exception as e:
+            # a page the encoder cannot read, a crashed worker (BrokenProcessPool), ...
+            print(f"Error bundling scans into a PDF, sending them one by one: {e!r}")
+    if pdf is None:
+        for key in keys:
+            await send_scan(message.bot, key, caption)
+        return
+    await message.bot.send_document(
+        OWNER_ID,
+        BufferedInputFile(pdf, filename="scans.pdf"),
+        caption=caption.replace("📄 Скан от", f"📄 Сканы ({len(pages)} стр.) от", 1),
+        parse_mode="HTML"
+    )
+    usage_metrics.incr("events", "sheet_bundles")
+
+def recognized_score(omr: dict, min_confidence: float):
+    """The score read from the answer sheet if the reading is reliable enough, else None."""
+    if omr and omr.get("score") is not None and omr["confidence"] >= min_confidence:
+        return omr["score"]
+    return None
+
 async def get_profile_keyboard(lang: str) -> types.ReplyKeyboardMarkup:
     return types.ReplyKeyboardMarkup(
         keyboard=[[
@@ -195,6 +327,7 @@ async def update_profile_start(message: types.Message, state: FSMContext):
     await message.answer(
         get_message("send_result_sheet", lang)
     )
+    await state.update_data(omr=None, sheets=[])
     await state.set_state(ProfileStates.waiting_for_sheet)
 
 DONE_WORDS = ["готово", "бүттү"]
@@ -204,31 +337,45 @@ DONE_WORDS = ["готово", "бүттү"]
 async def process_result_sheet(message: types.Message, state: FSMContext):
     lang = await user_lang(message.from_user.id)
     try:
-        file_id = None
-        if message.photo:
-            file_id = message.photo[-1].file_id
-        elif message.document:
-            file_id = message.document.file_id
-        if not file_id:
+        sheet = message.photo[-1] if message.photo else message.document
+        if not sheet:
             return
-        file = await message.bot.get_file(file_id)
-        file_bytes = await message.bot.download_file(file.file_path)
-        image_bytes = file_bytes.read()
-
-        # High quality black and white scan with filters
-        scanner = DocScanner(preserve_quality=True, apply_filters=True)
-        processed = scanner.scan_bytes(image_bytes)
-        caption = (
-            f"📄 Скан от <a href='tg://user?id={message.from_user.id}'>"
-            f"{message.from_user.full_name}</a>"
-        )
-        await message.bot.send_document(
-            OWNER_ID, 
-            BufferedInputFile(processed, filename="scan.png"), 
-            caption=caption, 
-            parse_mode="HTML"
-        )
+
+        # a photo sent again is served from the cache, without downloading or scanning it
+        key = photo_key(sheet.file_unique_id)
+        # an entry whose output file is gone is a miss and is scanned again
+        cached = scan_cache.get(key)
+        stored = True
+        if cached is not None and "omr" in cached:
+            reading = OmrResult(**cached["omr"])
+            usage_metrics.incr("events", "scan_cache_hits")
+        else:
+            file = await message.bot.get_file(sheet.file_id)
+            # downloaded straight into shared memory, where the scan worker reads it in place
+            with await download(message.bot, file, sheet.file_size) as photo:
+                # High quality black and white scan with filters, and the marks read from the sheet
+                processed, reading = await scan_sheet_async(photo, user_id=message.from_user.id)
+            usage_metrics.incr("events", "scans")
+            stored = scan_cache.put(key, processed, filename=scan_filename(), omr=reading.to_dict())
+            if not stored:
+                # too large to wait in the cache for the rest of the submission
+                await send_scan(message.bot, key, scan_caption(message.from_user), processed)
+        omr = summarize(reading, load_answer_key())
+        user_data = await state.get_data()
+        # of several photos, keep the most reliable reading for the profile
+        previous = user_data.get("omr")
+        if previous is None or omr["confidence"] > previous["confidence"]:
+            await state.update_data(omr=omr)
+        # the scans are sent to the owner together once the upload is finished
+        sheets = user_data.get("sheets") or []
+        if stored and key not in sheets:
+            await state.update_data(sheets=sheets + [key])
         await message.answer(get_message("sheet_received", lang))
+    except (ScanQueueFull, ScanUserLimit):
+        await message.answer(get_message("scan_busy", lang))
+    except PhotoQualityError as e:
+        usage_metrics.incr("events", "photos_rejected")
+        await message.answer(photo_rejected_text(e, lang))
     except Exception as e:
         print(f"Error processing sheet: {e}")
         await message.answer(get_message("error_occurred", lang))
@@ -237,6 +384,12 @@ async def process_result_sheet(message: types.Message, state: FSMContext):
 @router.message(ProfileStates.waiting_for_sheet, F.text.casefold().in_(DONE_WORDS))
 async def finish_sheet_upload(message: types.Message, state: FSMContext):
     lang = await user_lang(message.from_user.id)
+    user_data = await state.get_data()
+    try:
+        await send_sheets(message, user_data.get("sheets") or [], user_data.get("omr"))
+    except Exception as e:
+        print(f"Error sending sheets: {e}")
+    await state.update_data(sheets=[])
     await message.answer(get_message("enter_full_name", lang))
     await state.set_state(ProfileStates.waiting_for_name)
 
@@ -244,10 +397,20 @@ async def finish_sheet_upload(message: types.Message, state: FSMContext):
 async def process_name(message: types.Message, state: FSMContext):
     await state.update_data(full_name=message.text)
     lang = await user_lang(message.from_user.id)
-    
-    await message.answer(
-        get_message("enter_score", lang)
-    )
+
+    score = recognized_score((await state.get_data()).get("omr"), OMR_MIN_CONFIDENCE)
+    if score is not None:
+        await message.answer(
+            get_message("enter_score_prefilled", lang).format(score=score),
+            reply_markup=types.ReplyKeyboardMarkup(
+                keyboard=[[types.KeyboardButton(text=str(score))]],
+                resize_keyboard=True
+            )
+        )
+    else:
+        await message.answer(
+            get_message("enter_score", lang)
+        )
     await state.set_state(ProfileStates.waiting_for_score)
 
 @router.message(ProfileStates.waiting_for_score)
@@ -263,12 +426,31 @@ async def process_score(message: types.Message, state: FSMContext):
             await state.clear()
             return
             
+        omr = user_data.get('omr')
         await profile_manager.add_pending_profile(
             message.from_user.id,
             user_data['full_name'],
-            score
+            score,
+            omr=omr
         )
-        
+
+        # a score confirmed by a reliable sheet reading needs no review, once
+        # OMR is calibrated on the real sheet and trusted (OMR_AUTO_APPROVE)
+        username = message.from_user.username or message.from_user.full_name
+        if OMR_AUTO_APPROVE and score == recognized_score(omr, OMR_AUTO_APPROVE_CONFIDENCE):
+            await profile_manager.approve_profile(message.from_user.id)
+            await message.answer(
+                get_message("profile_auto_approved", lang),
+                reply_markup=await get_profile_keyboard(lang)
+            )
+            await message.bot.send_message(
+                OWNER_ID,
+                f"✅ Профиль @{username} ({user_data['full_name']}, {score}) "
+                f"подтвержден автоматически\n" + format_omr(omr)
+            )
+            await state.clear()
+            return
+
         await message.answer(
             get_message("profile_submitted", lang),
             reply_markup=await get_profile_keyboard(lang)
@@ -285,14 +467,16 @@ async def process_score(message: types.Message, state: FSMContext):
             )
         ]])
         
-        username = message.from_user.username or message.from_user.full_name
+        text = get_message("new_profile_admin", lang).format(
+            user=f"@{username}",
+            name=user_data['full_name'],
+            score=score
+        )
+        if omr:
+            text += "\n" + format_omr(omr)
         await message.bot.send_message(
             OWNER_ID,
-            get_message("new_profile_admin", lang).format(
-                user=f"@{username}",
-                name=user_data['full_name'],
-                score=score
-            ),
+            text,
             parse_mode="HTML",
             reply_markup=markup
         )
@@ -397,21 +581,21 @@ async def handle_scan(message: types.Message):
         if "image" in data:
             image_data = data.get("image")
             if image_data:
-                header, b64 = image_data.split(",", 1)
-                image_bytes = base64.b64decode(b64)
-                # High quality black and white scan with filters
-                scanner = DocScanner(preserve_quality=True, apply_filters=True)
-                processed = scanner.scan_bytes(image_bytes)
-                caption = (
-                    f"📄 Скан от <a href='tg://user?id={message.from_user.id}'>"
-                    f"{message.from_user.full_name}</a>"
-                )
-                await message.bot.send_document(
-                    OWNER_ID,
-                    BufferedInputFile(processed, filename="scan.png"),
-                    caption=caption,
-                    parse_mode="HTML"
-                )
+                # the data URL is decoded straight into shared memory, where the
+                # scan worker reads it in place
+                with SharedBuffer.from_base64(image_data, image_data.index(",") + 1) as photo:
+                    with photo.view() as view:
+                        key = content_key(view)
+                    # an entry whose output file is gone counts as a miss and is scanned again
+                    processed = scan_cache.read(key) if scan_cache.get(key) is not None else None
+                    if processed is not None:
+                        usage_metrics.incr("events", "scan_cache_hits")
+                    else:
+                        # High quality black and white scan with filters
+                        processed = await scan_bytes_async(photo, user_id=message.from_user.id)
+                        usage_metrics.incr("events", "scans")
+                        scan_cache.put(key, processed, filename=scan_filename())
+                await send_scan(message.bot, key, scan_caption(message.from_user), processed)
                 await message.answer(
                     get_message("photo_received", lang),
                     reply_markup=await get_profile_keyboard(lang)
@@ -431,6 +615,11 @@ async def handle_scan(message: types.Message):
             )
             return
         await message.answer(get_message("error_occurred", lang))
+    except (ScanQueueFull, ScanUserLimit):
+        await message.answer(get_message("scan_busy", lang))
+    except PhotoQualityError as e:
+        usage_metrics.incr("events", "photos_rejected")
+        await message.answer(photo_rejected_text(e, lang))
     except Exception as e:
         print(f"Error processing webapp data: {e}")
         await message.answer(get_message("error_occurred", lang))
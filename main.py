@@ -5,11 +5,12 @@ import asyncio
 import logging
 from aiogram import Bot, Dispatcher
 from handlers import start, calc, profiles, parser, file_id, tests, creator, tiktok
-from methods import admin, users
+from methods import admin, users, activity, metrics, scheduler, scan_pool, latex_pool
 from keyboards import menu
 from config import BOT_TOKEN
-from handlers.parser import poll_news, set_bot
-from methods.admin import start_daily_scheduler
+from methods.traffic import TrafficMiddleware
+from methods.activity import ActivityMiddleware
+from methods.metrics import HandlerMetricsMiddleware
 
 # Ensure aiofiles is installed
 try:
@@ -35,8 +36,11 @@ async def main():
     starts background tasks, and begins polling for messages.
     """
     bot = Bot(token=BOT_TOKEN)
-    #set_bot(bot)
     dp = Dispatcher()
+    dp.update.outer_middleware(TrafficMiddleware())
+    dp.update.outer_middleware(ActivityMiddleware())
+    dp.message.middleware(HandlerMetricsMiddleware())
+    dp.callback_query.middleware(HandlerMetricsMiddleware())
     
     # Include all routers
     dp.include_routers(
@@ -44,6 +48,11 @@ async def main():
         menu.router,
         admin.router,
         users.router,
+        activity.router,
+        metrics.router,
+        scheduler.router,
+        scan_pool.router,
+        latex_pool.router,
         calc.router,
         profiles.router,
         tests.router,
@@ -53,15 +62,8 @@ async def main():
         #tiktok.router
     )
     
-    # Start background tasks
+    # Background jobs are registered by the routers on startup and run by the scheduler
     try:
-        # Start daily schedule reporter
-        scheduler_task = start_daily_scheduler(bot)
-        logger.info("Daily scheduler started successfully")
-        
-        # Schedule poll_news as a background task (when enabled)
-        #asyncio.create_task(poll_news())
-        
         # Start polling
         logger.info("Starting bot polling...")
         await dp.start_polling(bot)
@@ -71,14 +73,6 @@ async def main():
     except Exception as e:
         logger.error(f"Error in main function: {e}")
         raise
-    finally:
-        # Clean up tasks
-        if 'scheduler_task' in locals():
-            scheduler_task.cancel()
-            try:
-                await scheduler_task
-            except asyncio.CancelledError:
-                logger.info("Daily scheduler task cancelled successfully")
 
 if __name__ == "__main__":
     asyncio.run(main())
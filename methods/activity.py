@@ -0,0 +1,115 @@
+import datetime
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Router, F, types
+from aiogram.types import TelegramObject, User
+
+from config import ACTIVITY_FLUSH_INTERVAL
+from methods.metrics import usage_metrics
+from methods.scheduler import scheduler, IntervalTrigger
+from methods.users import get_user_index, read_data, write_data
+
+logger = logging.getLogger(__name__)
+
+router = Router()
+
+
+class ActivityTracker:
+    """
+    Stamps last_seen and blocked flags for known users in memory and
+    persists them in batches, so tracking costs a dict assignment per update.
+    """
+
+    def __init__(self):
+        self._pending_seen: Dict[int, str] = {}
+        self._pending_blocked: Dict[int, bool] = {}
+
+    def seen(self, user_id: int, when: datetime.datetime = None) -> None:
+        when = when or datetime.datetime.now()
+        if get_user_index().touch(user_id, when):
+            self._pending_seen[user_id] = when.isoformat()
+
+    def set_blocked(self, user_id: int, blocked: bool, persist: bool = True) -> None:
+        """
+        Mark a user as having blocked (or unblocked) the bot. With persist=False
+        the flag is written with the next batch, which suits bulk sends.
+        """
+        index = get_user_index()
+        if user_id not in index:
+            return
+        index.set_blocked(user_id, blocked, pending=True)
+        self._pending_blocked[user_id] = blocked
+        if persist:
+            self.flush()
+
+    def flush(self) -> int:
+        """Write pending stamps to the user store. Returns the number of users written."""
+        if not self._pending_seen and not self._pending_blocked:
+            return 0
+        seen, self._pending_seen = self._pending_seen, {}
+        blocked, self._pending_blocked = self._pending_blocked, {}
+        data = read_data()
+        written = set()
+        for user_id, last_seen in seen.items():
+            user = data.get(str(user_id))
+            if user:
+                user['last_seen'] = last_seen
+                written.add(user_id)
+        for user_id, is_blocked in blocked.items():
+            user = data.get(str(user_id))
+            if user:
+                user['blocked'] = int(is_blocked)
+                written.add(user_id)
+        write_data(data)
+        get_user_index().clear_pending(blocked)
+        return len(written)
+
+
+activity_tracker = ActivityTracker()
+
+
+class ActivityMiddleware(BaseMiddleware):
+    """Outer update middleware that stamps last_seen for the sender and counts the update."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        usage_metrics.incr("events", "updates")
+        chat = data.get("event_chat")
+        if chat:
+            usage_metrics.incr("chat_types", chat.type)
+        user: User = data.get("event_from_user")
+        if user and not user.is_bot:
+            activity_tracker.seen(user.id)
+            index = get_user_index()
+            if user.id in index:
+                usage_metrics.incr("langs", index.lang_of(user.id))
+        return await handler(event, data)
+
+
+@router.my_chat_member(F.chat.type == "private")
+async def track_block_status(update: types.ChatMemberUpdated):
+    status = update.new_chat_member.status
+    if status == "kicked":
+        activity_tracker.set_blocked(update.chat.id, True)
+        logger.info(f"User {update.chat.id} blocked the bot")
+    elif status == "member":
+        activity_tracker.set_blocked(update.chat.id, False)
+
+
+async def _flush() -> None:
+    activity_tracker.flush()
+
+
+@router.startup()
+async def _on_start() -> None:
+    scheduler.add_job("activity_flush", _flush, IntervalTrigger(ACTIVITY_FLUSH_INTERVAL))
+
+
+@router.shutdown()
+async def _on_shutdown() -> None:
+    activity_tracker.flush()
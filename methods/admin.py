@@ -3,20 +3,26 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from aiogram.exceptions import TelegramRetryAfter
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError
 from aiogram.filters import Command
 from dataclasses import dataclass
 from typing import Union, List, Dict, Optional, AsyncGenerator, Callable
 import asyncio
-import json
 import logging
 import time
 import os
-from datetime import datetime, timedelta
+from datetime import datetime
 
 # Constants
-from config import API_TOKEN, GROUPS_FILE, HAN_ID
+from config import API_TOKEN, GROUPS_FILE, HAN_ID, DATA_FILE
 from methods.admins import is_admin, add_admin, remove_admin, get_all_admins
+from methods.audience import AudienceFilter, STATUS_PAID, STATUS_TRIAL, STATUS_NONE, LANG_TITLES
+from methods.users import get_user_index, get_statistics, read_data
+from methods import paced_broadcast
+from methods.activity import activity_tracker
+from methods.export import export_chain, KIND_FULL
+from methods.metrics import usage_metrics
+from methods.scheduler import scheduler, CronTrigger, MISFIRE_RUN_ONCE
 
 logger = logging.getLogger(__name__)
 
@@ -29,38 +35,52 @@ class BroadcastStatus:
     end_time: Optional[datetime] = None
 
 class BroadcastManager:
-    def __init__(self, bot: Bot, chunk_size: int = 30, timeout: float = 0.05):
+    def __init__(self, bot: Bot, chunk_size: int = 30, timeout: float = 0.05, max_retries: int = 3):
         self.bot = bot
         self.chunk_size = chunk_size
         self.timeout = timeout
+        self.max_retries = max_retries
         self.status = BroadcastStatus()
 
     async def _split_messages(self, user_ids: List[int]) -> AsyncGenerator[List[int], None]:
         for i in range(0, len(user_ids), self.chunk_size):
             yield user_ids[i:i + self.chunk_size]
 
+    async def _send_chunk(self, message_content: 'MessageContent', chunk: List[int]):
+        """Send a chunk concurrently. Returns ids hit by flood control and the wait they need."""
+        tasks = [message_content.send(self.bot, uid) for uid in chunk]
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+        retry_ids, retry_after = [], 0
+        for uid, result in zip(chunk, results):
+            if isinstance(result, TelegramRetryAfter):
+                retry_ids.append(uid)
+                retry_after = max(retry_after, result.retry_after)
+            elif isinstance(result, Exception) or result is False:
+                self.status.failed += 1
+            else:
+                self.status.sent += 1
+        return retry_ids, retry_after
+
     async def broadcast(self, message_content: 'MessageContent', user_ids: List[int], 
                        progress_callback=None) -> BroadcastStatus:
         self.status = BroadcastStatus(total=len(user_ids), start_time=datetime.now())
 
         async for chunk in self._split_messages(user_ids):
-            try:
-                tasks = [message_content.send(self.bot, uid) for uid in chunk]
-                results = await asyncio.gather(*tasks, return_exceptions=True)
-                
-                for result in results:
-                    if isinstance(result, Exception):
-                        self.status.failed += 1
-                    else:
-                        self.status.sent += 1
+            attempt = 0
+            while chunk:
+                chunk, retry_after = await self._send_chunk(message_content, chunk)
+                if chunk:
+                    attempt += 1
+                    if attempt > self.max_retries:
+                        self.status.failed += len(chunk)
+                        break
+                    await asyncio.sleep(retry_after)
 
-                if progress_callback:
-                    await progress_callback(self.status)
+            if progress_callback:
+                await progress_callback(self.status)
 
-                await asyncio.sleep(self.timeout)
-
-            except TelegramRetryAfter as e:
-                await asyncio.sleep(e.retry_after)
+            await asyncio.sleep(self.timeout)
 
         self.status.end_time = datetime.now()
         return self.status
@@ -70,33 +90,80 @@ class MessageContent:
         self.content = content
         self.is_photo = isinstance(content, dict) and 'photo' in content
 
-    async def send(self, bot: Bot, chat_id: int) -> bool:
+    async def send(self, bot: Bot, chat_id: int) -> Union[types.Message, bool]:
+        """
+        Send the content to a chat. Returns the sent message, or False on failure.
+        Flood control errors are re-raised so the caller can retry after the delay.
+        """
         try:
             if self.is_photo:
-                await bot.send_photo(
+                return await bot.send_photo(
                     chat_id,
                     self.content['photo'],
                     caption=self.content.get('caption', ''),
                     parse_mode='HTML'
                 )
             else:
-                await bot.send_message(
+                return await bot.send_message(
                     chat_id, 
                     self.content,
                     parse_mode='HTML'
                 )
-            return True
+        except TelegramRetryAfter:
+            raise
+        except TelegramForbiddenError as e:
+            logger.error(f"Error sending to {chat_id}: {e}")
+            if chat_id > 0:
+                activity_tracker.set_blocked(chat_id, True, persist=False)
+            return False
         except Exception as e:
             logger.error(f"Error sending to {chat_id}: {e}")
             return False
 
-async def broadcast_to_groups(content: MessageContent, group_ids: List[int], pin_option: str, progress_callback=None) -> BroadcastStatus:
+class LocalizedContent:
+    """Sends each recipient the variant of the message for their language."""
+
+    def __init__(self, default: MessageContent, variants: Dict[str, MessageContent],
+                 lang_of: Callable[[int], str]):
+        self.default = default
+        self.variants = variants
+        self.lang_of = lang_of
+
+    async def send(self, bot: Bot, chat_id: int) -> Union[types.Message, bool]:
+        content = self.variants.get(self.lang_of(chat_id), self.default)
+        return await content.send(bot, chat_id)
+
+def build_content(data: Dict) -> Union[MessageContent, LocalizedContent]:
+    """Build broadcast content from FSM data, with per-language variants if any."""
+    default = MessageContent(data.get('content'))
+    variants = data.get('variants') or {}
+    if not variants:
+        return default
+    return LocalizedContent(
+        default,
+        {lang: MessageContent(content) for lang, content in variants.items()},
+        get_user_index().lang_of,
+    )
+
+async def broadcast_to_groups(content: MessageContent, group_ids: List[int], pin_option: str, progress_callback=None,
+                              sender: Optional[Bot] = None, max_retries: int = 3) -> BroadcastStatus:
+    sender = sender or bot
     status = BroadcastStatus(total=len(group_ids), start_time=datetime.now())
     for gid in group_ids:
         try:
-            msg = await content.send(bot, gid)
-            if pin_option in ["pin_with_notification", "pin_without_notification"] and isinstance(msg, types.Message):
-                await bot.pin_chat_message(gid, msg.message_id, disable_notification=(pin_option=="pin_without_notification"))
+            for attempt in range(max_retries + 1):
+                try:
+                    msg = await content.send(sender, gid)
+                    break
+                except TelegramRetryAfter as e:
+                    if attempt == max_retries:
+                        raise
+                    await asyncio.sleep(e.retry_after)
+            if not msg:
+                raise RuntimeError("message was not delivered")
+            # pin only when the admin chose "С закреплением"
+            if pin_option == "pin_with_notification" and isinstance(msg, types.Message):
+                await sender.pin_chat_message(gid, msg.message_id)
             status.sent += 1
         except Exception as e:
             logger.error(f"Error sending to group {gid}: {e}")
@@ -139,6 +206,25 @@ class States(StatesGroup):
     pin_option = State()
     final_confirmation = State()
     waiting_for_admin_id = State()    # New state for admin management
+    segment_lang = State()
+    segment_status = State()
+    segment_expiry = State()
+    segment_seen = State()
+    variant_choice = State()
+    waiting_for_variant = State()
+
+# Options for broadcasts spread evenly over a time window
+PACED_WINDOWS = [
+    ("Равномерно за 1 ч", 3600),
+    ("Равномерно за 2 ч", 7200),
+    ("Равномерно за 6 ч", 21600),
+]
+
+def user_broadcast_options() -> List[tuple]:
+    options = [("Начать", "start")]
+    options += [(text, f"start_paced_{seconds}") for text, seconds in PACED_WINDOWS]
+    options.append(("Отмена", "cancel"))
+    return options
 
 bot = Bot(token=API_TOKEN)
 router = Router()
@@ -191,20 +277,14 @@ async def start_process(message: types.Message, state: FSMContext):
     await state.set_state(States.waiting_for_content)
     await message.answer("Ожидаю сообщение или изображение")
 
-@router.message(States.waiting_for_content, F.content_type.in_(['text', 'photo']))
-async def handle_content(message: types.Message, state: FSMContext):
-    content = (
+def extract_content(message: types.Message) -> Union[str, Dict[str, str]]:
+    return (
         message.html_text
         if message.content_type == 'text'
         else {"photo": message.photo[-1].file_id, "caption": message.html_text or ""}
     )
 
-    await state.update_data(content=content)
-
-    builder = InlineKeyboardBuilder()
-    builder.add(types.InlineKeyboardButton(text="Да", callback_data="confirm"))
-    builder.add(types.InlineKeyboardButton(text="Нет", callback_data="cancel"))
-
+async def preview_content(message: types.Message) -> None:
     if message.content_type == 'photo':
         await message.answer_photo(
             message.photo[-1].file_id,
@@ -214,6 +294,22 @@ async def handle_content(message: types.Message, state: FSMContext):
     else:
         await message.answer(message.html_text, parse_mode='HTML')
 
+def choice_keyboard(options: List[tuple]) -> types.InlineKeyboardMarkup:
+    keyboard = InlineKeyboardBuilder()
+    for text, callback_data in options:
+        keyboard.row(types.InlineKeyboardButton(text=text, callback_data=callback_data))
+    return keyboard.as_markup()
+
+@router.message(States.waiting_for_content, F.content_type.in_(['text', 'photo']))
+async def handle_content(message: types.Message, state: FSMContext):
+    await state.update_data(content=extract_content(message))
+
+    builder = InlineKeyboardBuilder()
+    builder.add(types.InlineKeyboardButton(text="Да", callback_data="confirm"))
+    builder.add(types.InlineKeyboardButton(text="Нет", callback_data="cancel"))
+
+    await preview_content(message)
+
     await message.answer(
         "Подтвердите отправку?",
         reply_markup=builder.as_markup()
@@ -240,6 +336,10 @@ async def process_confirmation(callback_query: types.CallbackQuery, state: FSMCo
         text="Всем пользователям",
         callback_data="target_all"
     ))
+    keyboard.add(types.InlineKeyboardButton(
+        text="По сегменту",
+        callback_data="target_segment"
+    ))
 
     await callback_query.message.answer(
         "Кому отправить сообщение?",
@@ -250,12 +350,24 @@ async def process_confirmation(callback_query: types.CallbackQuery, state: FSMCo
 
 @router.callback_query(States.choose_target)
 async def process_target(callback_query: types.CallbackQuery, state: FSMContext):
-    if callback_query.data not in ["target_groups", "target_all"]:
+    if callback_query.data not in ["target_groups", "target_all", "target_segment"]:
         await callback_query.answer()
         return
 
     await state.update_data(target=callback_query.data)
 
+    if callback_query.data == "target_segment":
+        await callback_query.message.answer(
+            "Язык пользователей?",
+            reply_markup=choice_keyboard([
+                ("Русский", "seg_lang_ru"),
+                ("Кыргызский", "seg_lang_kg"),
+                ("Все языки", "seg_lang_any"),
+            ])
+        )
+        await state.set_state(States.segment_lang)
+        return
+
     if callback_query.data == "target_groups":
         keyboard = InlineKeyboardBuilder()
         keyboard.add(types.InlineKeyboardButton(
@@ -273,17 +385,134 @@ async def process_target(callback_query: types.CallbackQuery, state: FSMContext)
         )
         await state.set_state(States.pin_option)
     else:
-        keyboard = InlineKeyboardBuilder()
-        keyboard.add(types.InlineKeyboardButton(text="Начать", callback_data="start"))
-        keyboard.add(types.InlineKeyboardButton(text="Отмена", callback_data="cancel"))
-
         await callback_query.message.answer(
             "Начать рассылку всем пользователям?",
-            reply_markup=keyboard.as_markup()
+            reply_markup=choice_keyboard(user_broadcast_options())
         )
         await state.set_state(States.final_confirmation)
 
 
+def _segment_value(data: str, prefix: str) -> Optional[str]:
+    value = data[len(prefix):]
+    return None if value == "any" else value
+
+async def _update_audience(state: FSMContext, **changes) -> AudienceFilter:
+    data = await state.get_data()
+    audience = AudienceFilter.from_dict(data.get('audience'))
+    for key, value in changes.items():
+        setattr(audience, key, value)
+    await state.update_data(audience=audience.to_dict())
+    return audience
+
+@router.callback_query(States.segment_lang, F.data.startswith("seg_lang_"))
+async def process_segment_lang(callback_query: types.CallbackQuery, state: FSMContext):
+    await _update_audience(state, lang=_segment_value(callback_query.data, "seg_lang_"))
+    await callback_query.message.answer(
+        "Статус подписки?",
+        reply_markup=choice_keyboard([
+            ("С подпиской", f"seg_status_{STATUS_PAID}"),
+            ("Пробный период", f"seg_status_{STATUS_TRIAL}"),
+            ("Без подписки", f"seg_status_{STATUS_NONE}"),
+            ("Любой", "seg_status_any"),
+        ])
+    )
+    await state.set_state(States.segment_status)
+
+@router.callback_query(States.segment_status, F.data.startswith("seg_status_"))
+async def process_segment_status(callback_query: types.CallbackQuery, state: FSMContext):
+    await _update_audience(state, status=_segment_value(callback_query.data, "seg_status_"))
+    await callback_query.message.answer(
+        "Подписка истекает в течение?",
+        reply_markup=choice_keyboard([
+            ("3 дней", "seg_expiry_3"),
+            ("7 дней", "seg_expiry_7"),
+            ("30 дней", "seg_expiry_30"),
+            ("Не важно", "seg_expiry_any"),
+        ])
+    )
+    await state.set_state(States.segment_expiry)
+
+@router.callback_query(States.segment_expiry, F.data.startswith("seg_expiry_"))
+async def process_segment_expiry(callback_query: types.CallbackQuery, state: FSMContext):
+    value = _segment_value(callback_query.data, "seg_expiry_")
+    await _update_audience(state, expires_within_days=int(value) if value else None)
+    await callback_query.message.answer(
+        "Последняя активность?",
+        reply_markup=choice_keyboard([
+            ("За 7 дней", "seg_seen_7"),
+            ("За 30 дней", "seg_seen_30"),
+            ("За 90 дней", "seg_seen_90"),
+            ("Не важно", "seg_seen_any"),
+        ])
+    )
+    await state.set_state(States.segment_seen)
+
+@router.callback_query(States.segment_seen, F.data.startswith("seg_seen_"))
+async def process_segment_seen(callback_query: types.CallbackQuery, state: FSMContext):
+    value = _segment_value(callback_query.data, "seg_seen_")
+    audience = await _update_audience(state, seen_within_days=int(value) if value else None)
+    if audience.lang:
+        await ask_final_confirmation(callback_query.message, state)
+    else:
+        await ask_variant_choice(callback_query.message, state)
+
+async def ask_variant_choice(message: types.Message, state: FSMContext):
+    data = await state.get_data()
+    variants = data.get('variants') or {}
+    options = [
+        (f"Отдельный текст: {title}" + (" ✅" if lang in variants else ""), f"variant_{lang}")
+        for lang, title in LANG_TITLES.items()
+    ]
+    options.append(("Продолжить", "variant_done"))
+    await message.answer(
+        "Можно задать отдельный текст для пользователей на другом языке. "
+        "Остальные получат основное сообщение.",
+        reply_markup=choice_keyboard(options)
+    )
+    await state.set_state(States.variant_choice)
+
+@router.callback_query(States.variant_choice, F.data.startswith("variant_"))
+async def process_variant_choice(callback_query: types.CallbackQuery, state: FSMContext):
+    lang = callback_query.data[len("variant_"):]
+    if lang == "done":
+        await ask_final_confirmation(callback_query.message, state)
+        return
+    if lang not in LANG_TITLES:
+        await callback_query.answer()
+        return
+    await state.update_data(variant_lang=lang)
+    await callback_query.message.answer(
+        f"Отправьте сообщение или изображение для языка: {LANG_TITLES[lang]}"
+    )
+    await state.set_state(States.waiting_for_variant)
+
+@router.message(States.waiting_for_variant, F.content_type.in_(['text', 'photo']))
+async def handle_variant(message: types.Message, state: FSMContext):
+    data = await state.get_data()
+    variants = data.get('variants') or {}
+    variants[data.get('variant_lang')] = extract_content(message)
+    await state.update_data(variants=variants)
+    await preview_content(message)
+    await ask_variant_choice(message, state)
+
+async def ask_final_confirmation(message: types.Message, state: FSMContext):
+    data = await state.get_data()
+    audience = AudienceFilter.from_dict(data.get('audience'))
+    total = get_user_index().count(audience)
+    variants = data.get('variants') or {}
+    variants_text = (
+        f"\nВарианты текста: {', '.join(LANG_TITLES[lang] for lang in variants)}"
+        if variants else ""
+    )
+    await message.answer(
+        f"Аудитория: {audience.describe()}\n"
+        f"Получателей: {total}{variants_text}\n\n"
+        f"Начать рассылку?",
+        reply_markup=choice_keyboard(user_broadcast_options())
+    )
+    await state.set_state(States.final_confirmation)
+
+
 @router.callback_query(States.pin_option)
 async def process_pin_option(callback_query: types.CallbackQuery, state: FSMContext):
     if callback_query.data not in ["pin_with_notification", "pin_without_notification"]:
@@ -311,8 +540,9 @@ async def process_final_confirmation(callback_query: types.CallbackQuery, state:
         return
 
     data = await state.get_data()
-    content = MessageContent(data.get('content'))
+    content = build_content(data)
     target = data.get('target')
+    usage_metrics.incr("events", "broadcasts")
 
     if target == "target_groups":
         group_ids = load_groups()
@@ -335,15 +565,20 @@ async def process_final_confirmation(callback_query: types.CallbackQuery, state:
 
     else:
         try:
-            with open('schedule.json', 'r') as file:
-                schedule_data = json.load(file)
-                user_ids = [info["user_id"] for info in schedule_data.values()]
+            audience = AudienceFilter.from_dict(data.get('audience'))
+            user_ids = get_user_index().select(audience)
         except Exception as e:
             logger.error(f"Error loading users: {e}")
             await callback_query.message.answer("Ошибка загрузки пользователей")
             await state.clear()
             return
 
+        if callback_query.data.startswith("start_paced_"):
+            await start_paced_broadcast(callback_query.message, data, user_ids,
+                                        int(callback_query.data[len("start_paced_"):]))
+            await state.clear()
+            return
+
         status_message = await callback_query.message.answer(
             f"Начинаю рассылку {len(user_ids)} пользователям..."
         )
@@ -368,6 +603,72 @@ async def process_final_confirmation(callback_query: types.CallbackQuery, state:
     )
     await state.clear()
 
+async def notify_paced_done(job: paced_broadcast.BroadcastJob) -> None:
+    if not job.report_chat_id:
+        return
+    result = {
+        paced_broadcast.STATUS_DONE: "завершена",
+        paced_broadcast.STATUS_FAILED: "прервана: список получателей потерян",
+    }.get(job.status, "остановлена")
+    await bot.send_message(
+        job.report_chat_id,
+        f"Равномерная рассылка {job.job_id} {result}.\n"
+        f"Успешно: {job.sent}\n"
+        f"Ошибок: {job.failed}"
+    )
+
+async def start_paced_broadcast(message: types.Message, data: Dict, user_ids: List[int], window_seconds: int):
+    payload = {'content': data.get('content'), 'variants': data.get('variants') or {}}
+    status_message = await message.answer(
+        f"Равномерная рассылка {len(user_ids)} пользователям "
+        f"за {window_seconds // 3600} ч. запланирована."
+    )
+    job = await paced_broadcast.create_job(
+        payload,
+        user_ids,
+        window_seconds,
+        report_chat_id=status_message.chat.id,
+        report_message_id=status_message.message_id,
+    )
+    paced_broadcast.start_job(bot, job, build_content(payload), notify_paced_done)
+
+@router.startup()
+async def resume_paced_broadcasts() -> None:
+    """Continue paced broadcasts that were interrupted by a restart."""
+    tasks = await paced_broadcast.resume_jobs(bot, build_content, notify_paced_done)
+    if tasks:
+        logger.info(f"Resumed {len(tasks)} paced broadcast(s)")
+
+@router.message(Command("broadcasts"))
+async def cmd_list_broadcasts(message: types.Message):
+    if not is_admin(message.from_user.id):
+        await message.answer("У вас нет прав для выполнения этой команды.")
+        return
+
+    jobs = await paced_broadcast.running_jobs()
+    if not jobs:
+        await message.answer("Нет активных равномерных рассылок.")
+        return
+    await message.answer(
+        "\n\n".join(paced_broadcast.format_progress(job) for job in jobs)
+        + "\n\nОстановить: /cancel_broadcast <id>"
+    )
+
+@router.message(Command("cancel_broadcast"))
+async def cmd_cancel_broadcast(message: types.Message):
+    if not is_admin(message.from_user.id):
+        await message.answer("У вас нет прав для выполнения этой команды.")
+        return
+
+    parts = message.text.split(maxsplit=1)
+    if len(parts) < 2:
+        await message.answer("Укажите id рассылки: /cancel_broadcast <id>")
+        return
+    if await paced_broadcast.cancel_job(parts[1].strip()):
+        await message.answer("Рассылка будет остановлена.")
+    else:
+        await message.answer("Активная рассылка с таким id не найдена.")
+
 # Admin management commands
 @router.message(Command("add_admin"))
 async def cmd_add_admin(message: types.Message, state: FSMContext):
@@ -435,10 +736,13 @@ async def process_admin_id(message: types.Message, state: FSMContext):
 
 async def send_daily_schedule_report(bot: Bot) -> None:
     """
-    Send the daily schedule.json file to the bot owner.
+    Send the daily backup of schedule.json to the bot owner.
     
-    This function reads the schedule.json file and sends it to the owner
-    with a detailed report about the current user base statistics.
+    Instead of the whole file, the owner receives a compressed delta
+    with the users added, changed and removed since the previous report.
+    A compressed full snapshot is sent every EXPORT_FULL_EVERY_DAYS days,
+    and the caption carries the current user base statistics. The
+    chain can be restored with `python -m methods.export restore`.
     
     Args:
         bot (Bot): The aiogram Bot instance used for sending messages
@@ -447,7 +751,7 @@ async def send_daily_schedule_report(bot: Bot) -> None:
         Exception: If there's an error reading or sending the file
     """
     try:
-        schedule_file_path = 'schedule.json'
+        schedule_file_path = DATA_FILE
         
         # Check if schedule file exists
         if not os.path.exists(schedule_file_path):
@@ -458,41 +762,35 @@ async def send_daily_schedule_report(bot: Bot) -> None:
             )
             return
             
-        # Get file statistics
-        file_size = os.path.getsize(schedule_file_path)
-        modification_time = datetime.fromtimestamp(
-            os.path.getmtime(schedule_file_path)
-        )
-        
-        # Load and analyze schedule data
-        try:
-            with open(schedule_file_path, 'r', encoding='utf-8') as file:
-                schedule_data = json.load(file)
-                user_count = len(schedule_data)
-        except (json.JSONDecodeError, UnicodeDecodeError) as e:
-            logger.error(f"Error reading schedule file content: {e}")
-            user_count = "Неизвестно"
-            schedule_data = {}
+        # Flush pending activity so the backup reflects the latest state
+        activity_tracker.flush()
+        export = await asyncio.to_thread(export_chain.prepare, read_data())
+        stats = await get_statistics()
         
         # Create detailed report caption
+        if export.kind == KIND_FULL:
+            contents = "Полная копия базы"
+        else:
+            contents = (
+                f"Изменения: +{export.added} новых, "
+                f"~{export.changed} изменено, -{export.removed} удалено"
+            )
         caption = (
             f"📋 Ежедневный отчет - schedule.json\n"
-            f"📅 Дата отчета: {datetime.now().strftime('%d.%m.%Y %H:%M')}\n"
-            f"👥 Пользователей в базе: {user_count}\n"
-            f"📦 Размер файла: {file_size} байт\n"
-            f"🕒 Последнее изменение: {modification_time.strftime('%d.%m.%Y %H:%M')}"
+            f"📅 Дата отчета: {export.created_at.strftime('%d.%m.%Y %H:%M')}\n"
+            f"📦 {contents}\n"
+            f"🗜 Размер: {export.raw_size} → {len(export.payload)} байт\n\n"
+            f"👥 Пользователей в базе: {stats['total_users']}\n"
+            f"❌ Заблокировали бота: {stats['blocked_users']}\n"
+            f"📈 DAU/WAU/MAU: {stats['dau']}/{stats['wau']}/{stats['mau']}"
         )
         
-        # Send the file with detailed information
-        with open(schedule_file_path, 'rb') as file:
-            await bot.send_document(
-                chat_id=HAN_ID,
-                document=types.FSInputFile(
-                    schedule_file_path, 
-                    filename=f'schedule_{datetime.now().strftime("%Y%m%d")}.json'
-                ),
-                caption=caption
-            )
+        await bot.send_document(
+            chat_id=HAN_ID,
+            document=types.BufferedInputFile(export.payload, filename=export.filename),
+            caption=caption
+        )
+        export_chain.commit(export)
             
         logger.info(f"Daily schedule report sent successfully to {HAN_ID}")
         
@@ -507,78 +805,23 @@ async def send_daily_schedule_report(bot: Bot) -> None:
             logger.error(f"Failed to send error notification: {send_error}")
 
 
-async def daily_schedule_task(bot: Bot) -> None:
+@router.startup()
+async def schedule_daily_report(bot: Bot) -> None:
     """
-    Background task that schedules daily sending of schedule.json.
+    Register the daily sending of schedule.json with the scheduler.
     
-    This function runs continuously and triggers the daily report
-    sending at 9:00 AM each day. It handles errors gracefully and
-    reschedules itself for the next day.
+    The report is sent at 9:00 AM each day. If the bot was down at
+    that time, the missed report is sent once right after startup.
     
     Args:
         bot (Bot): The aiogram Bot instance
-        
-    Note:
-        This function runs indefinitely and should be started as
-        a background task using asyncio.create_task()
     """
-    while True:
-        try:
-            now = datetime.now()
-            
-            # Set target time to 9:00 AM today
-            target_time = now.replace(
-                hour=9, minute=0, second=0, microsecond=0
-            )
-            
-            # If it's already past 9 AM today, schedule for tomorrow
-            if now >= target_time:
-                target_time += timedelta(days=1)
-            
-            # Calculate seconds until target time
-            time_until_target = (target_time - now).total_seconds()
-            
-            logger.info(
-                f"Next daily schedule report scheduled for: "
-                f"{target_time.strftime('%d.%m.%Y %H:%M')}"
-            )
-            
-            # Wait until target time
-            await asyncio.sleep(time_until_target)
-            
-            # Send the daily report
-            await send_daily_schedule_report(bot)
-            
-        except asyncio.CancelledError:
-            logger.info("Daily schedule task cancelled")
-            break
-        except Exception as e:
-            logger.error(f"Error in daily schedule task: {e}")
-            # Wait 1 hour before retrying if there's an error
-            await asyncio.sleep(3600)
-
-
-def start_daily_scheduler(bot: Bot) -> asyncio.Task:
-    """
-    Initialize and start the daily scheduler as a background task.
-    
-    This function creates a background task for the daily schedule
-    reporting and returns the task handle for potential cancellation.
-    
-    Args:
-        bot (Bot): The aiogram Bot instance
-        
-    Returns:
-        asyncio.Task: The created task handle
-        
-    Example:
-        scheduler_task = start_daily_scheduler(bot)
-        # Later, if needed:
-        # scheduler_task.cancel()
-    """
-    task = asyncio.create_task(daily_schedule_task(bot))
-    logger.info("Daily schedule reporter started successfully")
-    return task
+    scheduler.add_job(
+        "daily_schedule_report",
+        lambda: send_daily_schedule_report(bot),
+        CronTrigger(minute="0", hour="9"),
+        misfire=MISFIRE_RUN_ONCE,
+    )
 
 @router.message(Command("send_schedule"))
 async def cmd_send_schedule_now(message: types.Message) -> None:
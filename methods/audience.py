@@ -0,0 +1,242 @@
+import datetime
+import logging
+from collections import defaultdict
+from dataclasses import dataclass, asdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Subscription statuses used for audience selection
+STATUS_PAID = "paid"
+STATUS_TRIAL = "trial"
+STATUS_NONE = "none"
+
+STATUS_TITLES = {
+    STATUS_PAID: "с подпиской",
+    STATUS_TRIAL: "с пробным периодом",
+    STATUS_NONE: "без подписки",
+}
+
+LANG_TITLES = {
+    "ru": "русский",
+    "kg": "кыргызский",
+}
+
+
+@dataclass
+class AudienceFilter:
+    """Broadcast audience description. None means "any" for every field."""
+    lang: Optional[str] = None
+    status: Optional[str] = None
+    expires_within_days: Optional[int] = None
+    seen_within_days: Optional[int] = None
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict]) -> "AudienceFilter":
+        data = data or {}
+        return cls(**{key: data.get(key) for key in cls.__dataclass_fields__})
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+    def is_empty(self) -> bool:
+        return all(value is None for value in asdict(self).values())
+
+    def describe(self) -> str:
+        if self.is_empty():
+            return "все пользователи"
+        parts = []
+        if self.lang:
+            parts.append(f"язык: {LANG_TITLES.get(self.lang, self.lang)}")
+        if self.status:
+            parts.append(STATUS_TITLES.get(self.status, self.status))
+        if self.expires_within_days is not None:
+            parts.append(f"подписка истекает в течение {self.expires_within_days} дн.")
+        if self.seen_within_days is not None:
+            parts.append(f"активны за последние {self.seen_within_days} дн.")
+        return ", ".join(parts)
+
+
+def _day(value: Optional[str]) -> Optional[int]:
+    """Convert an ISO timestamp from the user record to a day ordinal."""
+    if not value:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(value).date().toordinal()
+    except (TypeError, ValueError):
+        return None
+
+
+def user_status(user: Dict) -> str:
+    if user.get('sub'):
+        return STATUS_PAID
+    if user.get('trial'):
+        return STATUS_TRIAL
+    return STATUS_NONE
+
+
+class UserIndex:
+    """
+    In-memory secondary indexes over the user store.
+
+    Users are bucketed by language, subscription status, expiry day and
+    last-seen day, so audience selection only touches the matching buckets
+    instead of scanning every record. Users who blocked the bot are kept in
+    a separate set and never selected.
+    """
+
+    def __init__(self):
+        self.loaded = False
+        self._entries: Dict[int, Tuple[str, str, Optional[int], Optional[int]]] = {}
+        self._by_lang: Dict[str, Set[int]] = defaultdict(set)
+        self._by_status: Dict[str, Set[int]] = defaultdict(set)
+        self._by_expiry_day: Dict[int, Set[int]] = defaultdict(set)
+        self._by_seen_day: Dict[int, Set[int]] = defaultdict(set)
+        self._blocked: Set[int] = set()
+        # blocked flags set in memory and not yet written to the user store
+        self._pending_blocked: Dict[int, bool] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._entries
+
+    def rebuild(self, data: Dict[str, Dict]) -> None:
+        """Rebuild all indexes from the raw user store ({user_id: record})."""
+        self._entries.clear()
+        for index in (self._by_lang, self._by_status, self._by_expiry_day, self._by_seen_day):
+            index.clear()
+        self._blocked.clear()
+        for user in data.values():
+            try:
+                self.update(user)
+            except Exception as e:
+                logger.error(f"Error indexing user {user.get('user_id')}: {e}")
+        self.loaded = True
+
+    def update(self, user: Dict) -> None:
+        user_id = int(user['user_id'])
+        old = self._entries.get(user_id)
+        self.remove(user_id)
+        seen_day = _day(user.get('last_seen'))
+        # records read from disk may lag behind activity stamped in memory
+        if old and old[3] is not None and (seen_day is None or old[3] > seen_day):
+            seen_day = old[3]
+        entry = (
+            user.get('lang') or 'ru',
+            user_status(user),
+            _day(user.get('expire_date')),
+            seen_day,
+        )
+        lang, status, expiry_day, seen_day = entry
+        self._entries[user_id] = entry
+        self._by_lang[lang].add(user_id)
+        self._by_status[status].add(user_id)
+        if expiry_day is not None:
+            self._by_expiry_day[expiry_day].add(user_id)
+        if seen_day is not None:
+            self._by_seen_day[seen_day].add(user_id)
+        # as with last_seen, the record may not have the pending flag yet
+        if self._pending_blocked.get(user_id, bool(user.get('blocked'))):
+            self._blocked.add(user_id)
+
+    def remove(self, user_id: int) -> None:
+        entry = self._entries.pop(user_id, None)
+        if entry is None:
+            return
+        lang, status, expiry_day, seen_day = entry
+        self._discard(self._by_lang, lang, user_id)
+        self._discard(self._by_status, status, user_id)
+        self._discard(self._by_expiry_day, expiry_day, user_id)
+        self._discard(self._by_seen_day, seen_day, user_id)
+        self._blocked.discard(user_id)
+
+    def touch(self, user_id: int, when: datetime.datetime) -> bool:
+        """Move a user to the last-seen bucket of `when`. Returns False for unknown users."""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return False
+        day = when.date().toordinal()
+        if entry[3] != day:
+            self._discard(self._by_seen_day, entry[3], user_id)
+            self._by_seen_day[day].add(user_id)
+            self._entries[user_id] = entry[:3] + (day,)
+        return True
+
+    def set_blocked(self, user_id: int, blocked: bool, pending: bool = False) -> None:
+        """
+        With pending=True the flag survives updates from records that do not
+        have it yet, until clear_pending() is called for the user.
+        """
+        if blocked:
+            self._blocked.add(user_id)
+        else:
+            self._blocked.discard(user_id)
+        if pending:
+            self._pending_blocked[user_id] = blocked
+
+    def clear_pending(self, user_ids: Iterable[int]) -> None:
+        """Forget pending blocked flags once they are written to the user store."""
+        for user_id in user_ids:
+            self._pending_blocked.pop(user_id, None)
+
+    def blocked_count(self) -> int:
+        return len(self._blocked)
+
+    def seen_count(self, days: int, now: Optional[datetime.datetime] = None) -> int:
+        """Number of users seen during the last `days` days, today included."""
+        today = (now or datetime.datetime.now()).date().toordinal()
+        return sum(len(self._by_seen_day.get(day, ())) for day in range(today - days + 1, today + 1))
+
+    @staticmethod
+    def _discard(index: Dict, key, user_id: int) -> None:
+        bucket = index.get(key)
+        if bucket is None:
+            return
+        bucket.discard(user_id)
+        if not bucket:
+            del index[key]
+
+    def lang_of(self, user_id: int, default: str = "ru") -> str:
+        entry = self._entries.get(user_id)
+        return entry[0] if entry else default
+
+    def _days_union(self, index: Dict[int, Set[int]], days: Iterable[int]) -> Set[int]:
+        result: Set[int] = set()
+        for day in days:
+            bucket = index.get(day)
+            if bucket:
+                result |= bucket
+        return result
+
+    def _candidate_sets(self, audience: AudienceFilter, today: int) -> List[Set[int]]:
+        sets = []
+        if audience.lang:
+            sets.append(self._by_lang.get(audience.lang, set()))
+        if audience.status:
+            sets.append(self._by_status.get(audience.status, set()))
+        if audience.expires_within_days is not None:
+            days = range(today, today + audience.expires_within_days + 1)
+            sets.append(self._days_union(self._by_expiry_day, days))
+        if audience.seen_within_days is not None:
+            days = range(today - audience.seen_within_days, today + 1)
+            sets.append(self._days_union(self._by_seen_day, days))
+        return sets
+
+    def select(self, audience: AudienceFilter, now: Optional[datetime.datetime] = None) -> List[int]:
+        """Return ids of users matching every condition of the audience filter."""
+        today = (now or datetime.datetime.now()).date().toordinal()
+        sets = self._candidate_sets(audience, today)
+        if not sets:
+            return [user_id for user_id in self._entries if user_id not in self._blocked]
+        sets.sort(key=len)
+        result = set(sets[0])
+        for other in sets[1:]:
+            result &= other
+            if not result:
+                break
+        return list(result - self._blocked)
+
+    def count(self, audience: AudienceFilter, now: Optional[datetime.datetime] = None) -> int:
+        return len(self.select(audience, now))
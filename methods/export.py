@@ -0,0 +1,216 @@
+"""
+Incremental backups of the user store.
+
+Every report is either a full snapshot or a delta against the previous
+report: users added or changed (as full records) and user ids removed.
+Payloads are compressed with zstd when the zstandard package is installed
+and with gzip otherwise. The chain can be restored with:
+
+    python -m methods.export restore schedule_full_*.json.gz schedule_delta_*.json.gz -o schedule.json
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import sys
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from config import EXPORT_DIR, EXPORT_FULL_EVERY_DAYS
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMAT = 1
+KIND_FULL = "full"
+KIND_DELTA = "delta"
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def compress(raw: bytes) -> Tuple[bytes, str]:
+    """Compress bytes, returning the payload and its file extension."""
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=10).compress(raw), ".zst"
+    return gzip.compress(raw, compresslevel=9), ".gz"
+
+
+def decompress(payload: bytes) -> bytes:
+    if payload.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read .zst exports")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    if payload.startswith(GZIP_MAGIC):
+        return gzip.decompress(payload)
+    return payload
+
+
+def compute_delta(old: Dict[str, Dict], new: Dict[str, Dict]) -> Dict[str, Any]:
+    added = {user_id: user for user_id, user in new.items() if user_id not in old}
+    changed = {
+        user_id: user for user_id, user in new.items()
+        if user_id in old and old[user_id] != user
+    }
+    removed = [user_id for user_id in old if user_id not in new]
+    return {"added": added, "changed": changed, "removed": removed}
+
+
+def apply_export(data: Dict[str, Dict], export: Dict[str, Any]) -> Dict[str, Dict]:
+    if export["kind"] == KIND_FULL:
+        return dict(export["users"])
+    data = dict(data)
+    data.update(export["added"])
+    data.update(export["changed"])
+    for user_id in export["removed"]:
+        data.pop(user_id, None)
+    return data
+
+
+@dataclass
+class Export:
+    """A prepared report that becomes the new baseline once it has been delivered."""
+    export_id: str
+    created_at: datetime
+    kind: str
+    filename: str
+    payload: bytes
+    raw_size: int
+    users: int
+    added: int = 0
+    changed: int = 0
+    removed: int = 0
+    snapshot: Dict[str, Dict] = field(default_factory=dict, repr=False)
+
+
+class ExportChain:
+    """
+    Keeps the last delivered state of the user store so each report only
+    carries the difference. The baseline lives in EXPORT_DIR and is advanced
+    by commit() after the report was sent, so a failed upload is folded into
+    the next delta instead of breaking the chain.
+    """
+
+    def __init__(self, directory: str = EXPORT_DIR, full_every_days: int = EXPORT_FULL_EVERY_DAYS):
+        self.directory = directory
+        self.full_every_days = full_every_days
+        self.baseline_path = os.path.join(directory, "baseline.json.gz")
+
+    def load_baseline(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.baseline_path, "rb") as f:
+                return json.loads(decompress(f.read()))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.error(f"Error reading export baseline, next export will be full: {e}")
+            return None
+
+    def prepare(self, data: Dict[str, Dict], now: Optional[datetime] = None) -> Export:
+        now = now or datetime.now()
+        export_id = now.strftime("%Y%m%d-%H%M%S")
+        baseline = self.load_baseline()
+
+        full_due = (
+            baseline is None
+            or now - datetime.fromisoformat(baseline["last_full_at"]) >= timedelta(days=self.full_every_days)
+        )
+        document = {
+            "format": EXPORT_FORMAT,
+            "id": export_id,
+            "base": None if full_due else baseline["id"],
+            "created_at": now.isoformat(),
+        }
+        counts = {}
+        if full_due:
+            document["kind"] = KIND_FULL
+            document["users"] = data
+        else:
+            delta = compute_delta(baseline["users"], data)
+            document["kind"] = KIND_DELTA
+            document.update(delta)
+            counts = {key: len(value) for key, value in delta.items()}
+
+        raw = json.dumps(document, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        payload, extension = compress(raw)
+        return Export(
+            export_id=export_id,
+            created_at=now,
+            kind=document["kind"],
+            filename=f"schedule_{document['kind']}_{export_id}.json{extension}",
+            payload=payload,
+            raw_size=len(raw),
+            users=len(data),
+            snapshot=data,
+            **counts,
+        )
+
+    def commit(self, export: Export) -> None:
+        """Record a delivered export as the base of the next delta."""
+        if export.kind == KIND_FULL:
+            last_full_at = export.created_at.isoformat()
+        else:
+            last_full_at = (self.load_baseline() or {}).get("last_full_at")
+        document = {"id": export.export_id, "last_full_at": last_full_at, "users": export.snapshot}
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self.baseline_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(gzip.compress(json.dumps(document, ensure_ascii=False).encode("utf-8"), compresslevel=6))
+        os.replace(tmp_path, self.baseline_path)
+
+
+export_chain = ExportChain()
+
+
+def restore(paths: List[str]) -> Dict[str, Dict]:
+    """Rebuild the user store from the latest full export and the deltas after it."""
+    exports = []
+    for path in paths:
+        with open(path, "rb") as f:
+            export = json.loads(decompress(f.read()))
+        if export.get("format") != EXPORT_FORMAT:
+            raise ValueError(f"{path} is not an export file")
+        exports.append(export)
+    exports.sort(key=lambda export: export["created_at"])
+
+    fulls = [i for i, export in enumerate(exports) if export["kind"] == KIND_FULL]
+    if not fulls:
+        raise ValueError("No full export among the given files")
+
+    data: Dict[str, Dict] = {}
+    previous_id = None
+    for export in exports[fulls[-1]:]:
+        if export["kind"] == KIND_DELTA and export["base"] != previous_id:
+            raise ValueError(f"Export {export['id']} is based on {export['base']}, expected {previous_id}")
+        data = apply_export(data, export)
+        previous_id = export["id"]
+    return data
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Restore schedule.json from exported backups")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    restore_parser = subparsers.add_parser("restore", help="apply a full export and the deltas after it")
+    restore_parser.add_argument("files", nargs="+", help="full and delta export files, in any order")
+    restore_parser.add_argument("-o", "--output", default="schedule.restored.json")
+    args = parser.parse_args(argv)
+
+    try:
+        data = restore(args.files)
+    except (OSError, ValueError, RuntimeError) as e:
+        print(f"Restore failed: {e}", file=sys.stderr)
+        return 1
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=4)
+    print(f"Restored {len(data)} users to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import os
+import signal
+import subprocess
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Union
+
+from aiogram import Router, types
+from aiogram.filters import Command
+
+from config import LATEX_WORKERS, LATEX_QUEUE_SIZE, LATEX_TIMEOUT
+from methods.admins import is_admin
+from methods.render_cache import render_cache
+
+logger = logging.getLogger(__name__)
+
+router = Router()
+
+
+class LatexQueueFull(Exception):
+    """Raised when the LaTeX compile queue is at capacity."""
+
+
+def _kill_tree(process: asyncio.subprocess.Process) -> None:
+    """Kills the process and everything it started (pdflatex may run kpsewhich, mktexpk, ...)."""
+    if process.returncode is not None:
+        return
+    try:
+        if os.name == "posix":
+            # the process leads its own session, see LatexPool.run
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            subprocess.run(["taskkill", "/F", "/T", "/PID", str(process.pid)], capture_output=True)
+    except (ProcessLookupError, OSError):
+        pass
+    try:
+        process.kill()
+    except ProcessLookupError:
+        pass
+
+
+class LatexPool:
+    """
+    Runs pdflatex as asyncio subprocesses, so compiles never take a thread
+    and never block the event loop.
+
+    At most `workers` processes run at once; up to `queue_size` more jobs
+    may wait for a free slot, and further jobs are rejected with
+    LatexQueueFull. A process running longer than its timeout is killed
+    together with its children and the job raises asyncio.TimeoutError.
+    """
+
+    def __init__(self, workers: int = LATEX_WORKERS, queue_size: int = LATEX_QUEUE_SIZE,
+                 timeout: float = LATEX_TIMEOUT):
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._slots = asyncio.Semaphore(self.workers)
+        self._processes: Set[asyncio.subprocess.Process] = set()
+        self.waiting = 0
+        self.running = 0
+        self.max_depth = 0
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.wait_time = 0.0
+        self.run_time = 0.0
+        self.max_wait = 0.0
+        self.max_run = 0.0
+
+    @property
+    def depth(self) -> int:
+        return self.waiting + self.running
+
+    async def run(self, cmd: List[str], cwd: Union[str, Path, None] = None, env: Optional[Dict[str, str]] = None,
+                  timeout: Optional[float] = None) -> subprocess.CompletedProcess:
+        """
+        Runs cmd in a free slot and returns its exit code and output once it
+        has exited; by then every file it wrote is complete.
+        """
+        if self.waiting >= self.queue_size:
+            self.rejected += 1
+            raise LatexQueueFull()
+
+        self.waiting += 1
+        self.max_depth = max(self.max_depth, self.depth)
+        queued_at = time.monotonic()
+        queued = True
+        try:
+            async with self._slots:
+                self.waiting -= 1
+                queued = False
+                self.running += 1
+                started = time.monotonic()
+                self.wait_time += started - queued_at
+                self.max_wait = max(self.max_wait, started - queued_at)
+                try:
+                    result = await self._run_process(cmd, cwd, env, timeout or self.timeout)
+                except asyncio.TimeoutError:
+                    self.timeouts += 1
+                    raise
+                except Exception:
+                    self.failed += 1
+                    raise
+                finally:
+                    self.running -= 1
+                    elapsed = time.monotonic() - started
+                    self.run_time += elapsed
+                    self.max_run = max(self.max_run, elapsed)
+                if result.returncode == 0:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                return result
+        finally:
+            if queued:
+                self.waiting -= 1
+
+    async def _run_process(self, cmd: List[str], cwd, env, timeout: float) -> subprocess.CompletedProcess:
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            cwd=cwd,
+            env=env,
+            # nonstopmode never asks, but a missing file prompt must not hang the job
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=os.name == "posix",
+        )
+        self._processes.add(process)
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+        except BaseException:
+            # a timeout, or the job was cancelled: nothing may outlive it
+            _kill_tree(process)
+            await process.wait()
+            raise
+        finally:
+            self._processes.discard(process)
+        return subprocess.CompletedProcess(
+            cmd, process.returncode,
+            stdout.decode("utf-8", errors="replace"),
+            stderr.decode("utf-8", errors="replace"),
+        )
+
+    def shutdown(self) -> None:
+        for process in list(self._processes):
+            _kill_tree(process)
+
+    def stats(self) -> Dict[str, Any]:
+        finished = self.completed + self.failed + self.timeouts
+        return {
+            'workers': self.workers,
+            'waiting': self.waiting,
+            'running': self.running,
+            'max_depth': self.max_depth,
+            'completed': self.completed,
+            'failed': self.failed,
+            'timeouts': self.timeouts,
+            'rejected': self.rejected,
+            'avg_wait': self.wait_time / finished if finished else 0.0,
+            'avg_run': self.run_time / finished if finished else 0.0,
+            'max_wait': self.max_wait,
+            'max_run': self.max_run,
+        }
+
+
+latex_pool = LatexPool()
+
+
+@router.message(Command("latex_pool"))
+async def cmd_latex_pool(message: types.Message):
+    if not is_admin(message.from_user.id):
+        await message.answer("У вас нет прав для выполнения этой команды.")
+        return
+
+    stats = latex_pool.stats()
+    cache = render_cache.stats()
+    await message.answer(
+        f"📐 Пул компиляции LaTeX\n\n"
+        f"Процессов: {stats['workers']}\n"
+        f"В очереди: {stats['waiting']}, выполняется: {stats['running']}\n"
+        f"Максимальная глубина очереди: {stats['max_depth']}\n"
+        f"Готово: {stats['completed']}, ошибок: {stats['failed']}, "
+        f"тайм-аутов: {stats['timeouts']}, отклонено: {stats['rejected']}\n"
+        f"Ожидание: среднее {stats['avg_wait']:.2f} сек., максимум {stats['max_wait']:.2f} сек.\n"
+        f"Компиляция: средняя {stats['avg_run']:.2f} сек., максимум {stats['max_run']:.2f} сек.\n"
+        f"Кэш рендеринга: {cache['entries']} файлов, {cache['size'] / 1024 / 1024:.1f} МБ, "
+        f"попаданий {cache['hit_rate']:.0%}"
+    )
+
+
+@router.shutdown()
+async def _on_shutdown() -> None:
+    latex_pool.shutdown()
@@ -0,0 +1,107 @@
+"""
+Line segment detectors DocScanner.get_corners can run on its edge map.
+
+Every detector takes the uint8 Canny edge map and returns the segments it
+found as an (N, 4) float32 array of (x1, y1, x2, y2), empty when there are
+none. DocScanner uses the one named by its line_detector option (the
+SCAN_LINE_DETECTOR setting in the bot); `python -m benchmarks.scanner
+--compare-line-detectors` measures every detector available here.
+"""
+import logging
+from typing import Callable, List
+
+import cv2
+import numpy as np
+
+try:
+    from pylsd.lsd import lsd as _pylsd
+except ImportError:
+    _pylsd = None
+
+logger = logging.getLogger(__name__)
+
+# Probabilistic Hough transform parameters for the 500-800 px detection image
+HOUGH_THRESHOLD = 25
+HOUGH_MIN_LENGTH = 20
+HOUGH_MAX_GAP = 15
+
+# Tried in this order when the configured detector cannot run here
+FALLBACK_ORDER = ("pylsd", "opencv_lsd", "hough")
+
+# OpenCV detector objects, created once per process
+_instances = {}
+
+
+def _segments(lines) -> np.ndarray:
+    if lines is None or len(lines) == 0:
+        return np.empty((0, 4), np.float32)
+    lines = np.asarray(lines, np.float32)
+    # pylsd adds the segment width as a fifth column, OpenCV an extra axis
+    return lines.reshape(len(lines), -1)[:, :4]
+
+
+def _instance(name: str, factory: Callable):
+    detector = _instances.get(name)
+    if detector is None:
+        detector = _instances[name] = factory()
+    return detector
+
+
+def detect_pylsd(edges: np.ndarray) -> np.ndarray:
+    return _segments(_pylsd(edges))
+
+
+def detect_opencv_lsd(edges: np.ndarray) -> np.ndarray:
+    detector = _instance("opencv_lsd", cv2.createLineSegmentDetector)
+    return _segments(detector.detect(edges)[0])
+
+
+def detect_fld(edges: np.ndarray) -> np.ndarray:
+    # a zero Canny aperture makes the detector take its input as the edge map,
+    # which it then erases while tracing the segments
+    detector = _instance("fld", lambda: cv2.ximgproc.createFastLineDetector(10, 1.414213562, 50, 50, 0, False))
+    return _segments(detector.detect(edges.copy()))
+
+
+def detect_hough(edges: np.ndarray) -> np.ndarray:
+    return _segments(cv2.HoughLinesP(
+        edges, 1, np.pi / 180, HOUGH_THRESHOLD, minLineLength=HOUGH_MIN_LENGTH, maxLineGap=HOUGH_MAX_GAP
+    ))
+
+
+DETECTORS = {
+    "pylsd": detect_pylsd,  # the pylsd package (LSD by von Gioi et al.)
+    "opencv_lsd": detect_opencv_lsd,  # cv2.createLineSegmentDetector
+    "fld": detect_fld,  # cv2.ximgproc.createFastLineDetector, needs opencv-contrib
+    "hough": detect_hough,  # cv2.HoughLinesP, always available
+}
+
+
+def is_available(name: str) -> bool:
+    if name == "pylsd":
+        return _pylsd is not None
+    if name == "opencv_lsd":
+        # OpenCV 3.4.6 to 4.5.0 shipped without the LSD implementation
+        try:
+            _instance("opencv_lsd", cv2.createLineSegmentDetector)
+        except cv2.error:
+            return False
+        return True
+    if name == "fld":
+        return hasattr(cv2, "ximgproc")
+    return name in DETECTORS
+
+
+def available() -> List[str]:
+    return [name for name in DETECTORS if is_available(name)]
+
+
+def get_detector(name: str) -> Callable[[np.ndarray], np.ndarray]:
+    """The named detector, or the first available one of FALLBACK_ORDER when it cannot run here."""
+    if name not in DETECTORS:
+        raise ValueError(f"Unknown line detector: {name}")
+    if not is_available(name):
+        fallback = next(other for other in FALLBACK_ORDER if is_available(other))
+        logger.warning(f"Line detector {name} is not available, using {fallback}")
+        name = fallback
+    return DETECTORS[name]
@@ -0,0 +1,193 @@
+import datetime
+import json
+import logging
+import time
+from html import escape
+from collections import Counter, defaultdict, deque
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List
+
+from aiogram import BaseMiddleware, Router, types
+from aiogram.filters import Command
+from aiogram.types import TelegramObject
+
+from config import METRICS_HISTORY_FILE, METRICS_TODAY_FILE, METRICS_SNAPSHOT_INTERVAL
+from methods.admins import is_admin
+from methods.scheduler import scheduler, IntervalTrigger
+from methods.utils import read_json_file, write_json_file
+
+logger = logging.getLogger(__name__)
+
+router = Router()
+
+# Counter groups kept per day
+GROUPS = ("events", "handlers", "langs", "chat_types")
+
+SPARK_BARS = "▁▂▃▄▅▆▇█"
+
+
+def _next_midnight() -> float:
+    tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+    return datetime.datetime.combine(tomorrow, datetime.time()).timestamp()
+
+
+class UsageMetrics:
+    """
+    In-memory usage counters for the current day.
+
+    Counting is a dict increment plus one timestamp comparison. At midnight
+    the day is rolled up into one compact JSON line appended to the history
+    file; the partial day is snapshotted periodically so restarts keep it.
+    """
+
+    def __init__(self, history_file: str = METRICS_HISTORY_FILE, today_file: str = METRICS_TODAY_FILE):
+        self.history_file = Path(history_file)
+        self.today_file = Path(today_file)
+        self.day = datetime.date.today().isoformat()
+        self.counters: Dict[str, Counter] = defaultdict(Counter)
+        self._rollover_at = _next_midnight()
+
+    def incr(self, group: str, key: str, amount: int = 1) -> None:
+        if time.time() >= self._rollover_at:
+            self.rollup()
+        self.counters[group][key] += amount
+
+    def record(self) -> Dict[str, Any]:
+        record = {"date": self.day}
+        for group in GROUPS:
+            if self.counters.get(group):
+                record[group] = dict(self.counters[group])
+        return record
+
+    def rollup(self) -> None:
+        """Append the finished day to the history file and start a new day."""
+        try:
+            self.history_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.history_file, "a", encoding="utf-8") as f:
+                f.write(json.dumps(self.record(), ensure_ascii=False, separators=(",", ":")) + "\n")
+        except Exception as e:
+            logger.error(f"Error writing usage history: {e}")
+        self.day = datetime.date.today().isoformat()
+        self.counters = defaultdict(Counter)
+        self._rollover_at = _next_midnight()
+        self.snapshot()
+
+    def tick(self) -> None:
+        """Periodic maintenance: roll the day over if it ended, otherwise snapshot it."""
+        if time.time() >= self._rollover_at:
+            self.rollup()
+        else:
+            self.snapshot()
+
+    def snapshot(self) -> None:
+        self.today_file.parent.mkdir(parents=True, exist_ok=True)
+        write_json_file(str(self.today_file), self.record())
+
+    def load(self) -> None:
+        """Restore the partial day saved before a restart, or roll it up if it is over."""
+        saved = read_json_file(str(self.today_file), default_data={})
+        if not saved.get("date"):
+            return
+        self.day = saved["date"]
+        self.counters = defaultdict(Counter, {
+            group: Counter(saved.get(group, {})) for group in GROUPS
+        })
+        if self.day != datetime.date.today().isoformat():
+            self.rollup()
+
+    def history(self, days: int) -> List[Dict[str, Any]]:
+        """Last `days` daily records, the current partial day included."""
+        records = deque(maxlen=max(days - 1, 0))
+        try:
+            with open(self.history_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        records.append(json.loads(line))
+        except FileNotFoundError:
+            pass
+        except json.JSONDecodeError as e:
+            logger.error(f"Error reading usage history: {e}")
+        return list(records) + [self.record()]
+
+
+usage_metrics = UsageMetrics()
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Inner middleware that counts calls per handler function."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        if handler_object is not None:
+            usage_metrics.incr("handlers", handler_object.callback.__name__)
+        return await handler(event, data)
+
+
+def sparkline(values: List[int]) -> str:
+    top = max(values) if values else 0
+    if not top:
+        return SPARK_BARS[0] * len(values)
+    return "".join(SPARK_BARS[min(len(SPARK_BARS) - 1, value * len(SPARK_BARS) // (top + 1))] for value in values)
+
+
+def format_history(records: List[Dict[str, Any]], top_count: int = 5) -> str:
+    events = [record.get("events", {}) for record in records]
+    updates = [day.get("updates", 0) for day in events]
+    new_users = [day.get("new_users", 0) for day in events]
+
+    lines = [f"{'Дата':<10} {'Апдейты':>8} {'Новые':>6} {'Рассылки':>8} {'Сканы':>6}"]
+    for record, day in zip(records, events):
+        lines.append(
+            f"{record['date']:<10} {day.get('updates', 0):>8} {day.get('new_users', 0):>6} "
+            f"{day.get('broadcasts', 0):>8} {day.get('scans', 0):>6}"
+        )
+
+    handlers = Counter()
+    langs = Counter()
+    chat_types = Counter()
+    for record in records:
+        handlers.update(record.get("handlers", {}))
+        langs.update(record.get("langs", {}))
+        chat_types.update(record.get("chat_types", {}))
+
+    lines.append("")
+    lines.append(f"Апдейты: {sparkline(updates)}")
+    lines.append(f"Новые:   {sparkline(new_users)}")
+    lines.append("")
+    lines.append("Топ обработчиков:")
+    lines += [f"  {name}: {count}" for name, count in handlers.most_common(top_count)]
+    lines.append("Языки: " + ", ".join(f"{lang} {count}" for lang, count in langs.most_common()))
+    lines.append("Чаты: " + ", ".join(f"{kind} {count}" for kind, count in chat_types.most_common()))
+    return "\n".join(lines)
+
+
+@router.message(Command("metrics_history"))
+async def cmd_metrics_history(message: types.Message):
+    if not is_admin(message.from_user.id):
+        await message.answer("У вас нет прав для выполнения этой команды.")
+        return
+
+    parts = message.text.split(maxsplit=1)
+    days = int(parts[1]) if len(parts) > 1 and parts[1].strip().isdigit() else 14
+    text = format_history(usage_metrics.history(max(1, min(days, 90))))
+    await message.answer(f"📈 <b>Использование по дням</b>\n<pre>{escape(text)}</pre>", parse_mode="HTML")
+
+
+async def _tick() -> None:
+    usage_metrics.tick()
+
+
+@router.startup()
+async def _on_start() -> None:
+    usage_metrics.load()
+    scheduler.add_job("usage_metrics", _tick, IntervalTrigger(METRICS_SNAPSHOT_INTERVAL))
+
+
+@router.shutdown()
+async def _on_shutdown() -> None:
+    usage_metrics.snapshot()
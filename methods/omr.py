@@ -0,0 +1,311 @@
+"""
+Optical mark recognition for scanned answer sheets.
+
+read_sheet() takes the warped page produced by DocScanner, thresholds it
+at a resolution where a bubble is a few pixels wide, aligns the expected
+bubble grid to it and measures how much of every bubble is filled using
+integral-image region sums, so all bubbles are measured in a handful of
+array operations.
+
+The bubble grid comes from OMR_LAYOUT_FILE, measured on the real answer
+sheet (see load_layout); DEFAULT_LAYOUT is the sheet drawn by
+benchmarks.synthetic_docs and only stands in until that file exists.
+"""
+import logging
+from dataclasses import dataclass, asdict, fields
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+
+from config import OMR_ANSWER_KEY_FILE, OMR_LAYOUT_FILE, MAX_SCORE
+from methods.utils import read_json_file
+
+logger = logging.getLogger(__name__)
+
+OPTION_LETTERS = "АБВГД"
+
+# Share of the inner bubble area that must be dark for a mark, and below which it is blank
+FILLED_RATIO = 0.5
+BLANK_RATIO = 0.25
+
+# Grid template correlation of a well aligned sheet
+GOOD_ALIGNMENT = 0.35
+
+# Width the sheet is normalized to before the grid is aligned and measured, and
+# the block size and offset of the threshold that separates ink from paper there
+WORK_WIDTH = 800
+INK_BLOCK = 51
+INK_OFFSET = 20
+
+# The grid is searched for within this share of the sheet size (less than half
+# a row pitch, so it cannot lock onto the neighbouring row) at every scale,
+# applied around the sheet center, of the candidates below
+SEARCH_MARGIN = 0.01
+SEARCH_SCALES = tuple(np.round(np.linspace(0.94, 1.06, 13), 2))
+
+
+@dataclass(frozen=True)
+class SheetLayout:
+    """
+    Bubble grid geometry as fractions of the sheet width (x, radius) and
+    height (y), so it does not depend on the scan resolution.
+    """
+    columns: int = 3
+    questions_per_column: int = 30
+    options: int = 5
+    first_x: float = 100 / 827
+    first_y: float = 260 / 1169
+    column_pitch: float = 235 / 827
+    option_pitch: float = 33 / 827
+    question_pitch: float = 29 / 1169
+    bubble_radius: float = 10 / 827
+
+    @property
+    def questions(self) -> int:
+        return self.columns * self.questions_per_column
+
+    def centers(self, width: float, height: float) -> np.ndarray:
+        """Bubble centers in pixels, shape (questions, options, 2)."""
+        question = np.arange(self.questions)
+        column, row = np.divmod(question, self.questions_per_column)
+        option = np.arange(self.options)
+        x = (self.first_x + column[:, np.newaxis] * self.column_pitch
+             + option[np.newaxis, :] * self.option_pitch) * width
+        y = np.broadcast_to(((self.first_y + row * self.question_pitch) * height)[:, np.newaxis], x.shape)
+        return np.stack([x, y], axis=2)
+
+
+# The sheet of benchmarks.synthetic_docs, not a calibrated ORT sheet
+DEFAULT_LAYOUT = SheetLayout()
+
+# Layout fields measured along the sheet width; the other distances are along its height
+_WIDTH_FIELDS = ("first_x", "column_pitch", "option_pitch", "bubble_radius")
+_HEIGHT_FIELDS = ("first_y", "question_pitch")
+
+_layout: Optional[SheetLayout] = None
+
+
+def load_layout(path: str = OMR_LAYOUT_FILE) -> Optional[SheetLayout]:
+    """
+    Layout file of the real answer sheet, measured in pixels on a straight
+    scan of a blank one: {"sheet_width": 2480, "sheet_height": 3508,
+    "columns": 3, "questions_per_column": 30, "options": 5, "first_x": ...,
+    "first_y": ..., "column_pitch": ..., "option_pitch": ...,
+    "question_pitch": ..., "bubble_radius": ...}, where first_x/first_y are
+    the center of the first bubble. Returns None when there is no file.
+    """
+    data = read_json_file(path, default_data={})
+    if not data:
+        return None
+    try:
+        width, height = float(data["sheet_width"]), float(data["sheet_height"])
+        values = {}
+        for name in (f.name for f in fields(SheetLayout)):
+            if name in _WIDTH_FIELDS:
+                values[name] = float(data[name]) / width
+            elif name in _HEIGHT_FIELDS:
+                values[name] = float(data[name]) / height
+            else:
+                values[name] = int(data[name])
+    except (KeyError, TypeError, ValueError) as e:
+        logger.error(f"Invalid OMR layout in {path}: {e!r}")
+        return None
+    return SheetLayout(**values)
+
+
+def sheet_layout() -> SheetLayout:
+    """The configured layout (read once per process), or DEFAULT_LAYOUT without one."""
+    global _layout
+    if _layout is None:
+        _layout = load_layout()
+        if _layout is None:
+            logger.warning(f"No OMR layout in {OMR_LAYOUT_FILE}, reading sheets with the synthetic one")
+            _layout = DEFAULT_LAYOUT
+    return _layout
+
+
+@dataclass
+class OmrResult:
+    answers: List[Optional[int]]  # marked option per question, None if blank or ambiguous
+    ambiguous: List[int]  # 1-based numbers of questions with several or partial marks
+    confidence: float  # 0..1, how much the reading can be trusted without review
+    alignment: float  # normalized correlation of the grid template with the sheet
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+
+def _ink_map(image: np.ndarray) -> np.ndarray:
+    """
+    Float map of dark pixels (1.0) on the sheet resized to WORK_WIDTH. The
+    threshold block spans a few bubbles, so solid marks stay solid while the
+    uneven lighting of a photo is still evened out.
+    """
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    height = max(1, int(round(image.shape[0] * WORK_WIDTH / image.shape[1])))
+    small = cv2.resize(image, (WORK_WIDTH, height), interpolation=cv2.INTER_AREA)
+    ink = cv2.adaptiveThreshold(small, 1, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, INK_BLOCK, INK_OFFSET)
+    return ink.astype(np.float32)
+
+
+def _grid_template(centers: np.ndarray, radius: float):
+    """Ring template of the bubble grid and the sheet position of its top left corner."""
+    points = centers.reshape(-1, 2)
+    pad = int(np.ceil(radius)) + 2
+    origin = points.min(axis=0) - pad
+    size = np.ceil(points.max(axis=0) - origin + pad).astype(int)
+    template = np.zeros((size[1], size[0]), np.float32)
+    ring_radius = int(round(radius))
+    for center in (points - origin).round().astype(int).tolist():
+        cv2.circle(template, center, ring_radius, 1.0, 1)
+    return template, origin
+
+
+def _match(ink: np.ndarray, centers: np.ndarray, radius: float, margin: int):
+    """Best correlation of the grid template around its expected position and the shift that gives it."""
+    height, width = ink.shape
+    template, origin = _grid_template(centers, radius)
+    x0, y0 = (np.maximum(0, origin - margin)).astype(int)
+    x1 = int(min(width, origin[0] + template.shape[1] + margin))
+    y1 = int(min(height, origin[1] + template.shape[0] + margin))
+    region = ink[y0:y1, x0:x1]
+    if region.shape[0] < template.shape[0] or region.shape[1] < template.shape[1]:
+        return -1.0, np.zeros(2)
+    scores = cv2.matchTemplate(region, template, cv2.TM_CCORR_NORMED)
+    _, score, _, location = cv2.minMaxLoc(scores)
+    return score, np.array([x0 + location[0], y0 + location[1]]) - origin
+
+
+def align_grid(ink: np.ndarray, layout: SheetLayout = DEFAULT_LAYOUT):
+    """
+    Finds the shift and the horizontal and vertical scale at which the bubble
+    grid best matches the sheet; the scanner's perspective transform leaves
+    the page slightly stretched or shifted when its corners are a bit off.
+    The scale is searched on a half-size map, then every column of bubbles
+    is shifted into place on its own.
+    Returns (centers of shape (questions, options, 2), bubble radius, correlation).
+    """
+    height, width = ink.shape
+    base = layout.centers(width, height)
+    middle = np.array([width / 2, height / 2])
+    radius = layout.bubble_radius * width
+    margin = int(SEARCH_MARGIN * max(width, height))
+    coarse = cv2.resize(ink, (width // 2, height // 2), interpolation=cv2.INTER_AREA)
+
+    def centers_at(scale):
+        return middle + (base - middle) * scale
+
+    # one axis at a time: vertical first, as the rows are denser than the options
+    best = (-1.0, np.ones(2), np.zeros(2))
+    for axis in (1, 0):
+        for value in SEARCH_SCALES:
+            scale = best[1].copy()
+            scale[axis] = value
+            score, shift = _match(coarse, centers_at(scale) / 2, radius * scale[0] / 2, margin // 2)
+            if score > best[0]:
+                best = (score, scale, shift * 2)
+    _, scale, shift = best
+    centers = centers_at(scale) + shift
+    radius *= scale[0]
+
+    scores = []
+    column_of = np.arange(layout.questions) // layout.questions_per_column
+    for column in range(layout.columns):
+        rows = column_of == column
+        score, shift = _match(ink, centers[rows], radius, max(2, int(radius / 2)))
+        centers[rows] += shift
+        scores.append(max(0.0, score))
+    return centers, radius, float(np.mean(scores))
+
+
+def fill_ratios(ink: np.ndarray, centers: np.ndarray, radius: float) -> np.ndarray:
+    """
+    Share of dark pixels in the square inscribed in every bubble (inside its
+    outline), computed for all bubbles at once from the integral image.
+    """
+    integral = cv2.integral(ink)
+    half = max(1, int(radius * 0.5))
+    height, width = ink.shape
+    cx = np.clip(centers[..., 0].round().astype(int), half, width - half - 1)
+    cy = np.clip(centers[..., 1].round().astype(int), half, height - half - 1)
+    x0, x1 = cx - half, cx + half + 1
+    y0, y1 = cy - half, cy + half + 1
+    sums = integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+    return sums / float((2 * half + 1) ** 2)
+
+
+def measure(image: np.ndarray, layout: SheetLayout = DEFAULT_LAYOUT):
+    """Fill ratio of every bubble, shape (questions, options), and the grid alignment score."""
+    ink = _ink_map(image)
+    centers, radius, alignment = align_grid(ink, layout)
+    # adaptive thresholding hollows out the middle of solid marks; closing fills
+    # those holes but not the much larger inside of an empty bubble
+    size = max(3, int(radius) | 1)
+    ink = cv2.morphologyEx(ink, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (size, size)))
+    return fill_ratios(ink, centers, radius), alignment
+
+
+def read_sheet(image: np.ndarray, layout: SheetLayout = DEFAULT_LAYOUT) -> OmrResult:
+    """Reads the marked answers from a warped (grayscale or color) scan of an answer sheet."""
+    fills, alignment = measure(image, layout)
+
+    order = np.argsort(fills, axis=1)
+    top = np.take_along_axis(fills, order[:, -1:], axis=1)[:, 0]
+    second = np.take_along_axis(fills, order[:, -2:-1], axis=1)[:, 0]
+    marked = (top >= FILLED_RATIO) & (second < BLANK_RATIO)
+    blank = top < BLANK_RATIO
+    ambiguous = ~(marked | blank)
+
+    answers = [int(option) if is_marked else None for option, is_marked in zip(order[:, -1], marked)]
+    # a misaligned grid (usually a badly detected page) reads noise, so a weak
+    # alignment caps the confidence
+    clear_share = 1.0 - ambiguous.mean()
+    confidence = float(clear_share * min(1.0, alignment / GOOD_ALIGNMENT))
+    return OmrResult(
+        answers=answers,
+        ambiguous=[int(i) + 1 for i in np.flatnonzero(ambiguous)],
+        confidence=round(confidence, 3),
+        alignment=round(alignment, 3),
+    )
+
+
+def load_answer_key(path: str = OMR_ANSWER_KEY_FILE) -> Optional[Dict]:
+    """
+    Answer key file: {"answers": ["А", "В", ...] or option indices, "points": 1,
+    "scale": [...]}. The optional scale is the ORT conversion table of the
+    test, the scaled score for 0, 1, 2, ... correct answers; without it the
+    score is correct * points. Returns None when no key is configured.
+    """
+    key = read_json_file(path, default_data={})
+    if not key.get("answers"):
+        return None
+    answers = [OPTION_LETTERS.index(a) if isinstance(a, str) else int(a) for a in key["answers"]]
+    return {"answers": answers, "points": key.get("points", 1), "scale": key.get("scale")}
+
+
+def score_answers(answers: List[Optional[int]], key: Dict) -> Dict:
+    correct = sum(1 for given, expected in zip(answers, key["answers"]) if given == expected)
+    scale = key.get("scale")
+    if scale:
+        score = scale[min(correct, len(scale) - 1)]
+    else:
+        score = correct * key["points"]
+    return {"correct": correct, "score": min(MAX_SCORE, int(round(score)))}
+
+
+def format_answers(answers: List[Optional[int]]) -> str:
+    return "".join(OPTION_LETTERS[a] if a is not None else "·" for a in answers)
+
+
+def summarize(result: OmrResult, key: Optional[Dict] = None) -> Dict:
+    """JSON-friendly summary of a reading, scored against the answer key when there is one."""
+    summary = {
+        "answers": format_answers(result.answers),
+        "ambiguous": result.ambiguous,
+        "confidence": result.confidence,
+    }
+    if key:
+        summary.update(score_answers(result.answers, key))
+    return summary
@@ -0,0 +1,320 @@
+import asyncio
+import copy
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field, fields
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+from config import (
+    BROADCAST_JOBS_FILE,
+    BROADCAST_RECIPIENTS_DIR,
+    PACED_BROADCAST_MAX_RATE,
+    PACED_BROADCAST_BUSY_RATE,
+    PACED_BROADCAST_MAX_SLOWDOWN,
+)
+from methods.traffic import traffic_monitor
+from methods.utils import read_json_file
+
+logger = logging.getLogger(__name__)
+
+# Persist progress after this many recipients or seconds, whichever comes first
+SAVE_EVERY_SENDS = 25
+SAVE_EVERY_SECONDS = 15
+PROGRESS_EVERY_SECONDS = 60
+
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_CANCELLED = "cancelled"
+STATUS_FAILED = "failed"
+
+
+@dataclass
+class BroadcastJob:
+    """
+    A broadcast delivered evenly over a time window, persisted across restarts.
+    The recipients are stored apart from the rest of the job, see BroadcastJobStore.
+    """
+    job_id: str
+    payload: Dict[str, Any]
+    window_seconds: int
+    deadline: str
+    created_at: str
+    total: int = 0
+    cursor: int = 0
+    sent: int = 0
+    failed: int = 0
+    status: str = STATUS_RUNNING
+    report_chat_id: Optional[int] = None
+    report_message_id: Optional[int] = None
+    finished_at: Optional[str] = None
+    # loaded only for delivering the job, see BroadcastJobStore.load_recipients
+    recipients: List[int] = field(default_factory=list, repr=False)
+
+
+class BroadcastJobStore:
+    """
+    JSON file with the state of all paced broadcast jobs, keyed by job id.
+
+    The recipient list of a job is written once, to a file of its own in
+    BROADCAST_RECIPIENTS_DIR, when the job is created; checkpoints only
+    rewrite the small state file. Both are replaced atomically, so a bot
+    killed mid-checkpoint leaves the previous state behind, never a
+    truncated file. All file access runs in a thread, off the event loop.
+    """
+
+    def __init__(self, path: str = BROADCAST_JOBS_FILE, recipients_dir: str = BROADCAST_RECIPIENTS_DIR):
+        self.path = path
+        self.recipients_dir = recipients_dir
+        # jobs checkpointing at the same time must not lose each other's state
+        self._lock = threading.Lock()
+
+    def _recipients_path(self, job_id: str) -> str:
+        return os.path.join(self.recipients_dir, f"{job_id}.json")
+
+    def _load_all(self) -> Dict[str, BroadcastJob]:
+        with self._lock:
+            data = read_json_file(self.path, default_data={})
+        jobs = {}
+        for job_id, raw in data.items():
+            # jobs saved before the recipients got a file of their own
+            recipients = raw.pop('recipients', None)
+            try:
+                job = BroadcastJob(**raw)
+            except TypeError as e:
+                logger.error(f"Skipping malformed broadcast job {job_id}: {e}")
+                continue
+            if recipients:
+                job.total = len(recipients)
+                if not os.path.exists(self._recipients_path(job_id)):
+                    self._write_recipients(job_id, recipients)
+            jobs[job_id] = job
+        return jobs
+
+    @staticmethod
+    def _write_atomic(path: str, data) -> None:
+        with open(path + ".part", "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+        os.replace(path + ".part", path)
+
+    def _write_recipients(self, job_id: str, recipients: List[int]) -> None:
+        os.makedirs(self.recipients_dir, exist_ok=True)
+        self._write_atomic(self._recipients_path(job_id), recipients)
+
+    def _read_recipients(self, job_id: str) -> List[int]:
+        path = self._recipients_path(job_id)
+        with open(path, "r", encoding="utf-8") as f:
+            recipients = json.load(f)
+        if not isinstance(recipients, list):
+            raise ValueError(f"{path} does not hold a recipient list")
+        return recipients
+
+    def _save(self, job_id: str, raw: Dict[str, Any], finished: bool) -> None:
+        with self._lock:
+            data = read_json_file(self.path, default_data={})
+            data[job_id] = raw
+            self._write_atomic(self.path, data)
+        if finished:
+            # finished jobs keep only the summary
+            try:
+                os.remove(self._recipients_path(job_id))
+            except FileNotFoundError:
+                pass
+
+    async def load_all(self) -> Dict[str, BroadcastJob]:
+        """All jobs, without their recipients."""
+        return await asyncio.to_thread(self._load_all)
+
+    async def get(self, job_id: str) -> Optional[BroadcastJob]:
+        return (await self.load_all()).get(job_id)
+
+    async def load_recipients(self, job_id: str) -> List[int]:
+        """
+        The stored recipients of a job. Raises OSError when the file is
+        missing or unreadable and ValueError when it holds no recipient list.
+        """
+        return await asyncio.to_thread(self._read_recipients, job_id)
+
+    async def create(self, job: BroadcastJob) -> None:
+        """Stores a new job together with its recipients."""
+        await asyncio.to_thread(self._write_recipients, job.job_id, job.recipients)
+        await self.save(job)
+
+    async def save(self, job: BroadcastJob) -> None:
+        """Checkpoints the state of a job: its cursor, counters and status."""
+        # snapshot on the loop, so the job can go on while the thread writes
+        raw = {f.name: copy.deepcopy(getattr(job, f.name)) for f in fields(job) if f.name != 'recipients'}
+        await asyncio.to_thread(self._save, job.job_id, raw, job.status != STATUS_RUNNING)
+
+
+job_store = BroadcastJobStore()
+
+# Jobs running in this process: their tasks and live state, by job id
+_running: Dict[str, asyncio.Task] = {}
+_live_jobs: Dict[str, BroadcastJob] = {}
+
+
+async def create_job(payload: Dict[str, Any], recipients: List[int], window_seconds: int,
+                     report_chat_id: Optional[int] = None, report_message_id: Optional[int] = None) -> BroadcastJob:
+    now = datetime.now()
+    job = BroadcastJob(
+        job_id=uuid.uuid4().hex[:8],
+        payload=payload,
+        window_seconds=window_seconds,
+        deadline=(now + timedelta(seconds=window_seconds)).isoformat(),
+        created_at=now.isoformat(),
+        total=len(recipients),
+        report_chat_id=report_chat_id,
+        report_message_id=report_message_id,
+        recipients=recipients,
+    )
+    await job_store.create(job)
+    return job
+
+
+def next_interval(remaining: int, seconds_left: float, load: float) -> float:
+    """
+    Delay before the next message. Spreads the remaining recipients over the
+    time left (never faster than PACED_BROADCAST_MAX_RATE) and stretches the
+    delay proportionally when interactive traffic is above the busy threshold.
+    """
+    interval = max(seconds_left / max(remaining, 1), 1.0 / PACED_BROADCAST_MAX_RATE)
+    if load > PACED_BROADCAST_BUSY_RATE:
+        interval *= min(load / PACED_BROADCAST_BUSY_RATE, PACED_BROADCAST_MAX_SLOWDOWN)
+    return interval
+
+
+def format_progress(job: BroadcastJob) -> str:
+    return (
+        f"Равномерная рассылка {job.job_id}\n"
+        f"Отправлено: {job.sent}/{job.total}\n"
+        f"Ошибок: {job.failed}\n"
+        f"Завершится до: {datetime.fromisoformat(job.deadline).strftime('%d.%m.%Y %H:%M')}"
+    )
+
+
+async def _report_progress(bot: Bot, job: BroadcastJob) -> None:
+    if not job.report_chat_id or not job.report_message_id:
+        return
+    try:
+        await bot.edit_message_text(
+            format_progress(job),
+            chat_id=job.report_chat_id,
+            message_id=job.report_message_id,
+        )
+    except Exception as e:
+        logger.debug(f"Could not update progress of broadcast {job.job_id}: {e}")
+
+
+async def _send_with_retry(bot: Bot, content, chat_id: int) -> bool:
+    while True:
+        try:
+            return bool(await content.send(bot, chat_id))
+        except TelegramRetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+
+
+async def run_job(bot: Bot, job: BroadcastJob, content) -> BroadcastJob:
+    """Deliver a job from its persisted cursor, pacing sends until the deadline."""
+    if not job.recipients:
+        try:
+            job.recipients = await job_store.load_recipients(job.job_id)
+            if len(job.recipients) != job.total:
+                raise ValueError(f"{len(job.recipients)} of {job.total} recipients stored")
+        except (OSError, ValueError) as e:
+            # the job keeps its total, so the report shows what was never sent
+            logger.error(f"Broadcast {job.job_id} cannot continue, its recipients are lost: {e}")
+            job.recipients = []
+            job.status = STATUS_FAILED
+            job.finished_at = datetime.now().isoformat()
+            await job_store.save(job)
+            await _report_progress(bot, job)
+            return job
+    deadline = datetime.fromisoformat(job.deadline)
+    last_save = last_progress = time.monotonic()
+    unsaved = 0
+
+    while job.cursor < job.total and job.status == STATUS_RUNNING:
+        if await _send_with_retry(bot, content, job.recipients[job.cursor]):
+            job.sent += 1
+        else:
+            job.failed += 1
+        job.cursor += 1
+        unsaved += 1
+
+        now = time.monotonic()
+        if unsaved >= SAVE_EVERY_SENDS or now - last_save >= SAVE_EVERY_SECONDS:
+            await job_store.save(job)
+            last_save, unsaved = now, 0
+        if now - last_progress >= PROGRESS_EVERY_SECONDS:
+            await _report_progress(bot, job)
+            last_progress = now
+
+        if job.cursor == job.total:
+            break
+        seconds_left = (deadline - datetime.now()).total_seconds()
+        await asyncio.sleep(next_interval(job.total - job.cursor, seconds_left, traffic_monitor.rate()))
+
+    if job.status == STATUS_RUNNING:
+        job.status = STATUS_DONE
+    job.finished_at = datetime.now().isoformat()
+    await job_store.save(job)
+    await _report_progress(bot, job)
+    return job
+
+
+def start_job(bot: Bot, job: BroadcastJob, content, on_done: Optional[Callable] = None) -> asyncio.Task:
+    async def runner():
+        try:
+            finished = await run_job(bot, job, content)
+            if on_done:
+                await on_done(finished)
+        except asyncio.CancelledError:
+            await job_store.save(job)
+            raise
+        except Exception as e:
+            logger.error(f"Paced broadcast {job.job_id} failed: {e}")
+            await job_store.save(job)
+        finally:
+            _running.pop(job.job_id, None)
+            _live_jobs.pop(job.job_id, None)
+
+    task = asyncio.create_task(runner())
+    _running[job.job_id] = task
+    _live_jobs[job.job_id] = job
+    logger.info(f"Paced broadcast {job.job_id} started at {job.cursor}/{job.total}")
+    return task
+
+
+async def resume_jobs(bot: Bot, build_content: Callable[[Dict[str, Any]], Any],
+                      on_done: Optional[Callable] = None) -> List[asyncio.Task]:
+    """Restart every persisted job that was still running when the bot stopped."""
+    tasks = []
+    for job in (await job_store.load_all()).values():
+        if job.status == STATUS_RUNNING and job.job_id not in _running:
+            tasks.append(start_job(bot, job, build_content(job.payload), on_done))
+    return tasks
+
+
+async def cancel_job(job_id: str) -> bool:
+    """Stop a job. A live job finishes its current send and saves itself."""
+    job = _live_jobs.get(job_id) or await job_store.get(job_id)
+    if not job or job.status != STATUS_RUNNING:
+        return False
+    job.status = STATUS_CANCELLED
+    if job_id not in _live_jobs:
+        await job_store.save(job)
+    return True
+
+
+async def running_jobs() -> List[BroadcastJob]:
+    jobs = {job.job_id: job for job in (await job_store.load_all()).values() if job.status == STATUS_RUNNING}
+    jobs.update(_live_jobs)
+    return list(jobs.values())
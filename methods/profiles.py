@@ -10,6 +10,7 @@ class Profile:
     ort_score: int
     scores: Dict[str, Dict[str, int]] = field(default_factory=dict)
     timestamp: str = None
+    omr: Optional[Dict] = None  # answer sheet reading, see methods.omr.summarize
 
 class ProfileManager:
     def __init__(self):
@@ -42,12 +43,14 @@ class ProfileManager:
             }
         return None
 
-    async def add_pending_profile(self, user_id: int, full_name: str, ort_score: int) -> None:
+    async def add_pending_profile(self, user_id: int, full_name: str, ort_score: int,
+                                  omr: Optional[Dict] = None) -> None:
         profile = Profile(
             user_id=user_id,
             full_name=full_name,
             ort_score=ort_score,
-            timestamp=datetime.datetime.now().isoformat()
+            timestamp=datetime.datetime.now().isoformat(),
+            omr=omr
         )
         data = self._read_pending_profiles()
         data["pending"][str(user_id)] = profile.__dict__
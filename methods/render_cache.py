@@ -0,0 +1,72 @@
+"""
+Cache of rendered LaTeX tasks, so a document rendered before is neither
+compiled, rasterized nor uploaded again.
+
+Every artifact (the PDF, the PNG at a given DPI) is an entry of its own,
+keyed by a hash of the stand.cls version, the document, the format and the
+DPI (see render_key), and may carry the Telegram file_id it was sent as.
+Storage, least recently used eviction and file_ids work as in ScanCache.
+"""
+import hashlib
+import os
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+from config import LATEX_CLASS_FILE, LATEX_CACHE_DIR, LATEX_CACHE_MAX_BYTES, LATEX_CACHE_MEMORY_BYTES
+from methods.scan_cache import ScanCache
+
+render_cache = ScanCache(LATEX_CACHE_DIR, LATEX_CACHE_MAX_BYTES, LATEX_CACHE_MEMORY_BYTES)
+
+# (mtime, size) of stand.cls and its hash
+_class_version: Tuple[Optional[Tuple[int, int]], str] = (None, "")
+
+
+def class_version() -> str:
+    """Hash of stand.cls, read again only when the file changes."""
+    global _class_version
+    stat = os.stat(LATEX_CLASS_FILE)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    if _class_version[0] != stamp:
+        with open(LATEX_CLASS_FILE, "rb") as f:
+            _class_version = (stamp, hashlib.sha256(f.read()).hexdigest())
+    return _class_version[1]
+
+
+def render_key(document: str, fmt: str, dpi: Optional[int] = None) -> str:
+    digest = hashlib.sha256()
+    # the DPI only matters to raster formats
+    for part in (class_version(), document, fmt, str(dpi) if fmt == "png" else ""):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return f"latex:{digest.hexdigest()}"
+
+
+def render_keys(document: str, formats: Iterable[str], dpi: Optional[int] = None) -> Dict[str, str]:
+    return {fmt: render_key(document, fmt, dpi) for fmt in formats}
+
+
+def restore_render(document: str, formats: Iterable[str], dpi: Optional[int], directory: Path,
+                   output_name: str) -> Optional[Dict[str, str]]:
+    """
+    Writes the cached artifacts of document to directory as output_name.<format>
+    and returns their paths by format; None unless every format is cached.
+    """
+    keys = render_keys(document, formats, dpi)
+    if not all(render_cache.get(key) for key in keys.values()):
+        return None
+    files = {}
+    for fmt, key in keys.items():
+        data = render_cache.read(key)
+        if data is None:
+            return None
+        path = directory / f"{output_name}.{fmt}"
+        path.write_bytes(data)
+        files[fmt] = str(path)
+    return files
+
+
+def store_render(document: str, files: Dict[str, str], dpi: Optional[int]) -> None:
+    """Caches the artifacts rendered from document, given as paths by format."""
+    for fmt, path in files.items():
+        with open(path, "rb") as f:
+            render_cache.put(render_key(document, fmt, dpi), f.read(), format=fmt)
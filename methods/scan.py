@@ -1,14 +1,20 @@
-# USAGE:
-# python scan.py (--images <IMG_DIR> | --image <IMG_PATH>) [-i]
+# USAGE (from the repository root):
+# python -m methods.scan (--images <IMG_DIR> | --image <IMG_PATH>) [-i] [-o <OUTPUT_DIR>]
 # For example, to scan a single image with interactive mode:
-# python scan.py --image sample_images/desk.JPG -i
-# To scan all images in a directory automatically:
-# python scan.py --images sample_images
+# python -m methods.scan --image sample_images/desk.JPG -i
+# To scan all images in a directory automatically, using every CPU core:
+# python -m methods.scan --images sample_images
+# To rescan an archive recursively into PNGs, skipping images scanned by an earlier run:
+# python -m methods.scan --images archive -r -o scans --format png --resume
 
-# Scanned images will be output to directory named 'output'
+# Scanned images will be output to directory named 'output' unless -o is given.
+# Batch runs write a JSON summary with per-image timings to <OUTPUT_DIR>/summary.json
 
 from pyimagesearch import transform
 from pyimagesearch import imutils
+from methods import scan_encoders
+from methods import scan_quality
+from methods import line_detectors
 from scipy.spatial import distance as dist
 from matplotlib.patches import Polygon
 import polygon_interacter as poly_i
@@ -16,16 +22,95 @@ import numpy as np
 import matplotlib.pyplot as plt
 import itertools
 import math
+from collections import Counter
 import cv2
-from pylsd.lsd import lsd
 
 import argparse
+import json
 import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+# JPEG start-of-frame markers, which carry the image dimensions
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# OpenCV flags that decode a JPEG directly at 1/2, 1/4 or 1/8 of its size
+REDUCED_DECODE_FLAGS = [
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+]
+
+def jpeg_dimensions(data):
+    """
+    Returns (width, height) read from the JPEG header without decoding the image,
+    or None if the data is not a JPEG or the header is malformed.
+    """
+    if data[:2] != b"\xff\xd8":
+        return None
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker in JPEG_SOF_MARKERS:
+            height = int.from_bytes(data[i + 5:i + 7], "big")
+            width = int.from_bytes(data[i + 7:i + 9], "big")
+            return width, height
+        if marker == 0x01 or 0xD0 <= marker <= 0xD9:
+            i += 2
+            continue
+        i += 2 + int.from_bytes(data[i + 2:i + 4], "big")
+    return None
+
+def result_size(result):
+    """Size reported to a tracer: an array's shape, a list's length, or None."""
+    if isinstance(result, tuple) and result:
+        # (value, extra) results such as (contour, confidence)
+        result = result[0]
+    if isinstance(result, np.ndarray):
+        return tuple(result.shape)
+    if isinstance(result, (list, bytes)):
+        return (len(result),)
+    return None
+
+class ScanTrace:
+    """
+    A DocScanner tracer that keeps a (stage, seconds, size) record of every
+    stage it is told about, in order.
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def __call__(self, stage, seconds, size):
+        self.records.append((stage, seconds, size))
+
+def write_image(path, image):
+    """
+    Writes the image in the format given by the path extension. The file is written
+    under a temporary name first, so an interrupted run never leaves a partial output.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    root, ext = os.path.splitext(path)
+    tmp_path = root + ".part" + ext
+    params = [cv2.IMWRITE_JPEG_QUALITY, 95] if ext.lower() in (".jpg", ".jpeg") else []
+    if not cv2.imwrite(tmp_path, image, params):
+        raise IOError("Could not write " + path)
+    os.replace(tmp_path, path)
 
 class DocScanner(object):
     """An image scanner"""
 
-    def __init__(self, interactive=False, MIN_QUAD_AREA_RATIO=0.25, MAX_QUAD_ANGLE_RANGE=40, preserve_quality=True, apply_filters=True):
+    def __init__(self, interactive=False, MIN_QUAD_AREA_RATIO=0.25, MAX_QUAD_ANGLE_RANGE=40, preserve_quality=True, apply_filters=True,
+                 MIN_CONTOUR_CONFIDENCE=0.8, tracer=None, output_format=None, jpeg_target_bytes=300000,
+                 quality_gate=False, quality_shadow=(), line_detector="pylsd"):
         """
         Args:
             interactive (boolean): If True, user can adjust screen contour before
@@ -39,8 +124,40 @@ class DocScanner(object):
                 Defaults to False.
             apply_filters (boolean): If True, apply grayscale conversion, sharpening 
                 and adaptive threshold. If False, return color image. Defaults to True.
+            MIN_CONTOUR_CONFIDENCE (float): A valid contour found directly in the edge map
+                is accepted without running the LSD corner search when its confidence
+                (see contour_confidence) is at least this value. Defaults to 0.8.
+            tracer (callable): If given, called as tracer(stage, seconds, size) after every
+                stage of a scan with its wall time and the size of its result, see
+                ScanTrace. Defaults to None.
+            output_format (str): Encoding of scan_bytes results, one of scan_encoders.FORMATS
+                (e.g. "png1" for a 1-bit PNG). If None, PNG when preserve_quality is set and
+                JPEG otherwise. Defaults to None.
+            jpeg_target_bytes (int): Size budget of the "jpeg" output format. Defaults to 300000.
+            quality_gate (boolean): If True, photos that are blurry, dark, glared or show the
+                document too small are rejected with scan_quality.PhotoQualityError before
+                the full-resolution decode. Defaults to False.
+            quality_shadow (tuple): Problem codes of scan_quality (e.g. scan_quality.GLARE)
+                the quality gate only measures: they are reported in last_quality instead of
+                rejecting the photo. Defaults to ().
+            line_detector (str): Line segment detector get_corners runs on the edge map, one
+                of line_detectors.DETECTORS; one that cannot run here is replaced by an
+                available one. Defaults to "pylsd".
         """        
         self.interactive = interactive
+        self.tracer = tracer
+        self.output_format = output_format
+        self.jpeg_target_bytes = jpeg_target_bytes
+        self.quality_gate = quality_gate
+        self.quality_shadow = tuple(quality_shadow)
+        # measurements of the last photo the quality gate let through
+        self.last_quality = None
+        self.line_detector = line_detector
+        self._detect_lines = line_detectors.get_detector(line_detector)
+        self.MIN_CONTOUR_CONFIDENCE = MIN_CONTOUR_CONFIDENCE
+        # which strategy produced the last contour, and how often each one won
+        self.last_stage = None
+        self.stage_counts = Counter()
         self.MIN_QUAD_AREA_RATIO = MIN_QUAD_AREA_RATIO
         self.MAX_QUAD_ANGLE_RANGE = MAX_QUAD_ANGLE_RANGE
         self.preserve_quality = preserve_quality
@@ -48,15 +165,17 @@ class DocScanner(object):
 
     def filter_corners(self, corners, min_dist=20):
         """Filters corners that are within min_dist of others"""
-        def predicate(representatives, corner):
-            return all(dist.euclidean(representative, corner) >= min_dist
-                       for representative in representatives)
-
-        filtered_corners = []
-        for c in corners:
-            if predicate(filtered_corners, c):
-                filtered_corners.append(c)
-        return filtered_corners
+        if len(corners) == 0:
+            return []
+
+        # all pairwise distances at once; a corner is kept when it is not
+        # close to any corner kept before it
+        points = np.asarray(corners, dtype=np.float64).reshape(-1, 2)
+        close = dist.squareform(dist.pdist(points)) < min_dist
+        keep = np.zeros(len(points), dtype=bool)
+        for i in range(len(points)):
+            keep[i] = not close[i, keep].any()
+        return [corners[i] for i in np.flatnonzero(keep)]
 
     def angle_between_vectors_degrees(self, u, v):
         """Returns the angle between two vectors in degrees"""
@@ -83,14 +202,47 @@ class DocScanner(object):
         The input quadrilateral must be a numpy array with vertices ordered clockwise
         starting with the top left vertex.
         """
-        tl, tr, br, bl = quad
-        ura = self.get_angle(tl[0], tr[0], br[0])
-        ula = self.get_angle(bl[0], tl[0], tr[0])
-        lra = self.get_angle(tr[0], br[0], bl[0])
-        lla = self.get_angle(br[0], bl[0], tl[0])
+        return self.angle_ranges(np.asarray(quad).reshape(1, 4, 2))[0]
 
-        angles = [ura, ula, lra, lla]
-        return np.ptp(angles)          
+    def angle_ranges(self, quads):
+        """
+        Vectorized angle_range for an array of quadrilaterals of shape (N, 4, 2).
+        Degenerate quadrilaterals (repeated vertices) get an infinite range.
+        """
+        quads = np.asarray(quads, dtype=np.float64)
+        prev_vec = np.roll(quads, 1, axis=1) - quads
+        next_vec = np.roll(quads, -1, axis=1) - quads
+        dot = (prev_vec * next_vec).sum(axis=2)
+        norms = np.linalg.norm(prev_vec, axis=2) * np.linalg.norm(next_vec, axis=2)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            angles = np.degrees(np.arccos(np.clip(dot / norms, -1.0, 1.0)))
+        ranges = np.ptp(angles, axis=1)
+        return np.where(np.isnan(ranges), np.inf, ranges)
+
+    def best_quad(self, corners, top_k=5):
+        """
+        Returns the quadrilateral (shape (4, 1, 2), int32) built from four of the
+        corners that has the smallest angle range among the top_k largest ones.
+        All candidate quadrilaterals are ordered and scored as array operations.
+        """
+        points = np.asarray(corners, dtype=np.float32).reshape(-1, 2)
+        combos = np.fromiter(
+            itertools.chain.from_iterable(itertools.combinations(range(len(points)), 4)),
+            dtype=np.intp).reshape(-1, 4)
+        quads = transform.order_points_batch(points[combos]).astype(np.int32)
+
+        # shoelace areas
+        x = quads[:, :, 0].astype(np.float64)
+        y = quads[:, :, 1].astype(np.float64)
+        areas = 0.5 * np.abs((x * np.roll(y, -1, axis=1) - np.roll(x, -1, axis=1) * y).sum(axis=1))
+
+        # top k quadrilaterals by area, then the one with the smallest angle range
+        k = min(top_k, len(areas))
+        top = np.argpartition(-areas, k - 1)[:k]
+        top = top[np.argsort(-areas[top], kind="stable")]
+        ranges = self.angle_ranges(quads[top])
+        best = top[np.argsort(ranges, kind="stable")[0]]
+        return quads[best].reshape(4, 1, 2)
 
     def get_corners(self, img):
         """
@@ -99,9 +251,9 @@ class DocScanner(object):
         This is a utility function used by get_contours. The input image is expected 
         to be rescaled and Canny filtered prior to be passed in.
         """
-        lines = lsd(img)
+        lines = self._traced("lines", self._detect_lines, img)
 
-        # massages the output from LSD
+        # massages the output of the line detector (LSD by default)
         # LSD operates on edges. One "line" has 2 edges, and so we need to combine the edges back into lines
         # 1. separate out the lines into horizontal and vertical lines.
         # 2. Draw the horizontal lines back onto a canvas, but slightly thicker and longer.
@@ -112,13 +264,13 @@ class DocScanner(object):
         # 7. Draw all the final lines onto another canvas. Where the lines overlap are also corners
 
         corners = []
-        if lines is not None:
+        if len(lines):
             # separate out the horizontal and vertical lines, and draw them back onto separate canvases
-            lines = lines.squeeze().astype(np.int32).tolist()
+            lines = lines.astype(np.int32).tolist()
             horizontal_lines_canvas = np.zeros(img.shape, dtype=np.uint8)
             vertical_lines_canvas = np.zeros(img.shape, dtype=np.uint8)
             for line in lines:
-                x1, y1, x2, y2, _ = line
+                x1, y1, x2, y2 = line
                 if abs(x2 - x1) > abs(y2 - y1):
                     (x1, y1), (x2, y2) = sorted(((x1, y1), (x2, y2)), key=lambda pt: pt[0])
                     cv2.line(horizontal_lines_canvas, (max(x1 - 5, 0), y1), (min(x2 + 5, img.shape[1] - 1), y2), 255, 2)
@@ -163,7 +315,7 @@ class DocScanner(object):
             corners += zip(corners_x, corners_y)
 
         # remove corners in close proximity
-        corners = self.filter_corners(corners)
+        corners = self._traced("corner_filter", self.filter_corners, corners)
         return corners
 
     def is_valid_contour(self, cnt, IM_WIDTH, IM_HEIGHT):
@@ -172,54 +324,103 @@ class DocScanner(object):
         return (len(cnt) == 4 and cv2.contourArea(cnt) > IM_WIDTH * IM_HEIGHT * self.MIN_QUAD_AREA_RATIO 
             and self.angle_range(cnt) < self.MAX_QUAD_ANGLE_RANGE)
 
-
-    def get_contour(self, rescaled_image):
+    def contour_confidence(self, approx, contour):
         """
-        Returns a numpy array of shape (4, 2) containing the vertices of the four corners
-        of the document in the image. It considers the corners returned from get_corners()
-        and uses heuristics to choose the four corners that most likely represent
-        the corners of the document. If no corners were found, or the four corners represent
-        a quadrilateral that is too small or convex, it returns the original four corners.
+        Returns a score in [0, 1] for a quadrilateral approximated from a contour: how
+        close its interior angles are to each other, times how well the four corners
+        cover the raw contour (a sheet of paper is a clean quadrilateral).
+        """
+        angle_score = max(0.0, 1.0 - self.angle_range(approx) / self.MAX_QUAD_ANGLE_RANGE)
+        approx_area = cv2.contourArea(approx)
+        contour_area = cv2.contourArea(contour)
+        if approx_area <= 0 or contour_area <= 0:
+            return 0.0
+        fit_score = min(approx_area, contour_area) / max(approx_area, contour_area)
+        return angle_score * fit_score
+
+    def _edge_contour(self, edged, IM_WIDTH, IM_HEIGHT):
+        """
+        Returns the first valid quadrilateral approximated from the largest contours of
+        the edged image together with its confidence, or (None, 0.0).
         """
+        (cnts, hierarchy) = cv2.findContours(edged, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        cnts = sorted(cnts, key=cv2.contourArea, reverse=True)[:5]
+
+        # loop over the contours
+        for c in cnts:
+            # approximate the contour
+            approx = cv2.approxPolyDP(c, 80, True)
+            if self.is_valid_contour(approx, IM_WIDTH, IM_HEIGHT):
+                return approx, self.contour_confidence(approx, c)
+        return None, 0.0
+
+    def _traced(self, stage, func, *args, **kwargs):
+        """Calls func and reports its wall time and result size to the tracer, if there is one."""
+        if self.tracer is None:
+            return func(*args, **kwargs)
+        started = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.tracer(stage, time.perf_counter() - started, result_size(result))
+        return result
+
+    def _record_stage(self, stage):
+        self.last_stage = stage
+        self.stage_counts[stage] += 1
+
+
+    def edge_map(self, rescaled_image):
+        """Returns the Canny edge map of the rescaled image used for document detection."""
 
         # these constants are carefully chosen
         MORPH = 9
         CANNY = 84
         HOUGH = 25
 
-        IM_HEIGHT, IM_WIDTH, _ = rescaled_image.shape
-
         # convert the image to grayscale and blur it slightly
-        gray = cv2.cvtColor(rescaled_image, cv2.COLOR_BGR2GRAY)
-        gray = cv2.GaussianBlur(gray, (7,7), 0)
+        gray = self._traced("gray", cv2.cvtColor, rescaled_image, cv2.COLOR_BGR2GRAY)
+        gray = self._traced("blur", cv2.GaussianBlur, gray, (7,7), 0)
 
         # dilate helps to remove potential holes between edge segments
         kernel = cv2.getStructuringElement(cv2.MORPH_RECT,(MORPH,MORPH))
-        dilated = cv2.morphologyEx(gray, cv2.MORPH_CLOSE, kernel)
+        dilated = self._traced("morph", cv2.morphologyEx, gray, cv2.MORPH_CLOSE, kernel)
 
         # find edges and mark them in the output map using the Canny algorithm
-        edged = cv2.Canny(dilated, 0, CANNY)
-        test_corners = self.get_corners(edged)
+        return self._traced("canny", cv2.Canny, dilated, 0, CANNY)
 
-        approx_contours = []
+    def get_contour(self, rescaled_image):
+        """
+        Returns a numpy array of shape (4, 2) containing the vertices of the four corners
+        of the document in the image. It first tries the cheap contour approximation of the
+        edged image and accepts it when its confidence is high enough. Otherwise it also
+        considers the corners returned from get_corners() and uses heuristics to choose the
+        four corners that most likely represent the corners of the document. If no corners
+        were found, or the four corners represent a quadrilateral that is too small or
+        convex, it returns the original four corners. The winning stage ("contours", "lsd"
+        or "fallback") is stored in last_stage.
+        """
 
-        if len(test_corners) >= 4:
-            quads = []
+        IM_HEIGHT, IM_WIDTH, _ = rescaled_image.shape
+        edged = self.edge_map(rescaled_image)
 
-            for quad in itertools.combinations(test_corners, 4):
-                points = np.array(quad)
-                points = transform.order_points(points)
-                points = np.array([[p] for p in points], dtype = "int32")
-                quads.append(points)
+        # cheap stage: contours found directly in the edged image
+        edge_approx, confidence = self._traced("contours", self._edge_contour, edged, IM_WIDTH, IM_HEIGHT)
+        if edge_approx is not None and confidence >= self.MIN_CONTOUR_CONFIDENCE:
+            self._record_stage("contours")
+            return edge_approx.reshape(4, 2)
 
-            # get top five quadrilaterals by area
-            quads = sorted(quads, key=cv2.contourArea, reverse=True)[:5]
-            # sort candidate quadrilaterals by their angle range, which helps remove outliers
-            quads = sorted(quads, key=self.angle_range)
+        # expensive stage: corners of the line segments found by LSD
+        test_corners = self.get_corners(edged)
 
-            approx = quads[0]
+        approx_contours = []
+        lsd_approx = None
+
+        if len(test_corners) >= 4:
+            # among the top five quadrilaterals by area, take the one with the smallest
+            # angle range, which helps remove outliers
+            approx = self._traced("quad_search", self.best_quad, test_corners)
             if self.is_valid_contour(approx, IM_WIDTH, IM_HEIGHT):
                 approx_contours.append(approx)
+                lsd_approx = approx
 
             # for debugging: uncomment the code below to draw the corners and countour found 
             # by get_corners() and overlay it on the image
@@ -229,18 +430,10 @@ class DocScanner(object):
             # plt.imshow(rescaled_image)
             # plt.show()
 
-        # also attempt to find contours directly from the edged image, which occasionally 
-        # produces better results
-        (cnts, hierarchy) = cv2.findContours(edged.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        cnts = sorted(cnts, key=cv2.contourArea, reverse=True)[:5]
-
-        # loop over the contours
-        for c in cnts:
-            # approximate the contour
-            approx = cv2.approxPolyDP(c, 80, True)
-            if self.is_valid_contour(approx, IM_WIDTH, IM_HEIGHT):
-                approx_contours.append(approx)
-                break
+        # the low-confidence contour from the cheap stage still competes, as it
+        # occasionally produces better results
+        if edge_approx is not None:
+            approx_contours.append(edge_approx)
 
         # If we did not find any valid contours, just use the whole image
         if not approx_contours:
@@ -249,9 +442,11 @@ class DocScanner(object):
             BOTTOM_LEFT = (0, IM_HEIGHT)
             TOP_LEFT = (0, 0)
             screenCnt = np.array([[TOP_RIGHT], [BOTTOM_RIGHT], [BOTTOM_LEFT], [TOP_LEFT]])
+            self._record_stage("fallback")
 
         else:
             screenCnt = max(approx_contours, key=cv2.contourArea)
+            self._record_stage("lsd" if screenCnt is lsd_approx else "contours")
             
         return screenCnt.reshape(4, 2)
 
@@ -269,26 +464,35 @@ class DocScanner(object):
         new_points = np.array([[p] for p in new_points], dtype = "int32")
         return new_points.reshape(4, 2)
 
-    def _process_image(self, image):
-        """Process an image and return the scanned result as a numpy array."""
-
+    @property
+    def rescaled_height(self):
         # Increase processing resolution for better edge detection
-        RESCALED_HEIGHT = 800.0 if self.preserve_quality else 500.0
+        return 800.0 if self.preserve_quality else 500.0
 
+    def _detect_contour(self, image):
+        """
+        Returns the document contour in coordinates of the image rescaled to
+        rescaled_height. The image may be a reduced decode of the full photo.
+        """
         assert image is not None
 
-        ratio = image.shape[0] / RESCALED_HEIGHT
-        orig = image.copy()
-        rescaled_image = imutils.resize(image, height=int(RESCALED_HEIGHT))
+        rescaled_image = self._traced("resize", imutils.resize, image, height=int(self.rescaled_height))
 
         # get the contour of the document
         screenCnt = self.get_contour(rescaled_image)
 
         if self.interactive:
             screenCnt = self.interactive_get_contour(screenCnt, rescaled_image)
+        return screenCnt
 
-        # apply the perspective transformation
-        warped = transform.four_point_transform(orig, screenCnt * ratio)
+    def _process_image(self, image, screenCnt=None):
+        """
+        Process an image and return the scanned result as a numpy array.
+        The contour is detected on the image itself unless screenCnt is given.
+        """
+        warped = self._warp(image, screenCnt)
+        # drop our reference to the full-resolution photo as early as possible
+        del image
 
         # If apply_filters is False, return the warped color image
         if not self.apply_filters:
@@ -296,35 +500,123 @@ class DocScanner(object):
 
         # convert the warped image to grayscale
         gray = cv2.cvtColor(warped, cv2.COLOR_BGR2GRAY)
+        del warped
 
-        # sharpen image
-        sharpen = cv2.GaussianBlur(gray, (0,0), 3)
-        sharpen = cv2.addWeighted(gray, 1.5, sharpen, -0.5, 0)
+        return self.threshold(gray)
+
+    def _warp(self, image, screenCnt=None):
+        """Returns the document cut out of the image and seen from straight above."""
+        assert image is not None
+
+        if screenCnt is None:
+            screenCnt = self._detect_contour(image)
+        ratio = image.shape[0] / self.rescaled_height
+
+        # apply the perspective transformation; it does not modify the source
+        # image, so no copy of the full-resolution photo is needed
+        return self._traced("warp", transform.four_point_transform, image, screenCnt * ratio)
+
+    def threshold(self, gray):
+        """Returns the sharpened, adaptively thresholded black and white version of a grayscale image."""
+
+        sharpen = self._traced("sharpen", self.sharpen, gray)
 
         # apply adaptive threshold to get black and white effect
-        thresh = cv2.adaptiveThreshold(sharpen, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 21, 15)
+        thresh = self._traced("threshold", cv2.adaptiveThreshold,
+                              sharpen, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 21, 15)
 
         return thresh
 
-    def scan(self, image_path):
+    def sharpen(self, gray):
+        """Returns an unsharp-masked copy of a grayscale image."""
 
-        OUTPUT_DIR = 'output'
+        # sharpen image (in place, reusing the blurred buffer)
+        sharpen = cv2.GaussianBlur(gray, (0,0), 3)
+        cv2.addWeighted(gray, 1.5, sharpen, -0.5, 0, dst=sharpen)
+        return sharpen
 
-        image = cv2.imread(image_path)
+    def scan(self, image_path, output_path=None):
+        """
+        Scan the image file and write the result to output_path, by default
+        to a file with the same name in the 'output' directory.
+        """
+        if output_path is None:
+            output_path = os.path.join('output', os.path.basename(image_path))
 
-        basename = os.path.basename(image_path)
-        result = self._process_image(image)
+        nparr = np.fromfile(image_path, np.uint8)
+        result = self._process_image(*self._decode_for_scan(nparr))
 
-        cv2.imwrite(OUTPUT_DIR + '/' + basename, result)
-        print("Proccessed " + basename)
+        write_image(output_path, result)
+        print("Proccessed " + os.path.basename(image_path))
+
+    def check_quality(self, image):
+        """Raises scan_quality.PhotoQualityError if the photo is not worth scanning."""
+        quality = self._traced("quality", scan_quality.check, image, self.quality_shadow)
+        if not quality.ok:
+            raise scan_quality.PhotoQualityError(quality)
+        self.last_quality = quality
+
+    def _decode_for_scan(self, nparr):
+        """
+        Returns the full-resolution image and the document contour. For large
+        JPEGs the contour is detected on a reduced decode (1/2, 1/4 or 1/8 of
+        the size, chosen from the header dimensions) that still covers the
+        detection resolution, so the full image is decoded once, only for the
+        perspective transform. With quality_gate the photo is checked on the
+        reduced decode too, before any of the expensive work.
+        """
+        dimensions = jpeg_dimensions(nparr[:65536].tobytes())
+        if dimensions:
+            # EXIF rotation may swap the sides, so require both to be large enough
+            short_side = min(dimensions)
+            for factor, flag in REDUCED_DECODE_FLAGS:
+                if short_side / factor >= self.rescaled_height:
+                    reduced = self._traced("decode_reduced", cv2.imdecode, nparr, flag)
+                    if reduced is None:
+                        break
+                    if self.quality_gate:
+                        self.check_quality(reduced)
+                    screenCnt = self._detect_contour(reduced)
+                    del reduced
+                    return self._traced("decode", cv2.imdecode, nparr, cv2.IMREAD_COLOR), screenCnt
+        image = self._traced("decode", cv2.imdecode, nparr, cv2.IMREAD_COLOR)
+        if self.quality_gate and image is not None:
+            self.check_quality(image)
+        return image, None
 
     def scan_bytes(self, image_bytes):
         """Scan an image provided as bytes and return processed image bytes."""
 
         nparr = np.frombuffer(image_bytes, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        result = self._process_image(image)
-        
+        result = self._process_image(*self._decode_for_scan(nparr))
+        return self.encode(result)
+
+    def scan_sheet_bytes(self, image_bytes, layout=None):
+        """
+        Scan a photo of an answer sheet provided as bytes. Returns the processed
+        image bytes and the marks read from the sheet (an omr.OmrResult).
+        """
+        from methods import omr
+
+        nparr = np.frombuffer(image_bytes, np.uint8)
+        warped = self._warp(*self._decode_for_scan(nparr))
+        # the marks are read from the untouched page: the scan's adaptive
+        # threshold hollows out solid marks on high resolution photos
+        reading = self._traced("omr", omr.read_sheet, warped, layout or omr.sheet_layout())
+        if self.apply_filters:
+            gray = cv2.cvtColor(warped, cv2.COLOR_BGR2GRAY)
+            del warped
+            return self.encode(self.threshold(gray)), reading
+        return self.encode(warped), reading
+
+    def encode(self, result):
+        """Encodes a processed image for sending in output_format (see the constructor)."""
+        return self._traced("encode", self._encode, result)
+
+    def _encode(self, result):
+        if self.output_format is not None:
+            return scan_encoders.encode(result, self.output_format, self.jpeg_target_bytes)
+
         # Use higher quality JPEG encoding or PNG for lossless compression
         if self.preserve_quality:
             # Use PNG for lossless compression when preserving quality
@@ -335,6 +627,105 @@ class DocScanner(object):
         
         return buffer.tobytes()
 
+VALID_FORMATS = [".jpg", ".jpeg", ".jp2", ".png", ".bmp", ".tiff", ".tif"]
+
+def iter_images(directory, recursive=False):
+    """Yields image paths from the directory as they are listed, without building a list."""
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if recursive:
+                    yield from iter_images(entry.path, recursive)
+            elif os.path.splitext(entry.name)[1].lower() in VALID_FORMATS:
+                yield entry.path
+
+def output_path_for(image_path, input_dir, output_dir, output_format):
+    """Mirrors the input layout under output_dir, changing the extension if requested."""
+    relative = os.path.relpath(image_path, input_dir)
+    root, ext = os.path.splitext(relative)
+    return os.path.join(output_dir, root + ("." + output_format if output_format else ext))
+
+# Scanner of a batch worker process
+_batch_scanner = None
+
+def _init_batch_worker(options):
+    global _batch_scanner
+    # the pool provides the parallelism, so keep each worker single-threaded
+    cv2.setNumThreads(1)
+    _batch_scanner = DocScanner(**options)
+
+def _scan_batch_item(image_path, output_path):
+    started = time.perf_counter()
+    record = {"image": image_path, "output": output_path}
+    try:
+        nparr = np.fromfile(image_path, np.uint8)
+        write_image(output_path, _batch_scanner._process_image(*_batch_scanner._decode_for_scan(nparr)))
+        record["stage"] = _batch_scanner.last_stage
+    except Exception as e:
+        record["error"] = "%s: %s" % (type(e).__name__, e)
+    record["seconds"] = round(time.perf_counter() - started, 4)
+    return record
+
+def run_batch(input_dir, output_dir, output_format=None, workers=None, resume=False,
+              recursive=False, summary_path=None, options=None):
+    """
+    Scans every image under input_dir with a pool of worker processes and writes a
+    JSON summary. Directory entries are streamed and at most a few images per worker
+    are in flight, so memory use does not depend on the size of the archive.
+    """
+    workers = workers or os.cpu_count() or 1
+    summary_path = summary_path or os.path.join(output_dir, "summary.json")
+    started = time.time()
+    records = []
+    skipped = failed = 0
+
+    def report_progress(final=False):
+        elapsed = time.time() - started
+        done = len(records)
+        rate = done / elapsed if elapsed else 0.0
+        sys.stderr.write("\rScanned %d, failed %d, skipped %d (%.1f img/s)" % (done, failed, skipped, rate))
+        if final:
+            sys.stderr.write("\n")
+        sys.stderr.flush()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker,
+                             initargs=(options or {},)) as executor:
+        pending = set()
+        for image_path in iter_images(input_dir, recursive):
+            output_path = output_path_for(image_path, input_dir, output_dir, output_format)
+            if resume and os.path.exists(output_path):
+                skipped += 1
+                continue
+            pending.add(executor.submit(_scan_batch_item, image_path, output_path))
+            if len(pending) >= workers * 4:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    records.append(future.result())
+                    failed += "error" in records[-1]
+                report_progress()
+        for future in pending:
+            records.append(future.result())
+            failed += "error" in records[-1]
+    report_progress(final=True)
+
+    seconds = [record["seconds"] for record in records if "error" not in record]
+    summary = {
+        "input_dir": input_dir,
+        "output_dir": output_dir,
+        "workers": workers,
+        "scanned": len(records) - failed,
+        "failed": failed,
+        "skipped": skipped,
+        "total_seconds": round(time.time() - started, 2),
+        "mean_image_seconds": round(sum(seconds) / len(seconds), 4) if seconds else None,
+        "stages": dict(Counter(record.get("stage") for record in records if "error" not in record)),
+        "images": records,
+    }
+    os.makedirs(os.path.dirname(summary_path) or ".", exist_ok=True)
+    with open(summary_path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    return summary
+
 
 if __name__ == "__main__":
     ap = argparse.ArgumentParser()
@@ -343,24 +734,47 @@ if __name__ == "__main__":
     group.add_argument("--image", help="Path to single image to be scanned")
     ap.add_argument("-i", action='store_true',
         help = "Flag for manually verifying and/or setting document corners")
+    ap.add_argument("-o", "--output", default="output",
+        help = "Directory for scanned images (created if missing). Defaults to 'output'")
+    ap.add_argument("--format", choices=["png", "jpg", "tif", "webp"],
+        help = "Output image format. Defaults to the format of each input image")
+    ap.add_argument("-w", "--workers", type=int,
+        help = "Number of worker processes for --images. Defaults to the number of CPU cores")
+    ap.add_argument("-r", "--recursive", action='store_true',
+        help = "Also scan images in subdirectories of --images")
+    ap.add_argument("--resume", action='store_true',
+        help = "Skip images whose output file already exists")
+    ap.add_argument("--summary",
+        help = "Path of the JSON summary for --images. Defaults to <output>/summary.json")
+    ap.add_argument("--color", action='store_true',
+        help = "Keep the warped color image instead of the black and white filter")
+    ap.add_argument("--line-detector", choices=sorted(line_detectors.DETECTORS), default="pylsd",
+        help = "Line segment detector used to find the document corners")
 
     args = vars(ap.parse_args())
     im_dir = args["images"]
     im_file_path = args["image"]
     interactive_mode = args["i"]
-
-    scanner = DocScanner(interactive_mode)
-
-    valid_formats = [".jpg", ".jpeg", ".jp2", ".png", ".bmp", ".tiff", ".tif"]
-
-    get_ext = lambda f: os.path.splitext(f)[1].lower()
+    options = {"apply_filters": not args["color"], "line_detector": args["line_detector"]}
 
     # Scan single image specified by command line argument --image <IMAGE_PATH>
     if im_file_path:
-        scanner.scan(im_file_path)
+        scanner = DocScanner(interactive_mode, **options)
+        output_path = output_path_for(im_file_path, os.path.dirname(im_file_path), args["output"], args["format"])
+        scanner.scan(im_file_path, output_path)
+
+    # Scan images one by one in this process, so corners can be adjusted interactively
+    elif interactive_mode:
+        scanner = DocScanner(interactive_mode, **options)
+        for im in iter_images(im_dir, args["recursive"]):
+            output_path = output_path_for(im, im_dir, args["output"], args["format"])
+            if not (args["resume"] and os.path.exists(output_path)):
+                scanner.scan(im, output_path)
 
     # Scan all valid images in directory specified by command line argument --images <IMAGE_DIR>
     else:
-        im_files = [f for f in os.listdir(im_dir) if get_ext(f) in valid_formats]
-        for im in im_files:
-            scanner.scan(im_dir + '/' + im)
+        summary = run_batch(im_dir, args["output"], args["format"], args["workers"], args["resume"],
+                            args["recursive"], args["summary"], options)
+        print("Scanned %d images in %.1f s (%d failed, %d skipped), summary: %s" % (
+            summary["scanned"], summary["total_seconds"], summary["failed"], summary["skipped"],
+            args["summary"] or os.path.join(args["output"], "summary.json")))
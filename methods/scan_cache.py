@@ -0,0 +1,174 @@
+"""
+Cache of finished scans, so a photo sent again is neither downloaded,
+scanned nor uploaded again.
+
+Entries are keyed by the Telegram file_unique_id of the photo (see
+photo_key) or by a hash of the image for web app uploads (content_key).
+Each one keeps the processed output on disk, the Telegram file_id of the
+document it was sent as, and any extra fields (e.g. the OMR reading).
+The disk part is evicted least recently used first to stay within a byte
+budget; the most recently used outputs are also kept in memory.
+"""
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from config import SCAN_CACHE_DIR, SCAN_CACHE_MAX_BYTES, SCAN_CACHE_MEMORY_BYTES
+from methods.utils import read_json_file, write_json_file
+
+logger = logging.getLogger(__name__)
+
+
+def photo_key(file_unique_id: str) -> str:
+    return f"tg:{file_unique_id}"
+
+
+def content_key(data: bytes) -> str:
+    return f"sha256:{hashlib.sha256(data).hexdigest()}"
+
+
+class ScanCache:
+    def __init__(self, directory: str = SCAN_CACHE_DIR, max_bytes: int = SCAN_CACHE_MAX_BYTES,
+                 memory_bytes: int = SCAN_CACHE_MEMORY_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        self.index_file = os.path.join(directory, "index.json")
+        # key -> entry, least recently used first
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_size = 0
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    @property
+    def size(self) -> int:
+        return sum(entry["size"] for entry in self._entries.values())
+
+    def _path(self, key: str) -> str:
+        # keys may hold characters that are not safe in file names
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + ".bin")
+
+    def _load(self) -> None:
+        entries = read_json_file(self.index_file, default_data={}).get("entries", {})
+        for key, entry in sorted(entries.items(), key=lambda item: item[1].get("used", 0)):
+            if os.path.exists(self._path(key)):
+                self._entries[key] = entry
+
+    def _save(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        write_json_file(self.index_file, {"entries": dict(self._entries)})
+
+    def _remember(self, key: str, data: bytes) -> None:
+        if len(data) > self.memory_bytes:
+            return
+        if key in self._memory:
+            self._memory_size -= len(self._memory.pop(key))
+        self._memory[key] = data
+        self._memory_size += len(data)
+        while self._memory_size > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    def _evict(self) -> None:
+        total = self.size
+        while total > self.max_bytes and self._entries:
+            key, entry = self._entries.popitem(last=False)
+            total -= entry["size"]
+            if key in self._memory:
+                self._memory_size -= len(self._memory.pop(key))
+            try:
+                os.remove(self._path(key))
+            except OSError as e:
+                logger.warning(f"Could not remove cached scan {key}: {e}")
+
+    def _drop(self, key: str) -> None:
+        """Forgets an entry whose output file is gone."""
+        if self._entries.pop(key, None) is not None:
+            self._save()
+
+    def contains(self, key: str) -> bool:
+        """Whether the output of key is cached, without reading it or counting a lookup."""
+        if key not in self._entries:
+            return False
+        if key in self._memory or os.path.exists(self._path(key)):
+            return True
+        self._drop(key)
+        return False
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """The entry for key, marked as just used, or None; also None when its output is gone."""
+        if not self.contains(key):
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry = self._entries[key]
+        # the new order is written with the next put
+        entry["used"] = time.time()
+        self._entries.move_to_end(key)
+        return entry
+
+    def peek(self, key: str) -> Optional[Dict[str, Any]]:
+        """The entry for key without counting a lookup or marking it used."""
+        return self._entries.get(key)
+
+    def read(self, key: str) -> Optional[bytes]:
+        """The cached output for key, from memory if possible."""
+        data = self._memory.get(key)
+        if data is not None:
+            self._memory.move_to_end(key)
+            return data
+        try:
+            with open(self._path(key), "rb") as f:
+                data = f.read()
+        except OSError:
+            # the file is gone, so is the entry
+            self._drop(key)
+            return None
+        self._remember(key, data)
+        return data
+
+    def put(self, key: str, data: bytes, **fields) -> bool:
+        """
+        Stores an output with extra entry fields such as filename, file_id or
+        omr. An output larger than the whole budget is not stored: False.
+        """
+        if len(data) > self.max_bytes:
+            logger.warning(f"Not caching {key}: {len(data)} bytes is over the {self.max_bytes} byte budget")
+            return False
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        with open(path + ".part", "wb") as f:
+            f.write(data)
+        os.replace(path + ".part", path)
+
+        self._entries[key] = dict(fields, size=len(data), used=time.time())
+        self._entries.move_to_end(key)
+        self._remember(key, data)
+        self._evict()
+        self._save()
+        return True
+
+    def set_file_id(self, key: str, file_id: str) -> None:
+        """Remembers the Telegram file_id the output of key was uploaded as."""
+        entry = self._entries.get(key)
+        if entry is not None and entry.get("file_id") != file_id:
+            entry["file_id"] = file_id
+            self._save()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'size': self.size,
+            'memory_entries': len(self._memory),
+            'memory_size': self._memory_size,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+scan_cache = ScanCache()
@@ -0,0 +1,153 @@
+"""
+Output encoders for scanned pages.
+
+A thresholded scan only holds black and white, so storing it as an 8-bit
+PNG wastes most of the file. The bilevel formats here pack it to one bit
+per pixel without losing anything; colour scans get a grayscale JPEG
+whose quality is chosen to fit a byte budget. encode_pdf() bundles
+several encoded scans into one PDF.
+"""
+import io
+from typing import List
+
+import cv2
+import numpy as np
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+# png: 8-bit PNG, png1: 1-bit PNG, g4: CCITT Group 4 TIFF, webp: lossless WebP,
+# jpeg: grayscale JPEG fitted to a size budget
+FORMATS = ("png", "png1", "g4", "webp", "jpeg")
+EXTENSIONS = {"png": ".png", "png1": ".png", "g4": ".tiff", "webp": ".webp", "jpeg": ".jpg"}
+
+# Formats that only hold black and white; colour scans fall back to jpeg
+BILEVEL_FORMATS = {"png1", "g4"}
+
+# zlib level of the 1-bit PNG: higher levels are several times slower for a few percent
+PNG1_COMPRESSION = 3
+
+# Quality range searched by the size-targeted JPEG encoder
+JPEG_MIN_QUALITY = 40
+JPEG_MAX_QUALITY = 95
+
+# Page width of PDF bundles: a scan of any resolution fills an A4 page
+A4_WIDTH_INCHES = 8.27
+
+
+def is_color(image: np.ndarray) -> bool:
+    return image.ndim == 3 and image.shape[2] > 1
+
+
+def output_format(fmt: str, color: bool = False) -> str:
+    """The format an image is actually written in: bilevel formats cannot hold colour."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown scan output format: {fmt}")
+    if color and fmt in BILEVEL_FORMATS:
+        return "jpeg"
+    if fmt == "g4" and not PIL_AVAILABLE:
+        return "png1"
+    return fmt
+
+
+def extension(fmt: str, color: bool = False) -> str:
+    return EXTENSIONS[output_format(fmt, color)]
+
+
+def _encode_png1(image: np.ndarray) -> bytes:
+    ok, buffer = cv2.imencode(".png", image, [cv2.IMWRITE_PNG_BILEVEL, 1, cv2.IMWRITE_PNG_COMPRESSION, PNG1_COMPRESSION])
+    if not ok:
+        raise ValueError("Could not encode 1-bit PNG")
+    return buffer.tobytes()
+
+
+def _encode_g4(image: np.ndarray) -> bytes:
+    # OpenCV only writes 8-bit TIFFs, which Group 4 does not support
+    height, width = image.shape[:2]
+    packed = np.packbits(image > 127, axis=1)
+    buffer = io.BytesIO()
+    Image.frombytes("1", (width, height), packed.tobytes()).save(buffer, "TIFF", compression="group4")
+    return buffer.getvalue()
+
+
+def _encode_webp(image: np.ndarray) -> bytes:
+    # quality above 100 selects lossless WebP
+    ok, buffer = cv2.imencode(".webp", image, [cv2.IMWRITE_WEBP_QUALITY, 101])
+    if not ok:
+        raise ValueError("Could not encode WebP")
+    return buffer.tobytes()
+
+
+def _encode_jpeg(image: np.ndarray, target_bytes: int) -> bytes:
+    """
+    Grayscale JPEG of the highest quality that fits target_bytes, found by a
+    binary search; a page that does not fit even at the lowest quality is
+    scaled down to fit.
+    """
+    if is_color(image):
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+    def at_quality(img, quality):
+        return cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])[1]
+
+    best = at_quality(image, JPEG_MIN_QUALITY)
+    if best.size > target_bytes:
+        scale = (target_bytes / best.size) ** 0.5 * 0.95
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        best = at_quality(image, JPEG_MIN_QUALITY)
+
+    low, high = JPEG_MIN_QUALITY + 1, JPEG_MAX_QUALITY
+    while low <= high:
+        quality = (low + high) // 2
+        candidate = at_quality(image, quality)
+        if candidate.size <= target_bytes:
+            best, low = candidate, quality + 1
+        else:
+            high = quality - 1
+    return best.tobytes()
+
+
+def encode(image: np.ndarray, fmt: str = "png", target_bytes: int = 300_000) -> bytes:
+    """Encodes a scanned page in the given format, see output_format() for fallbacks."""
+    fmt = output_format(fmt, is_color(image))
+    if fmt == "png1":
+        return _encode_png1(image)
+    if fmt == "g4":
+        return _encode_g4(image)
+    if fmt == "webp":
+        return _encode_webp(image)
+    if fmt == "jpeg":
+        return _encode_jpeg(image, target_bytes)
+    return cv2.imencode(".png", image)[1].tobytes()
+
+
+def _pdf_page(data: bytes) -> "Image.Image":
+    image = Image.open(io.BytesIO(data))
+    if image.mode == "1":
+        return image
+    image = image.convert("L")
+    # thresholded scans stored as 8-bit images are still black and white
+    colors = image.getcolors(2)
+    if colors and {color for _, color in colors} <= {0, 255}:
+        image = image.convert("1")
+    return image
+
+
+def encode_pdf(pages: List[bytes]) -> bytes:
+    """
+    One PDF with a page per encoded scan (in any of FORMATS). Black and white
+    pages are stored with CCITT Group 4 compression when Pillow has libtiff,
+    the others as JPEG. Requires Pillow (see PIL_AVAILABLE).
+    """
+    if not pages:
+        raise ValueError("No pages to bundle")
+    buffer = io.BytesIO()
+    # one page at a time: save_all would give every page the resolution of
+    # the first, and pages scanned at other sizes the wrong physical size
+    for index, page in enumerate(pages):
+        image = _pdf_page(page)
+        image.save(buffer, "PDF", append=index > 0, resolution=image.width / A4_WIDTH_INCHES)
+    return buffer.getvalue()
@@ -0,0 +1,444 @@
+import asyncio
+import html
+import logging
+import multiprocessing
+import os
+import time
+import traceback
+from bisect import bisect_left
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import resource_tracker
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from aiogram import Router, types
+from aiogram.filters import Command
+
+from config import SCAN_WORKERS, SCAN_QUEUE_SIZE, SCAN_PER_USER_LIMIT, SCAN_OUTPUT_FORMAT, SCAN_JPEG_TARGET_BYTES, \
+    SCAN_QUALITY_GATE, SCAN_GLARE_GATE, SCAN_LINE_DETECTOR
+from methods import scan_encoders, scan_quality
+from methods.admins import is_admin
+from methods.scan_cache import scan_cache
+from methods.scan_quality import PhotoQualityError
+from methods.shared_buffers import SharedBuffer
+from methods.omr import OmrResult
+
+logger = logging.getLogger(__name__)
+
+router = Router()
+
+
+class ScanQueueFull(Exception):
+    """Raised when the scan queue is at capacity."""
+
+
+class ScanUserLimit(Exception):
+    """Raised when a user already has the maximum number of scans in flight."""
+
+
+# Worker process state: one DocScanner per option set
+_worker_scanners: Dict[Tuple, Any] = {}
+
+# Upper bounds of the stage time histogram buckets, in milliseconds
+STAGE_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+def _init_worker() -> None:
+    """Preload OpenCV and pylsd so the first scan in a worker pays no import cost."""
+    import cv2
+    from methods import scan  # noqa: F401
+
+    # the pool provides the parallelism, so keep each worker single-threaded
+    cv2.setNumThreads(1)
+
+
+def _warm_up() -> int:
+    return os.getpid()
+
+
+def _scan_in_worker(image: Union[bytes, Tuple[str, int]], options: Dict[str, Any], read_marks: bool = False):
+    """
+    Returns the scan result, the stage trace of the scan and the quality
+    measurements of the photo (None without the quality gate). The photo is
+    given as bytes or as the handle of a SharedBuffer, which is read in place.
+    The output comes back as bytes: it is a fraction of the photo's size, and
+    a segment of its own would cost the same copies while leaking whenever
+    the awaiting handler is cancelled.
+    """
+    from methods.scan import DocScanner, ScanTrace
+
+    key = tuple(sorted(options.items()))
+    scanner = _worker_scanners.get(key)
+    if scanner is None:
+        scanner = _worker_scanners[key] = DocScanner(**options)
+    scanner.tracer = trace = ScanTrace()
+    scanner.last_quality = None
+
+    shared = None
+    if isinstance(image, tuple):
+        shared = SharedBuffer.attach(image)
+        image = shared.view()
+    try:
+        result = scanner.scan_sheet_bytes(image) if read_marks else scanner.scan_bytes(image)
+    except Exception as e:
+        if shared is not None:
+            # the scanner's frames in the traceback still hold arrays over the
+            # shared photo, which would keep the segment from being detached
+            traceback.clear_frames(e.__traceback__)
+        raise
+    finally:
+        if shared is not None:
+            image.release()
+            shared.close()
+    return result, trace.records, scanner.last_quality
+
+
+def _bundle_in_worker(pages: List[bytes]):
+    """Returns the pages bundled into one PDF and the trace of the bundling."""
+    started = time.perf_counter()
+    pdf = scan_encoders.encode_pdf(pages)
+    return pdf, [("pdf", time.perf_counter() - started, (len(pages),))]
+
+
+class StageStats:
+    """
+    Time histograms of the DocScanner stages of the scans done by the pool,
+    so it is visible where scan time goes on real photos.
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        self.scans = 0
+
+    def add(self, records: List[Tuple[str, float, Optional[Tuple]]], scan: bool = True) -> None:
+        """Adds the trace of a job; scan is False for jobs other than scans, e.g. PDF bundles."""
+        if scan:
+            self.scans += 1
+        for stage, seconds, size in records:
+            entry = self.stages.get(stage)
+            if entry is None:
+                entry = self.stages[stage] = {
+                    'buckets': [0] * (len(STAGE_BUCKETS_MS) + 1),
+                    'count': 0,
+                    'total': 0.0,
+                    'max': 0.0,
+                    'size': None,
+                }
+            ms = seconds * 1000
+            entry['buckets'][bisect_left(STAGE_BUCKETS_MS, ms)] += 1
+            entry['count'] += 1
+            entry['total'] += ms
+            entry['max'] = max(entry['max'], ms)
+            if size is not None:
+                entry['size'] = size
+
+    def percentile(self, stage: str, q: float) -> float:
+        """Upper bound of the histogram bucket holding the q-th percentile, in milliseconds."""
+        entry = self.stages[stage]
+        rank = entry['count'] * q / 100
+        seen = 0
+        for bound, count in zip(STAGE_BUCKETS_MS, entry['buckets']):
+            seen += count
+            if seen >= rank:
+                return bound
+        return entry['max']
+
+    def reset(self) -> None:
+        self.stages.clear()
+        self.scans = 0
+
+    def format(self) -> str:
+        total = sum(entry['total'] for entry in self.stages.values()) or 1.0
+        lines = [f"{'stage':<14} {'n':>5} {'mean':>7} {'p50≤':>6} {'p95≤':>6} {'max':>7} {'share':>6}  size"]
+        # the most expensive stages first
+        for stage, entry in sorted(self.stages.items(), key=lambda item: item[1]['total'], reverse=True):
+            size = "x".join(map(str, entry['size'])) if entry['size'] else ""
+            lines.append(
+                f"{stage:<14} {entry['count']:>5} {entry['total'] / entry['count']:>7.1f} "
+                f"{self.percentile(stage, 50):>6} {self.percentile(stage, 95):>6} "
+                f"{entry['max']:>7.1f} {entry['total'] / total:>6.0%}  {size}"
+            )
+        return "\n".join(lines)
+
+
+stage_stats = StageStats()
+
+
+def _mp_context():
+    # not fork: by the time the pool (re)starts the bot has threads (asyncio.to_thread),
+    # and a child forked from it may inherit a held lock. Workers fork from a fresh,
+    # single-threaded server that has done the heavy imports once; spawn elsewhere
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["cv2", "methods.scan"])
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+class ScanPool:
+    """
+    Runs DocScanner in worker processes so scans never block the event loop.
+
+    At most `workers` scans run at once; up to `queue_size` more may wait for
+    a free worker, and further requests are rejected with ScanQueueFull. A
+    single user may have at most `per_user` scans queued or running.
+    """
+
+    def __init__(self, workers: int = SCAN_WORKERS, queue_size: int = SCAN_QUEUE_SIZE,
+                 per_user: int = SCAN_PER_USER_LIMIT):
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.per_user = per_user
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._slots = asyncio.Semaphore(self.workers)
+        self._user_scans: Counter = Counter()
+        self.waiting = 0
+        self.running = 0
+        self.max_depth = 0
+        self.completed = 0
+        self.failed = 0
+        self.bundles = 0
+        self.rejected = 0
+        self.bad_photos = 0
+        # photos the shadow quality checks would have rejected, by problem
+        self.shadow_rejects: Counter = Counter()
+        self.wait_time = 0.0
+        self.run_time = 0.0
+        self.output_bytes = 0
+
+    @property
+    def depth(self) -> int:
+        return self.waiting + self.running
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            if os.name == "posix":
+                # started before the workers, so they share it with the bot: shared
+                # memory created in one process and removed in another stays tracked
+                resource_tracker.ensure_running()
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=_mp_context(),
+                initializer=_init_worker,
+            )
+        return self._executor
+
+    async def start(self) -> None:
+        """Spawn and warm up every worker ahead of the first scan."""
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        pids = await asyncio.gather(*(loop.run_in_executor(executor, _warm_up) for _ in range(self.workers)))
+        logger.info(f"Scan pool ready with {len(set(pids))} worker(s)")
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _run(self, func, *args, user_id: Optional[int] = None):
+        """Runs func(*args) in a worker, within the queue and per-user limits; returns its result."""
+        if self.waiting >= self.queue_size:
+            self.rejected += 1
+            raise ScanQueueFull()
+        if user_id is not None and self._user_scans[user_id] >= self.per_user:
+            self.rejected += 1
+            raise ScanUserLimit()
+
+        self._user_scans[user_id] += 1
+        self.waiting += 1
+        self.max_depth = max(self.max_depth, self.depth)
+        queued_at = time.monotonic()
+        queued = True
+        try:
+            async with self._slots:
+                self.waiting -= 1
+                queued = False
+                self.running += 1
+                started = time.monotonic()
+                self.wait_time += started - queued_at
+                try:
+                    loop = asyncio.get_running_loop()
+                    return await loop.run_in_executor(self._get_executor(), func, *args)
+                except BrokenProcessPool:
+                    # a worker died (e.g. out of memory); start a fresh pool for the next scans
+                    logger.error("Scan worker crashed, restarting the pool")
+                    self.shutdown()
+                    self.failed += 1
+                    raise
+                except PhotoQualityError:
+                    # not a failure of the scanner: the user is asked for a better photo
+                    self.bad_photos += 1
+                    raise
+                except Exception:
+                    self.failed += 1
+                    raise
+                finally:
+                    self.running -= 1
+                    self.run_time += time.monotonic() - started
+        finally:
+            if queued:
+                self.waiting -= 1
+            self._user_scans[user_id] -= 1
+            if self._user_scans[user_id] <= 0:
+                del self._user_scans[user_id]
+
+    async def scan(self, image: Union[bytes, SharedBuffer], user_id: Optional[int] = None, read_marks: bool = False,
+                   **options):
+        """
+        Scans a photo given as bytes or in a SharedBuffer; the latter reaches
+        the worker without pickled copies. The caller keeps ownership of the
+        buffer.
+        """
+        if isinstance(image, SharedBuffer):
+            image = image.handle()
+        result, trace, quality = await self._run(_scan_in_worker, image, options, read_marks, user_id=user_id)
+        self.completed += 1
+        if quality is not None and quality.shadow:
+            self.shadow_rejects.update(quality.shadow)
+            logger.info(
+                f"Photo would be rejected for {', '.join(quality.shadow)}: sharpness {quality.sharpness:.0f}, "
+                f"glare {quality.glare:.3f}, brightness {quality.brightness:.0f}, page {quality.page_ratio:.2f}"
+            )
+        self.output_bytes += len(result[0] if isinstance(result, tuple) else result)
+        stage_stats.add(trace)
+        return result
+
+    async def bundle(self, pages: List[bytes], user_id: Optional[int] = None) -> bytes:
+        """Bundles encoded scans into one PDF, see scan_encoders.encode_pdf."""
+        pdf, trace = await self._run(_bundle_in_worker, pages, user_id=user_id)
+        self.bundles += 1
+        stage_stats.add(trace, scan=False)
+        return pdf
+
+    def stats(self) -> Dict[str, Any]:
+        finished = self.completed + self.failed + self.bundles
+        return {
+            'workers': self.workers,
+            'waiting': self.waiting,
+            'running': self.running,
+            'max_depth': self.max_depth,
+            'completed': self.completed,
+            'failed': self.failed,
+            'bundles': self.bundles,
+            'rejected': self.rejected,
+            'bad_photos': self.bad_photos,
+            'shadow_rejects': dict(self.shadow_rejects),
+            'avg_wait': self.wait_time / finished if finished else 0.0,
+            'avg_run': self.run_time / finished if finished else 0.0,
+            'avg_output_kb': self.output_bytes / self.completed / 1024 if self.completed else 0.0,
+        }
+
+
+scan_pool = ScanPool()
+
+
+def scan_filename(apply_filters: bool = True) -> str:
+    """File name for a scan encoded in SCAN_OUTPUT_FORMAT."""
+    return "scan" + scan_encoders.extension(SCAN_OUTPUT_FORMAT, color=not apply_filters)
+
+
+def _quality_shadow() -> Tuple[str, ...]:
+    """Quality checks that are measured but do not reject photos yet."""
+    return () if SCAN_GLARE_GATE else (scan_quality.GLARE,)
+
+
+async def scan_bytes_async(image: Union[bytes, SharedBuffer], user_id: Optional[int] = None,
+                           preserve_quality: bool = True, apply_filters: bool = True) -> bytes:
+    """
+    Async counterpart of DocScanner.scan_bytes, executed in the scan pool.
+    The result is encoded in SCAN_OUTPUT_FORMAT, see scan_filename(). With
+    SCAN_QUALITY_GATE, unusable photos raise scan_quality.PhotoQualityError;
+    glare only does with SCAN_GLARE_GATE and is otherwise just counted.
+    Pass the photo in a SharedBuffer to spare the copies of pickling it.
+    """
+    return await scan_pool.scan(
+        image,
+        user_id=user_id,
+        preserve_quality=preserve_quality,
+        apply_filters=apply_filters,
+        output_format=SCAN_OUTPUT_FORMAT,
+        jpeg_target_bytes=SCAN_JPEG_TARGET_BYTES,
+        quality_gate=SCAN_QUALITY_GATE,
+        quality_shadow=_quality_shadow(),
+        line_detector=SCAN_LINE_DETECTOR,
+    )
+
+
+async def scan_sheet_async(image: Union[bytes, SharedBuffer], user_id: Optional[int] = None,
+                           preserve_quality: bool = True, apply_filters: bool = True) -> Tuple[bytes, OmrResult]:
+    """Async counterpart of DocScanner.scan_sheet_bytes: the scan and the marks read from it."""
+    return await scan_pool.scan(
+        image,
+        user_id=user_id,
+        read_marks=True,
+        preserve_quality=preserve_quality,
+        apply_filters=apply_filters,
+        output_format=SCAN_OUTPUT_FORMAT,
+        jpeg_target_bytes=SCAN_JPEG_TARGET_BYTES,
+        quality_gate=SCAN_QUALITY_GATE,
+        quality_shadow=_quality_shadow(),
+        line_detector=SCAN_LINE_DETECTOR,
+    )
+
+
+async def bundle_pdf_async(pages: List[bytes], user_id: Optional[int] = None) -> bytes:
+    """Bundles encoded scans into one multi-page PDF in the scan pool."""
+    return await scan_pool.bundle(pages, user_id=user_id)
+
+
+@router.message(Command("scan_pool"))
+async def cmd_scan_pool(message: types.Message):
+    if not is_admin(message.from_user.id):
+        await message.answer("У вас нет прав для выполнения этой команды.")
+        return
+
+    stats = scan_pool.stats()
+    cache = scan_cache.stats()
+    await message.answer(
+        f"🖨 Пул сканирования\n\n"
+        f"Процессов: {stats['workers']}\n"
+        f"В очереди: {stats['waiting']}, выполняется: {stats['running']}\n"
+        f"Максимальная глубина очереди: {stats['max_depth']}\n"
+        f"Готово: {stats['completed']}, ошибок: {stats['failed']}, отклонено: {stats['rejected']}\n"
+        f"Плохих фото: {stats['bad_photos']}, PDF собрано: {stats['bundles']}\n"
+        f"Отклонила бы проверка в тестовом режиме: "
+        f"{', '.join(f'{problem} {count}' for problem, count in stats['shadow_rejects'].items()) or 'нет'}\n"
+        f"Среднее ожидание: {stats['avg_wait']:.2f} сек.\n"
+        f"Среднее время скана: {stats['avg_run']:.2f} сек.\n"
+        f"Средний размер скана: {stats['avg_output_kb']:.0f} КБ ({SCAN_OUTPUT_FORMAT})\n"
+        f"Кэш: {cache['entries']} сканов, {cache['size'] / 1024 / 1024:.1f} МБ "
+        f"(в памяти {cache['memory_entries']}), попаданий {cache['hit_rate']:.0%}"
+    )
+
+
+@router.message(Command("scan_stages"))
+async def cmd_scan_stages(message: types.Message):
+    if not is_admin(message.from_user.id):
+        await message.answer("У вас нет прав для выполнения этой команды.")
+        return
+
+    parts = message.text.split(maxsplit=1)
+    if len(parts) > 1 and parts[1].strip() == "reset":
+        stage_stats.reset()
+        await message.answer("Статистика этапов сканирования сброшена.")
+        return
+    if not stage_stats.scans:
+        await message.answer("Сканов пока не было.")
+        return
+
+    await message.answer(
+        f"⏱ Этапы сканирования за {stage_stats.scans} скан(ов), время в мс\n\n"
+        f"<pre>{html.escape(stage_stats.format())}</pre>",
+        parse_mode="HTML"
+    )
+
+
+@router.startup()
+async def _on_start() -> None:
+    await scan_pool.start()
+
+
+@router.shutdown()
+async def _on_shutdown() -> None:
+    scan_pool.shutdown()
@@ -0,0 +1,134 @@
+"""
+Quality checks of a photo before it is scanned.
+
+check() measures a small thumbnail of the photo: sharpness (variance of
+the Laplacian), glare (blown-out spots on the page that wash out the ink
+under them), the mean brightness and how much of the frame the page
+covers. A photo failing any of them is not worth a full scan, so DocScanner rejects it with
+PhotoQualityError and the user is asked to take it again. Checks not yet
+trusted can run in shadow mode: measured and reported, but not rejected.
+"""
+from dataclasses import dataclass, field
+from typing import Iterable, List, Optional
+
+import cv2
+import numpy as np
+
+# Long side of the thumbnail all measurements are taken on, so the
+# thresholds do not depend on the photo resolution
+THUMBNAIL_SIDE = 512
+
+MIN_SHARPNESS = 100.0  # variance of the Laplacian of the thumbnail
+MAX_GLARE = 0.008  # share of the page covered by glare spots
+GLARE_LEVEL = 250  # gray level of a blown-out pixel
+GLARE_MARGIN = 5  # a glare spot is at least this much brighter than the paper (its median)
+GLARE_WINDOW = 31  # thumbnail pixels around a glare pixel with no ink left in them
+GLARE_MIN_SPOT = 0.002  # smaller bright spots (share of the page) are noise, not glare
+MIN_BRIGHTNESS = 60  # mean gray level
+MIN_PAGE_RATIO = 0.15  # largest bright region over the frame area
+
+# Problem codes, in the order they are reported
+BLURRY = "blurry"
+GLARE = "glare"
+DARK = "dark"
+SMALL_PAGE = "small_page"
+
+
+@dataclass
+class PhotoQuality:
+    sharpness: float
+    glare: float
+    brightness: float
+    page_ratio: float
+    problems: List[str] = field(default_factory=list)
+    # problems found by shadow checks, which do not reject the photo
+    shadow: List[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.problems
+
+
+class PhotoQualityError(Exception):
+    """Raised for photos too poor to scan; carries the PhotoQuality measurements."""
+
+    def __init__(self, quality: PhotoQuality):
+        super().__init__(quality)
+        self.quality = quality
+
+    def __str__(self):
+        return "photo rejected: " + ", ".join(self.quality.problems)
+
+
+def thumbnail(image: np.ndarray) -> np.ndarray:
+    """Grayscale copy of the image with its long side scaled to THUMBNAIL_SIDE."""
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    # averaging whole blocks is several times faster than INTER_AREA at a
+    # fractional scale; the rest of the way is less than a factor of two
+    factor = max(image.shape[:2]) // THUMBNAIL_SIDE
+    if factor > 1:
+        height, width = image.shape[0] // factor, image.shape[1] // factor
+        image = cv2.resize(image[:height * factor, :width * factor], (width, height), interpolation=cv2.INTER_AREA)
+    scale = THUMBNAIL_SIDE / max(image.shape[:2])
+    return cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_LINEAR)
+
+
+def measure_glare(gray: np.ndarray, page: Optional[np.ndarray]) -> float:
+    """
+    Share of the page (a contour on the thumbnail) covered by blown-out spots
+    that stand out from the paper. A white, well exposed sheet is bright all
+    over, which is not glare: only pixels brighter than the paper's median
+    by GLARE_MARGIN count, and only where the whole GLARE_WINDOW around them
+    is blown out too. Uneven light may clip the paper, but the ink on it
+    stays dark; glare adds light on top and washes the ink out. Spots
+    smaller than GLARE_MIN_SPOT of the page are noise.
+    """
+    if page is None:
+        return 0.0
+    mask = np.zeros(gray.shape, np.uint8)
+    cv2.drawContours(mask, [page], -1, 1, cv2.FILLED)
+    page_area = int(np.count_nonzero(mask))
+    if not page_area:
+        return 0.0
+    paper = float(np.median(gray[mask > 0]))
+    level = max(GLARE_LEVEL, paper + GLARE_MARGIN)
+    if level > 255:
+        return 0.0
+    # the darkest pixel around each one, so anything near ink is not glare
+    darkest = cv2.erode(gray, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (GLARE_WINDOW, GLARE_WINDOW)))
+    spots = ((darkest >= level) & (mask > 0)).astype(np.uint8)
+    _, _, stats, _ = cv2.connectedComponentsWithStats(spots, connectivity=8)
+    areas = stats[1:, cv2.CC_STAT_AREA]
+    return float(areas[areas >= GLARE_MIN_SPOT * page_area].sum()) / page_area
+
+
+def check(image: np.ndarray, shadow: Iterable[str] = ()) -> PhotoQuality:
+    """
+    Measures a decoded photo (any resolution, color or grayscale). Problems
+    listed in shadow are reported in PhotoQuality.shadow instead of problems.
+    """
+    gray = thumbnail(image)
+    sharpness = float(cv2.Laplacian(gray, cv2.CV_32F).var())
+    brightness = float(gray.mean())
+
+    # the page is the largest region brighter than its surroundings
+    _, bright = cv2.threshold(cv2.GaussianBlur(gray, (5, 5), 0), 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    contours, _ = cv2.findContours(bright, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    page = max(contours, key=cv2.contourArea, default=None)
+    page_ratio = (cv2.contourArea(page) if page is not None else 0.0) / gray.size
+    glare = measure_glare(gray, page)
+
+    problems = []
+    if sharpness < MIN_SHARPNESS and brightness >= MIN_BRIGHTNESS:
+        # a dark photo has little contrast to be sharp with; report the darkness instead
+        problems.append(BLURRY)
+    if glare > MAX_GLARE:
+        problems.append(GLARE)
+    if brightness < MIN_BRIGHTNESS:
+        problems.append(DARK)
+    if page_ratio < MIN_PAGE_RATIO:
+        problems.append(SMALL_PAGE)
+    return PhotoQuality(sharpness, glare, brightness, page_ratio,
+                        [problem for problem in problems if problem not in shadow],
+                        [problem for problem in problems if problem in shadow])
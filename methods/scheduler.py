@@ -0,0 +1,326 @@
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from aiogram import Router, types
+from aiogram.filters import Command
+
+from config import SCHEDULER_STATE_FILE, SCHEDULER_MAX_RUNNING
+from methods.admins import is_admin
+from methods.utils import read_json_file, write_json_file
+
+logger = logging.getLogger(__name__)
+
+router = Router()
+
+# What to do with runs that were due while the bot was down
+MISFIRE_SKIP = "skip"  # drop them and wait for the next regular run
+MISFIRE_RUN_ONCE = "run_once"  # run once right away, however many were missed
+
+# Upper bound on a single sleep of the scheduler loop, so clock jumps are noticed
+MAX_SLEEP = 60
+
+
+class IntervalTrigger:
+    """Fires every `seconds` seconds, counted from the previous run."""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+
+    def next_fire(self, after: datetime) -> datetime:
+        return after + timedelta(seconds=self.seconds)
+
+    def describe(self) -> str:
+        if self.seconds % 3600 == 0:
+            return f"каждые {self.seconds // 3600} ч."
+        if self.seconds % 60 == 0:
+            return f"каждые {self.seconds // 60} мин."
+        return f"каждые {self.seconds} сек."
+
+
+def _parse_cron_field(value: str, low: int, high: int) -> Set[int]:
+    """Parse one crontab field: *, */n, a, a-b, a-b/n and comma-separated lists."""
+    result = set()
+    for part in str(value).split(","):
+        step = 1
+        if "/" in part:
+            part, step_text = part.split("/", 1)
+            step = int(step_text)
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start, end = (int(bound) for bound in part.split("-", 1))
+        else:
+            start = end = int(part)
+        if start < low or end > high or start > end or step < 1:
+            raise ValueError(f"Invalid cron field: {value}")
+        result.update(range(start, end + 1, step))
+    return result
+
+
+class CronTrigger:
+    """
+    Fires at wall-clock times matching crontab-like fields.
+    day_of_week uses Python numbering: 0 is Monday.
+    """
+
+    def __init__(self, minute: str = "0", hour: str = "*", day: str = "*", day_of_week: str = "*"):
+        self.expression = f"{minute} {hour} {day} * {day_of_week}"
+        self.minutes = sorted(_parse_cron_field(minute, 0, 59))
+        self.hours = sorted(_parse_cron_field(hour, 0, 23))
+        self.days = _parse_cron_field(day, 1, 31)
+        self.days_of_week = _parse_cron_field(day_of_week, 0, 6)
+
+    def next_fire(self, after: datetime) -> datetime:
+        start = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        for day_offset in range(366):
+            date = start.date() + timedelta(days=day_offset)
+            if date.day not in self.days or date.weekday() not in self.days_of_week:
+                continue
+            for hour in self.hours:
+                for minute in self.minutes:
+                    candidate = datetime(date.year, date.month, date.day, hour, minute)
+                    if candidate >= start:
+                        return candidate
+        raise ValueError(f"Cron expression never fires: {self.expression}")
+
+    def describe(self) -> str:
+        return f"cron {self.expression}"
+
+
+@dataclass
+class Job:
+    """A scheduled coroutine together with its run state."""
+    name: str
+    func: Callable[[], Awaitable[Any]]
+    trigger: Any
+    jitter: float = 0
+    max_instances: int = 1
+    misfire: str = MISFIRE_SKIP
+    misfire_grace: float = 60
+    next_run: Optional[datetime] = None
+    last_run: Optional[str] = None
+    last_status: Optional[str] = None
+    last_error: Optional[str] = None
+    last_duration: Optional[float] = None
+    runs: int = 0
+    failures: int = 0
+    skipped: int = 0
+    running: int = 0
+
+    def state(self) -> Dict[str, Any]:
+        return {
+            'next_run': self.next_run.isoformat() if self.next_run else None,
+            'last_run': self.last_run,
+            'last_status': self.last_status,
+            'last_error': self.last_error,
+            'last_duration': self.last_duration,
+            'runs': self.runs,
+            'failures': self.failures,
+            'skipped': self.skipped,
+        }
+
+
+class Scheduler:
+    """
+    Runs registered background jobs on interval or cron triggers.
+
+    Next-run times and run statistics are stored in a JSON file, so after a
+    restart each job continues on its schedule and missed runs are handled by
+    its misfire policy instead of piling up. A job never runs more than
+    `max_instances` times concurrently, and at most SCHEDULER_MAX_RUNNING jobs
+    run at once in total.
+    """
+
+    def __init__(self, state_file: str = SCHEDULER_STATE_FILE, max_running: int = SCHEDULER_MAX_RUNNING):
+        self.state_file = state_file
+        self.jobs: Dict[str, Job] = {}
+        self._saved_state: Optional[Dict[str, Dict]] = None
+        self._semaphore = asyncio.Semaphore(max_running)
+        self._wakeup = asyncio.Event()
+        self._loop_task: Optional[asyncio.Task] = None
+        self._job_tasks: Set[asyncio.Task] = set()
+
+    def add_job(self, name: str, func: Callable[[], Awaitable[Any]], trigger, jitter: float = 0,
+                max_instances: int = 1, misfire: str = MISFIRE_SKIP, misfire_grace: float = 60) -> Job:
+        """Register a job, restoring its persisted state. Re-adding a name replaces the job."""
+        if self._saved_state is None:
+            self._saved_state = read_json_file(self.state_file, default_data={})
+        job = Job(name, func, trigger, jitter, max_instances, misfire, misfire_grace)
+        saved = self._saved_state.get(name, {})
+        for key in ('last_run', 'last_status', 'last_error', 'last_duration', 'runs', 'failures', 'skipped'):
+            if key in saved:
+                setattr(job, key, saved[key])
+        job.next_run = self._first_run(job, saved.get('next_run'))
+        self.jobs[name] = job
+        self._save_state()
+        self._wakeup.set()
+        return job
+
+    def _schedule_after(self, job: Job, moment: datetime) -> datetime:
+        next_run = job.trigger.next_fire(moment)
+        if job.jitter:
+            next_run += timedelta(seconds=random.uniform(0, job.jitter))
+        return next_run
+
+    def _first_run(self, job: Job, saved_next_run: Optional[str]) -> datetime:
+        now = datetime.now()
+        if not saved_next_run:
+            return self._schedule_after(job, now)
+        try:
+            next_run = datetime.fromisoformat(saved_next_run)
+        except ValueError:
+            return self._schedule_after(job, now)
+        if next_run >= now:
+            # the trigger may have been changed to fire sooner since the state was saved
+            return min(next_run, self._schedule_after(job, now))
+        if (now - next_run).total_seconds() <= job.misfire_grace:
+            return next_run
+        if job.misfire == MISFIRE_RUN_ONCE:
+            logger.info(f"Job {job.name} missed its run at {next_run}, running it now")
+            return now
+        logger.info(f"Job {job.name} missed its run at {next_run}, skipping to the next one")
+        return self._schedule_after(job, now)
+
+    def _save_state(self) -> None:
+        state = dict(self._saved_state or {})
+        state.update({name: job.state() for name, job in self.jobs.items()})
+        write_json_file(self.state_file, state)
+
+    def start(self) -> None:
+        if self._loop_task is None or self._loop_task.done():
+            self._loop_task = asyncio.create_task(self._run_loop())
+            logger.info(f"Scheduler started with {len(self.jobs)} job(s)")
+
+    async def stop(self) -> None:
+        tasks = list(self._job_tasks)
+        if self._loop_task:
+            tasks.append(self._loop_task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._loop_task = None
+        self._save_state()
+
+    async def _run_loop(self) -> None:
+        while True:
+            self._wakeup.clear()
+            now = datetime.now()
+            due = [job for job in self.jobs.values() if job.next_run <= now]
+            for job in due:
+                self._fire(job, now)
+            if due:
+                self._save_state()
+
+            upcoming = min((job.next_run for job in self.jobs.values()), default=None)
+            timeout = MAX_SLEEP
+            if upcoming is not None:
+                timeout = min(max((upcoming - datetime.now()).total_seconds(), 0), MAX_SLEEP)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _fire(self, job: Job, now: datetime) -> None:
+        job.next_run = self._schedule_after(job, now)
+        if job.running >= job.max_instances:
+            job.skipped += 1
+            logger.warning(f"Job {job.name} is still running, skipping this run")
+            return
+        job.running += 1
+        task = asyncio.create_task(self._execute(job))
+        self._job_tasks.add(task)
+        task.add_done_callback(self._job_tasks.discard)
+
+    async def _execute(self, job: Job) -> None:
+        try:
+            async with self._semaphore:
+                started = time.monotonic()
+                job.last_run = datetime.now().isoformat()
+                try:
+                    await job.func()
+                    job.last_status, job.last_error = "ok", None
+                except asyncio.CancelledError:
+                    job.last_status = "cancelled"
+                    raise
+                except Exception as e:
+                    job.last_status, job.last_error = "error", str(e)
+                    job.failures += 1
+                    logger.error(f"Job {job.name} failed: {e}")
+                job.runs += 1
+                job.last_duration = round(time.monotonic() - started, 3)
+        finally:
+            job.running -= 1
+            self._save_state()
+
+    def run_now(self, name: str) -> bool:
+        """Make a job due immediately. Returns False for unknown jobs."""
+        job = self.jobs.get(name)
+        if not job:
+            return False
+        job.next_run = datetime.now()
+        self._wakeup.set()
+        return True
+
+
+scheduler = Scheduler()
+
+
+def format_job(job: Job) -> str:
+    status = {"ok": "✅", "error": "❌", "cancelled": "⏹"}.get(job.last_status, "—")
+    lines = [
+        f"{status} {job.name} ({job.trigger.describe()})",
+        f"  Следующий запуск: {job.next_run.strftime('%d.%m.%Y %H:%M:%S') if job.next_run else '—'}",
+    ]
+    if job.last_run:
+        last_run = datetime.fromisoformat(job.last_run).strftime('%d.%m.%Y %H:%M:%S')
+        lines.append(f"  Последний запуск: {last_run}, {job.last_duration or 0} сек.")
+    lines.append(f"  Запусков: {job.runs}, ошибок: {job.failures}, пропущено: {job.skipped}")
+    if job.running:
+        lines.append(f"  Выполняется сейчас: {job.running}")
+    if job.last_status == "error" and job.last_error:
+        lines.append(f"  Ошибка: {job.last_error[:200]}")
+    return "\n".join(lines)
+
+
+@router.message(Command("jobs"))
+async def cmd_jobs(message: types.Message):
+    if not is_admin(message.from_user.id):
+        await message.answer("У вас нет прав для выполнения этой команды.")
+        return
+
+    if not scheduler.jobs:
+        await message.answer("Фоновых задач нет.")
+        return
+    jobs = sorted(scheduler.jobs.values(), key=lambda job: job.next_run)
+    await message.answer("⏱ Фоновые задачи:\n\n" + "\n\n".join(format_job(job) for job in jobs))
+
+
+@router.message(Command("run_job"))
+async def cmd_run_job(message: types.Message):
+    if not is_admin(message.from_user.id):
+        await message.answer("У вас нет прав для выполнения этой команды.")
+        return
+
+    parts = message.text.split(maxsplit=1)
+    if len(parts) < 2:
+        await message.answer("Использование: /run_job <имя задачи>")
+        return
+    if scheduler.run_now(parts[1].strip()):
+        await message.answer("Задача поставлена в очередь.")
+    else:
+        await message.answer("Задача не найдена.")
+
+
+@router.startup()
+async def _on_start() -> None:
+    scheduler.start()
+
+
+@router.shutdown()
+async def _on_shutdown() -> None:
+    await scheduler.stop()
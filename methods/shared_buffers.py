@@ -0,0 +1,122 @@
+"""
+Photos in shared memory, so they reach the scan worker processes without
+being pickled and copied on the way.
+
+A SharedBuffer is written like a file: download() has aiogram stream a
+Telegram file straight into one, from_base64() decodes a web app data URL
+into one. The scan pool hands the worker only the buffer's handle (its
+segment name and size) and the worker reads the photo in place. The
+caller owns the buffer and removes it, also when the scan is cancelled.
+"""
+import binascii
+from multiprocessing import shared_memory
+from typing import Optional, Tuple
+
+# Base64 characters decoded at a time by from_base64 (a multiple of 4)
+BASE64_CHUNK = 4 * 16384
+
+
+class SharedBuffer:
+    def __init__(self, capacity: int = 0, handle: Optional[Tuple[str, int]] = None, owner: bool = True):
+        """
+        A new segment of capacity bytes, or with handle the existing segment
+        it names. The owner removes the segment on close().
+        """
+        if handle is None:
+            self._shm = shared_memory.SharedMemory(create=True, size=max(1, capacity))
+            self.size = 0
+        else:
+            name, self.size = handle
+            self._shm = shared_memory.SharedMemory(name=name)
+        self.owner = owner
+
+    @classmethod
+    def attach(cls, handle: Tuple[str, int], owner: bool = False) -> "SharedBuffer":
+        return cls(handle=handle, owner=owner)
+
+    @classmethod
+    def from_bytes(cls, data, owner: bool = True) -> "SharedBuffer":
+        buffer = cls(len(data), owner=owner)
+        buffer.write(data)
+        return buffer
+
+    @classmethod
+    def from_base64(cls, text: str, start: int = 0) -> "SharedBuffer":
+        """
+        Decodes text[start:] chunk by chunk, without a decoded copy of the
+        whole image; data URLs carry no line breaks, so chunks stay aligned.
+        """
+        length = len(text) - start
+        buffer = cls(length // 4 * 3 + 3)
+        try:
+            for offset in range(start, len(text), BASE64_CHUNK):
+                buffer.write(binascii.a2b_base64(text[offset:offset + BASE64_CHUNK]))
+        except Exception:
+            buffer.close()
+            raise
+        return buffer
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    @property
+    def capacity(self) -> int:
+        return self._shm.size
+
+    def handle(self) -> Tuple[str, int]:
+        """What another process needs to attach to the buffer, see attach()."""
+        return self._shm.name, self.size
+
+    def view(self) -> memoryview:
+        """The written bytes, in place; release the view before close()."""
+        return self._shm.buf[:self.size]
+
+    def write(self, data) -> int:
+        end = self.size + len(data)
+        if end > self.capacity:
+            raise ValueError(f"SharedBuffer overflow: {end} bytes written to a {self.capacity} byte buffer")
+        self._shm.buf[self.size:end] = data
+        self.size = end
+        return len(data)
+
+    def flush(self) -> None:
+        """Nothing to flush: writes land in the segment. aiogram calls it after every chunk."""
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        """
+        Writes always append and the bytes are read through view(), so there
+        is no position to move; aiogram rewinds its destination when done.
+        """
+        return 0
+
+    def close(self) -> None:
+        """Detaches from the segment; the owner also removes it."""
+        self._shm.close()
+        if self.owner:
+            self._shm.unlink()
+
+    def __enter__(self) -> "SharedBuffer":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+async def download(bot, file, size: Optional[int] = None) -> SharedBuffer:
+    """
+    Downloads a Telegram file (an aiogram File) into a new SharedBuffer.
+    The size comes from the file or the message; when neither knows it, the
+    file is downloaded to memory first and copied.
+    """
+    size = file.file_size or size
+    if not size:
+        data = await bot.download_file(file.file_path)
+        return SharedBuffer.from_bytes(data.getbuffer())
+    buffer = SharedBuffer(size)
+    try:
+        await bot.download_file(file.file_path, destination=buffer, seek=False)
+    except Exception:
+        buffer.close()
+        raise
+    return buffer
@@ -0,0 +1,47 @@
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+
+class TrafficMonitor:
+    """Counts incoming updates in one-second buckets over a short sliding window."""
+
+    def __init__(self, window: int = 10):
+        self.window = window
+        self._counts = [0] * window
+        self._seconds = [0] * window
+
+    def hit(self) -> None:
+        second = int(time.monotonic())
+        slot = second % self.window
+        if self._seconds[slot] != second:
+            self._seconds[slot] = second
+            self._counts[slot] = 0
+        self._counts[slot] += 1
+
+    def rate(self) -> float:
+        """Average incoming updates per second over the window."""
+        now = int(time.monotonic())
+        total = sum(
+            count for second, count in zip(self._seconds, self._counts)
+            if now - second < self.window
+        )
+        return total / self.window
+
+
+traffic_monitor = TrafficMonitor()
+
+
+class TrafficMiddleware(BaseMiddleware):
+    """Outer update middleware that feeds the traffic monitor."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        traffic_monitor.hit()
+        return await handler(event, data)
@@ -2,11 +2,12 @@ import json
 import datetime
 import logging
 import re
-import asyncio
 from functools import lru_cache
 from aiogram import Router, F, types, Bot
 from config import BOT_TOKEN, OWNER_ID, GROUP_ID, DATA_FILE
 from methods.utils import read_json_file, write_json_file
+from methods.audience import UserIndex
+from methods.metrics import usage_metrics
 
 bot = Bot(token=BOT_TOKEN)
 router = Router()
@@ -15,6 +16,9 @@ router = Router()
 MUTE_DURATION = datetime.timedelta(weeks=1)
 CACHE_DURATION = 300  # 5 minutes cache for admin status
 
+# Secondary indexes over the user store, built lazily on first use
+user_index = UserIndex()
+
 # Utility function to read data from JSON file
 def read_data():
     return read_json_file(DATA_FILE, default_data={})
@@ -23,6 +27,11 @@ def read_data():
 def write_data(data):
     write_json_file(DATA_FILE, data)
 
+def get_user_index() -> UserIndex:
+    if not user_index.loaded:
+        user_index.rebuild(read_data())
+    return user_index
+
 # Function to find user data by user_id
 def find_user_data(user_id):
     data = read_data()
@@ -33,12 +42,14 @@ def update_user_data(user):
     data = read_data()
     data[str(user['user_id'])] = user
     write_data(data)
+    get_user_index().update(user)
 
 async def user_data(user_id: int):
     user = find_user_data(user_id)
     if not user:
         user = {'user_id': user_id, 'lang': 'ru', 'sub': 0, 'expire_date': None}
         update_user_data(user)
+        usage_metrics.incr("events", "new_users")
     return user
 
 async def user_lang(user_id: int):
@@ -107,6 +118,7 @@ async def remove_user(user_id):
     if str(user_id) in data:
         del data[str(user_id)]
         write_data(data)
+    get_user_index().remove(int(user_id))
 
 # On start verifies expired memberships
 async def load_jobs():
@@ -174,33 +186,24 @@ async def moderate_message(message: types.Message, entities: list):
     except Exception as e:
         logging.error(f"Moderation error: {e}")
 
-# Optimize statistics collection
+# Live counters from the user index; block status and last_seen are
+# maintained passively by methods.activity instead of probing every user
 async def get_statistics():
     try:
-        data = read_data()
-        total_users = len(data)
-        active_users = 0
-        
-        # Process users in batches to avoid rate limits
-        batch_size = 20
-        for i in range(0, total_users, batch_size):
-            batch = list(data.keys())[i:i + batch_size]
-            for user_id in batch:
-                try:
-                    await bot.send_chat_action(int(user_id), 'typing')
-                    active_users += 1
-                except:
-                    continue
-                await asyncio.sleep(0.05)  # Prevent rate limiting
-                
+        index = get_user_index()
+        total_users = len(index)
+        blocked_users = index.blocked_count()
         return {
             'total_users': total_users,
-            'active_users': active_users,
-            'blocked_users': total_users - active_users
+            'active_users': total_users - blocked_users,
+            'blocked_users': blocked_users,
+            'dau': index.seen_count(1),
+            'wau': index.seen_count(7),
+            'mau': index.seen_count(30)
         }
     except Exception as e:
         logging.error(f"Statistics error: {e}")
-        return {'total_users': 0, 'active_users': 0, 'blocked_users': 0}
+        return {'total_users': 0, 'active_users': 0, 'blocked_users': 0, 'dau': 0, 'wau': 0, 'mau': 0}
 
 @router.message(F.text == "Статистика")
 async def show_statistics(message: types.Message):
@@ -212,6 +215,9 @@ async def show_statistics(message: types.Message):
         f"📊 <b>Статистика бота:</b>\n\n"
         f"👥 Всего пользователей: {stats['total_users']}\n"
         f"✅ Активных: {stats['active_users']}\n"
-        f"❌ Заблокировали бота: {stats['blocked_users']}\n",
+        f"❌ Заблокировали бота: {stats['blocked_users']}\n\n"
+        f"📈 DAU: {stats['dau']}\n"
+        f"📈 WAU: {stats['wau']}\n"
+        f"📈 MAU: {stats['mau']}\n",
         parse_mode="HTML"
     )
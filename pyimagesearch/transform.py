@@ -30,6 +30,31 @@ def order_points(pts):
     # bottom-right, and bottom-left order
     return np.array([tl, tr, br, bl], dtype = "float32")
 
+def order_points_batch(quads):
+    # vectorized order_points for an array of quadrilaterals of
+    # shape (N, 4, 2), returning them in the same corner order
+    quads = np.asarray(quads, dtype = "float32")
+    rows = np.arange(len(quads))[:, np.newaxis]
+
+    # split each quad into its two left-most and two right-most points
+    xSorted = quads[rows, np.argsort(quads[:, :, 0], axis = 1, kind = "stable")]
+    leftMost = xSorted[:, :2]
+    rightMost = xSorted[:, 2:]
+
+    # the upper left-most point is the top-left, the other one is the
+    # bottom-left
+    leftMost = leftMost[rows, np.argsort(leftMost[:, :, 1], axis = 1, kind = "stable")]
+    tl = leftMost[:, 0]
+    bl = leftMost[:, 1]
+
+    # the right-most point farther from the top-left is the bottom-right
+    D = np.linalg.norm(rightMost - tl[:, np.newaxis], axis = 2)
+    farther = np.where(D[:, 0] > D[:, 1], 0, 1)
+    br = rightMost[rows[:, 0], farther]
+    tr = rightMost[rows[:, 0], 1 - farther]
+
+    return np.stack([tl, tr, br, bl], axis = 1)
+
 def four_point_transform(image, pts):
     # obtain a consistent order of the points and unpack them
     # individually
@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+from aiogram import Bot
+from aiogram.types import File
+
+from methods.shared_buffers import SharedBuffer, download
+
+DATA = bytes(range(256)) * 700  # several download chunks
+
+
+def make_bot(monkeypatch, data=DATA):
+    bot = Bot("42:TEST")
+
+    async def stream_content(url, timeout, chunk_size, raise_for_status):
+        for offset in range(0, len(data), chunk_size):
+            yield data[offset:offset + chunk_size]
+
+    monkeypatch.setattr(bot.session, "stream_content", stream_content)
+    return bot
+
+
+@pytest.mark.parametrize("seek", [True, False])
+def test_download_file_into_shared_buffer(monkeypatch, seek):
+    bot = make_bot(monkeypatch)
+    with SharedBuffer(len(DATA)) as buffer:
+        result = asyncio.run(bot.download_file("photos/file.jpg", destination=buffer, seek=seek))
+        assert result is buffer
+        view = buffer.view()
+        assert bytes(view) == DATA
+        view.release()
+
+
+def test_download(monkeypatch):
+    bot = make_bot(monkeypatch)
+    file = File(file_id="id", file_unique_id="unique", file_size=len(DATA), file_path="photos/file.jpg")
+    with asyncio.run(download(bot, file)) as buffer:
+        view = buffer.view()
+        assert bytes(view) == DATA
+        view.release()
+
+
+def test_download_overflow_removes_buffer(monkeypatch):
+    bot = make_bot(monkeypatch)
+    file = File(file_id="id", file_unique_id="unique", file_size=len(DATA) - 1, file_path="photos/file.jpg")
+    with pytest.raises(ValueError):
+        asyncio.run(download(bot, file))